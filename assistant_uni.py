@@ -1,148 +1,109 @@
 import os
-import re
-import glob
-import time
-import uuid
-import json
-import logging
-from typing import List, Tuple, Optional
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Tuple, Optional
 from dotenv import load_dotenv
-from pythonjsonlogger import jsonlogger
-from openai import OpenAI
-from langsmith.wrappers import wrap_openai
 
 from memory import SessionMemory
-from planner_agent import orchestrate
+from planner_agent import DOMAIN_KEYS, orchestrate, orchestrate_stream, stream_chat
+from query_analyzer import TOKEN, QueryAnalysis, QueryAnalyzer
+# la recuperación vive en retrieval.py (sin credenciales); se reexporta para el código existente
+from retrieval import (
+    CHUNKER,
+    DATA_DIR,
+    INDEX_DIR,
+    RAG_MODE,
+    corpus_fijo,
+    corpus_version,
+    formatear_contexto,
+    get_scorer,
+    recuperar_contexto,
+    recuperar_contexto_batch,
+    set_scorer,
+    _cargar_documentos,
+    _get_indice,
+)
+from response_cache import ResponseCache, bucket_for, normalizar_pregunta
+from rate_limit import MemoryBackend, RateLimiter, SQLiteBackend
+from tracing import event, log_event, new_span_id, new_trace_id, span, usage_tokens
+from llm_gateway import LLMGateway, LLMGatewayError, chat_completion
 
 load_dotenv()
 API_KEY = os.getenv("OPENAI_API_KEY")
 BASE_URL = os.getenv("OPENAI_BASE_URL")
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
-LOG_PATH = os.getenv("LOG_PATH", "logs/agent.log")
-
-if not API_KEY or not BASE_URL:
-    raise RuntimeError("Faltan OPENAI_API_KEY u OPENAI_BASE_URL en .env")
 
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+_client: Optional[LLMGateway] = None
+_init_lock = threading.Lock()
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
-os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-
-logger = logging.getLogger("agent_logger")
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    fh = logging.FileHandler(LOG_PATH, encoding="utf-8")
-    fmt = (
-        "%(asctime)s %(levelname)s %(trace_id)s %(span_id)s "
-        "%(parent_span_id)s %(role)s %(latency_ms)s %(tokens_used)s %(message)s"
-    )
-    formatter = jsonlogger.JsonFormatter(fmt)
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
-
-def new_trace_id() -> str:
-    return str(uuid.uuid4())
-
-def new_span_id() -> str:
-    return str(uuid.uuid4())[:8]
-
-def log_event(
-    trace_id: str,
-    span_id: str,
-    parent_span_id: Optional[str],
-    role: str,
-    message: str,
-    latency_ms: Optional[float] = None,
-    tokens_used: Optional[int] = None,
-    tool: Optional[str] = None,
-):
+def get_client() -> LLMGateway:
     """
-    tokens_used → si viene None, se fuerza a 0.
-    Esto es la causa de que antes vieras "0 tokens" siempre.
-    Ahora SIEMPRE se pasa tokens reales o estimados.
+    Cliente del modelo, creado en la primera llamada: importar este módulo no
+    exige credenciales. Pool HTTP, plazos, reintentos, hedging, circuit
+    breaker y cupos por etapa: ver llm_gateway.py.
     """
-    rec = {
-        "trace_id": trace_id,
-        "span_id": span_id,
-        "parent_span_id": parent_span_id,
-        "role": role,
-        "message": message,
-        "tool": tool,
-        "latency_ms": latency_ms or 0,
-        "tokens_used": int(tokens_used) if tokens_used is not None else 0,
-    }
-
-    logger.info(
-        json.dumps(rec, ensure_ascii=False),
-        extra={
-            "trace_id": trace_id,
-            "span_id": span_id,
-            "parent_span_id": parent_span_id or "",
-            "role": role,
-            "latency_ms": latency_ms or 0,
-            "tokens_used": rec["tokens_used"],
-        },
-    )
-
-
-def _tokenizar(texto: str) -> List[str]:
-    return re.findall(r"[a-záéíóúñ0-9]+", (texto or "").lower())
-
-def _chunkear(texto: str, tam: int = 800, overlap: int = 120) -> List[str]:
-    texto = re.sub(r"\s+", " ", (texto or "").strip())
-    out, i = [], 0
-    while i < len(texto):
-        out.append(texto[i : i + tam])
-        i += max(tam - overlap, 1)
-    return out
-
-def _cargar_documentos() -> List[Tuple[str, str]]:
-    docs = []
-    if not os.path.isdir(DATA_DIR):
-        return docs
-    for patron in ("*.txt", "*.md"):
-        for path in glob.glob(os.path.join(DATA_DIR, patron)):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    docs.append((os.path.basename(path), f.read()))
-            except Exception:
-                continue
-    return docs
-
-def _puntuar_chunk(pregs: List[str], chunk: str) -> int:
-    toks = _tokenizar(chunk)
-    return sum(toks.count(t) for t in pregs)
-
-def recuperar_contexto(
-    pregunta: str, top_k: int = 3, domain_hint: str = ""
-) -> List[Tuple[str, str]]:
-    documentos = _cargar_documentos()
-    if not documentos:
-        return []
-    pregs = _tokenizar(pregunta)
-    candidatos: List[Tuple[int, str, str]] = []
-    for fuente, contenido in documentos:
-        for ch in _chunkear(contenido):
-            score = _puntuar_chunk(pregs, ch)
-            if domain_hint and domain_hint in fuente.lower():
-                score += 4
-            if score > 0:
-                candidatos.append((score, fuente, ch))
-    candidatos.sort(key=lambda x: x[0], reverse=True)
-    return [(fuente, ch) for _, fuente, ch in candidatos[:top_k]]
-
-def formatear_contexto(contextos: List[Tuple[str, str]]) -> str:
-    if not contextos:
-        return "No se encontraron fragmentos relevantes en la base local."
-    partes = []
-    for fuente, frag in contextos:
-        partes.append(f"[Fuente: {fuente}]\n{frag.strip()}")
-    return "\n\n---\n\n".join(partes)
+    global _client
+    with _init_lock:
+        if _client is None:
+            if not API_KEY or not BASE_URL:
+                raise RuntimeError("Faltan OPENAI_API_KEY u OPENAI_BASE_URL en .env")
+            wrap = None
+            if os.getenv("LANGCHAIN_TRACING_V2", "").lower() == "true":
+                from langsmith.wrappers import wrap_openai as wrap
+            _client = LLMGateway(api_key=API_KEY, base_url=BASE_URL, wrap=wrap)
+        return _client
+
+def client_stats() -> Optional[Dict[str, object]]:
+    """Estadísticas del gateway si el cliente ya existe; no lo crea."""
+    return _client.stats() if _client is not None else None
+
+def __getattr__(nombre: str):
+    # `assistant_uni.client` sigue funcionando, pero el cliente se crea recién al pedirlo
+    if nombre == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
 
 SYSTEM_PROMPT = (
     "Eres un asistente universitario que responde dudas académicas. "
     "Usa el contexto RAG cuando esté disponible. "
 )
+PROMPT_VERSION = "v1-" + hashlib.sha1(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:8]
+
+# --- Caché de respuestas ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "3600"))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+RESPONSE_CACHE_DB_SIZE = int(os.getenv("RESPONSE_CACHE_DB_SIZE", "10000"))
+RESPONSE_CACHE_NEAR_DUP = os.getenv("RESPONSE_CACHE_NEAR_DUP", "")
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _init_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_entries=RESPONSE_CACHE_SIZE,
+                ttl_s=RESPONSE_CACHE_TTL_S,
+                sqlite_path=RESPONSE_CACHE_DB or None,
+                max_db_entries=RESPONSE_CACHE_DB_SIZE,
+                near_dup_threshold=float(RESPONSE_CACHE_NEAR_DUP) if RESPONSE_CACHE_NEAR_DUP else None,
+            )
+        return _response_cache
+
+def log_cache(estado: Optional[str]) -> None:
+    cache = get_response_cache()
+    if cache is None or estado is None:
+        return
+    st = cache.stats()
+    event(
+        "system",
+        f"cache_{estado} (hit_rate={st['hit_rate']:.2f}, hits={st['hits'] + st['near_hits']}, misses={st['misses']})",
+        tool="response_cache",
+    )
 
 MAX_INPUT_LENGTH = int(os.getenv("MAX_INPUT_LENGTH", "2400"))
 RATE_LIMIT_PER_MIN = int(os.getenv("RATE_LIMIT_PER_MIN", "60"))
@@ -155,27 +116,39 @@ _blocklist_patterns = [
     r"delete system prompt",
 ]
 
-_request_timestamps: List[float] = []
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", str(RATE_LIMIT_PER_MIN)))
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "")
+
+_rate_limiter: Optional[RateLimiter] = None
+
+# blocklist y palabras clave de dominio compiladas en una sola expresión
+_analizador = QueryAnalyzer(_blocklist_patterns, DOMAIN_KEYS, token=TOKEN)
+
+def analizar_consulta(pregunta: str) -> QueryAnalysis:
+    """Tokens, dominios y bloqueos de la pregunta en una pasada; se reutiliza hasta el retriever."""
+    return _analizador.analizar(pregunta)
 
 def sanitize_input(texto: str) -> Tuple[bool, Optional[str]]:
     if not texto or not texto.strip():
         return False, "Entrada vacía."
     if len(texto) > MAX_INPUT_LENGTH:
         return False, f"Entrada demasiado larga (máx {MAX_INPUT_LENGTH} caracteres)."
-    lower = texto.lower()
-    for pat in _blocklist_patterns:
-        if re.search(pat, lower):
-            return False, "Entrada rechazada por contener instrucciones no permitidas."
+    if analizar_consulta(texto).bloqueos:
+        return False, "Entrada rechazada por contener instrucciones no permitidas."
     return True, None
 
-def rate_limit_ok() -> Tuple[bool, Optional[str]]:
-    global _request_timestamps
-    ahora = time.time()
-    window_start = ahora - 60
-    _request_timestamps = [t for t in _request_timestamps if t >= window_start]
-    if len(_request_timestamps) >= RATE_LIMIT_PER_MIN:
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    with _init_lock:
+        if _rate_limiter is None:
+            backend = SQLiteBackend(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryBackend()
+            _rate_limiter = RateLimiter(RATE_LIMIT_PER_MIN, burst=RATE_LIMIT_BURST, backend=backend)
+        return _rate_limiter
+
+def rate_limit_ok(client_id: str = "global") -> Tuple[bool, Optional[str]]:
+    """Token bucket por cliente (sesión, IP...); sin client_id se comparte un balde global."""
+    if not get_rate_limiter().allow(client_id or "global"):
         return False, "Límite de tasa alcanzado."
-    _request_timestamps.append(ahora)
     return True, None
 
 def _extract_text_from_choice(choice) -> str:
@@ -212,22 +185,53 @@ def _extract_tokens_used(resp) -> Optional[int]:
     return None
 
 
-def consultar(pregunta: str, trace_id: Optional[str] = None, parent_span=None) -> str:
-    trace_id = trace_id or new_trace_id()
-    span_request = new_span_id()
-    log_event(trace_id, span_request, parent_span, "user", pregunta)
+def respuesta_degradada(pregunta: str) -> str:
+    """Respuesta sin modelo: los fragmentos más relevantes del corpus, con su fuente."""
+    contextos = recuperar_contexto(pregunta, top_k=3)
+    aviso = "El servicio del modelo no está disponible en este momento."
+    if not contextos:
+        return aviso + " Intenta de nuevo en unos minutos o valida en el sitio oficial."
+    partes = []
+    for fuente, texto in contextos:
+        texto = " ".join(texto.split())
+        partes.append(f"- [{fuente}] " + (texto[:300].rsplit(" ", 1)[0] + "…" if len(texto) > 300 else texto))
+    return (aviso + " Estos fragmentos de la normativa pueden ayudarte:\n\n" + "\n".join(partes)
+            + "\n\nValida la información en la fuente oficial.")
+
 
+def _preparar_consulta(
+    pregunta: str, client_id: Optional[str] = "global"
+) -> Tuple[Optional[str], List[dict], Optional[ResponseCache], Optional[str]]:
+    """
+    Validación, rate limit, RAG y caché. Devuelve (respuesta final si no hace
+    falta llamar al modelo, mensajes, caché, bucket de caché). Con
+    `client_id=None` no se cobra rate limit (el servidor ya lo hizo).
+    """
+    pregunta = analizar_consulta(pregunta)
     ok, err = sanitize_input(pregunta)
     if not ok:
-        log_event(trace_id, new_span_id(), span_request, "system", f"input_validation_failed: {err}")
-        return f"Entrada inválida: {err}"
+        event("system", f"input_validation_failed: {err}")
+        return f"Entrada inválida: {err}", [], None, None
 
-    ok, err = rate_limit_ok()
+    ok, err = rate_limit_ok(client_id) if client_id is not None else (True, None)
     if not ok:
-        log_event(trace_id, new_span_id(), span_request, "system", f"rate_limit: {err}")
-        return f"Rate limit: {err}"
+        event("system", f"rate_limit: {err}")
+        return f"Rate limit: {err}", [], None, None
 
     contextos = recuperar_contexto(pregunta, top_k=3)
+
+    cache = get_response_cache()
+    bucket = None
+    if cache is not None:
+        bucket = bucket_for([("", contextos)], MODEL, PROMPT_VERSION)
+        with span("cache") as sp:
+            cached = cache.get(normalizar_pregunta(pregunta), bucket)
+            sp.set(cache="hit" if cached is not None else "miss")
+        log_cache("hit" if cached is not None else "miss")
+        if cached is not None:
+            event("assistant", cached, tokens_used=0, tool="cache")
+            return cached, [], None, None
+
     bloque_contexto = formatear_contexto(contextos)
 
     user_content = (
@@ -239,50 +243,164 @@ def consultar(pregunta: str, trace_id: Optional[str] = None, parent_span=None) -
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_content},
     ]
+    return None, messages, cache, bucket
+
+
+def consultar(
+    pregunta: str, trace_id: Optional[str] = None, parent_span=None, client_id: Optional[str] = "global"
+) -> str:
+    with span("consultar", trace_id=trace_id, parent_id=parent_span) as raiz, corpus_fijo() as snap:
+        raiz.set(corpus=snap.version)
+        event("user", pregunta)
+        final, messages, cache, bucket = _preparar_consulta(pregunta, client_id)
+        if final is not None:
+            return final
+
+        try:
+            with span("llm", role="assistant", model=MODEL) as sp:
+                resp = chat_completion(
+                    get_client(),
+                    "consultar",
+                    model=MODEL,
+                    temperature=0.5,
+                    messages=messages,
+                )
+
+                text = ""
+                if hasattr(resp, "choices") and resp.choices:
+                    text = _extract_text_from_choice(resp.choices[0])
+
+                tokens_used = _extract_tokens_used(resp)
+                if tokens_used is None:
+                    tokens_used = max(20, len(text) // 4)
+                prompt, completion, _ = usage_tokens(resp)
+                sp.set(message=text, tokens_used=tokens_used, prompt_tokens=prompt, completion_tokens=completion)
+        except LLMGatewayError as e:
+            event("system", f"llm_degradado: {e}", tool="llm_gateway")
+            return respuesta_degradada(pregunta)
+        except Exception as e:
+            return f"Error al procesar la consulta: {e}"
+
+        if cache is not None and text:
+            cache.put(normalizar_pregunta(pregunta), bucket, text)
+        return text
 
-    span_call = new_span_id()
-    start = time.time()
 
-    try:
-        resp = client.chat.completions.create(
+def consultar_stream(
+    pregunta: str, trace_id: Optional[str] = None, parent_span=None, client_id: Optional[str] = "global"
+) -> Iterator[str]:
+    """
+    Igual que consultar, pero entrega el texto a medida que llega (stream=True).
+    Al terminar registra latencia total, tiempo al primer token y tokens usados.
+    """
+    with span("consultar", trace_id=trace_id, parent_id=parent_span) as raiz, corpus_fijo() as snap:
+        raiz.set(corpus=snap.version)
+        event("user", pregunta)
+        final, messages, cache, bucket = _preparar_consulta(pregunta, client_id)
+        if final is not None:
+            yield final
+            return
+
+        usage: Dict[str, object] = {}
+        partes: List[str] = []
+        try:
+            with span("llm", role="assistant", model=MODEL) as sp:
+                for delta in stream_chat(get_client(), MODEL, messages, 0.5, usage, stage="consultar"):
+                    partes.append(delta)
+                    yield delta
+                sp.set(message="".join(partes), tokens_used=usage["tokens_used"], ttft_ms=usage["ttft_ms"],
+                       prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"])
+        except LLMGatewayError as e:
+            event("system", f"llm_degradado: {e}", tool="llm_gateway")
+            yield respuesta_degradada(pregunta)
+            return
+        except Exception as e:
+            yield f"Error al procesar la consulta: {e}"
+            return
+
+        text = "".join(partes)
+        if cache is not None and text:
+            cache.put(normalizar_pregunta(pregunta), bucket, text)
+
+def orquestar_stream(
+    pregunta: str,
+    mem: SessionMemory,
+    trace_id: Optional[str] = None,
+    meta_out: Optional[dict] = None,
+) -> Iterator[str]:
+    """
+    Flujo orquestado completo para una sesión: actualiza la memoria, registra
+    los eventos del trace y entrega la respuesta en streaming. Si se pasa
+    `meta_out`, al terminar queda ahí el dict que devuelve orchestrate.
+    """
+    pregunta = analizar_consulta(pregunta)
+    low = pregunta.normalizado
+    if "vespertina" in low:
+        mem.remember("jornada", "vespertina")
+    if "diurna" in low:
+        mem.remember("jornada", "diurna")
+
+    mem.add_turn("user", pregunta)
+
+    with span("orquestar", role="assistant", trace_id=trace_id) as sp, corpus_fijo() as snap:
+        sp.set(corpus=snap.version)
+        event("user", pregunta)
+        stream = orchestrate_stream(
+            question=pregunta,
+            mem_summary=mem.resumen(),
+            client=get_client(),
             model=MODEL,
-            temperature=0.5,
-            messages=messages,
+            retrieve=recuperar_contexto,
+            format_ctx=formatear_contexto,
+            cache=get_response_cache(),
         )
-        latency = (time.time() - start) * 1000
-
-        text = ""
-        if hasattr(resp, "choices") and resp.choices:
-            text = _extract_text_from_choice(resp.choices[0])
-
-        tokens_used = _extract_tokens_used(resp)
-        if tokens_used is None:
-            tokens_used = max(20, len(text) // 4)
-
-        log_event(
-            trace_id,
-            span_call,
-            span_request,
-            "assistant",
-            text,
-            latency_ms=latency,
-            tokens_used=tokens_used,
+        try:
+            for parte in stream:
+                yield parte
+            respuesta = stream.result
+        except LLMGatewayError as e:
+            # sin modelo (breaker abierto o sin cupo): fragmentos del corpus en vez de esperar
+            event("system", f"llm_degradado: {e}", tool="llm_gateway")
+            texto = respuesta_degradada(pregunta)
+            yield texto
+            respuesta = {"text": texto, "tokens_used": 0, "route": "degradado", "fused": False, "failed": {},
+                         "cache": None}
+
+        tokens_orch = None
+        respuesta_text = ""
+        ruta = None
+
+        if isinstance(respuesta, dict) and "text" in respuesta:
+            respuesta_text = respuesta.get("text", "")
+            tokens_orch = respuesta.get("tokens_used")
+            ruta = "fusion" if respuesta.get("fused") else f"directo:{respuesta.get('route')}"
+            if respuesta.get("cache") == "hit":
+                ruta = "cache"
+            log_cache(respuesta.get("cache"))
+        else:
+            respuesta_text = str(respuesta)
+
+        if tokens_orch is None:
+            tokens_orch = max(20, len(respuesta_text) // 4)
+            respuesta_text = "(TOKEN_ESTIMADO) " + respuesta_text
+
+        # los tokens ya quedaron en los spans de cada llamada al modelo; aquí va el total del trace
+        sp.set(
+            message=respuesta_text,
+            tokens_total=int(tokens_orch),
+            tool=ruta,
+            ttft_ms=respuesta.get("ttft_ms") if isinstance(respuesta, dict) else None,
         )
-        return text
 
-    except Exception as e:
-        latency = (time.time() - start) * 1000
-        log_event(
-            trace_id,
-            span_call,
-            span_request,
-            "system",
-            f"error: {e}",
-            latency_ms=latency,
-        )
-        return f"Error al procesar la consulta: {e}"
+        mem.add_turn("assistant", respuesta_text)
+        if meta_out is not None and isinstance(respuesta, dict):
+            meta_out.update(respuesta, trace_id=sp.trace_id, corpus_version=snap.version)
 
 if __name__ == "__main__":
+    if os.getenv("METRICS_PORT"):
+        import observability
+
+        observability.start_metrics_server(int(os.environ["METRICS_PORT"]))
     print("Asistente universitario listo")
     mem = SessionMemory()
 
@@ -298,74 +416,20 @@ if __name__ == "__main__":
     
             if pregunta.lower().startswith("simple "):
                 q = pregunta[7:].strip()
-                respuesta = consultar(q, trace_id=trace_root)
                 print("\nPregunta:", pregunta)
-                print("Respuesta:", respuesta, "\n")
+                print("Respuesta: ", end="", flush=True)
+                for parte in consultar_stream(q, trace_id=trace_root):
+                    print(parte, end="", flush=True)
+                print("\n")
                 continue
 
-            low = pregunta.lower()
-            if "vespertina" in low:
-                mem.remember("jornada", "vespertina")
-            if "diurna" in low:
-                mem.remember("jornada", "diurna")
-
-            mem.add_turn("user", pregunta)
-            span_orch = new_span_id()
-            log_event(trace_root, span_orch, None, "system", "orchestrate_start")
-
-            start_orch = time.time()
-
+            print("\nPregunta:", pregunta)
+            print("Respuesta: ", end="", flush=True)
             try:
-                respuesta = orchestrate(
-                    question=pregunta,
-                    mem_summary=mem.resumen(),
-                    client=client,
-                    model=MODEL,
-                    retrieve=recuperar_contexto,
-                    format_ctx=formatear_contexto,
-                )
-                latency_orch = (time.time() - start_orch) * 1000
-
-    
-                tokens_orch = None
-                respuesta_text = ""
-
-                if isinstance(respuesta, dict) and "text" in respuesta:
-                    respuesta_text = respuesta.get("text", "")
-                    tokens_orch = respuesta.get("tokens_used")
-                else:
-                    respuesta_text = str(respuesta)
-
-        
-                if not tokens_orch:
-                    tokens_orch = max(20, len(respuesta_text) // 4)
-                    respuesta_text = "(TOKEN_ESTIMADO) " + respuesta_text
-
-        
-                log_event(
-                    trace_root,
-                    new_span_id(),
-                    span_orch,
-                    "assistant",
-                    respuesta_text,
-                    latency_ms=latency_orch,
-                    tokens_used=int(tokens_orch),
-                )
-
-                mem.add_turn("assistant", respuesta_text)
-                print("\nPregunta:", pregunta)
-                print("Respuesta:", respuesta_text, "\n")
-
+                for parte in orquestar_stream(pregunta, mem, trace_id=trace_root):
+                    print(parte, end="", flush=True)
+                print("\n")
             except Exception as e:
-                latency_orch = (time.time() - start_orch) * 1000
-                log_event(
-                    trace_root,
-                    new_span_id(),
-                    span_orch,
-                    "system",
-                    f"orchestrate_error: {e}",
-                    latency_ms=latency_orch,
-                )
                 print(f"Error: {e}")
 
     except KeyboardInterrupt:
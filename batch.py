@@ -0,0 +1,338 @@
+"""
+Procesamiento masivo de preguntas (revisión de calidad, preguntas históricas).
+
+    python batch.py preguntas.jsonl -o respuestas.jsonl --workers 4 --tpm 90000
+
+Lee las preguntas de un JSONL (objetos con "pregunta"/"question" y, si
+viene, "id") o de un CSV con esas columnas, y las pasa por
+`planner_agent.orchestrate` con `workers` hilos que comparten el índice, el
+cliente del modelo y la caché del proceso. Un presupuesto global de tokens
+por minuto (token bucket) frena el envío: cada pregunta reserva lo que se
+estima que va a gastar y al terminar se ajusta con lo que gastó de verdad.
+
+Cada respuesta se agrega al JSONL de salida apenas está lista, con fuentes,
+ruta, tokens, latencia y tiempos por etapa (de los spans del trace). Esa
+salida es también el checkpoint: al volver a correr con el mismo archivo se
+saltan los ids ya respondidos y se reintentan los que quedaron con error o
+interrumpidos (los que esperaban presupuesto o breaker al cortar la corrida).
+Cada pregunta es su propio trace (span 'batch'), así que aparece en el log
+y en el dashboard como cualquier otra consulta.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+import assistant_uni as au
+import retrieval
+from llm_gateway import LLMGatewayError
+from planner_agent import orchestrate
+from tracing import Span, add_listener, event, new_trace_id, span
+
+load_dotenv()
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_TPM = int(os.getenv("BATCH_TPM", "0"))  # 0 = sin presupuesto
+BATCH_TOKENS_ESTIMADOS = int(os.getenv("BATCH_TOKENS_ESTIMADOS", "1500"))
+
+CAMPOS_PREGUNTA = ("pregunta", "question", "texto", "text")
+# estados que no se reintentan al reanudar
+TERMINADOS = ("ok", "invalida")
+
+
+class TokenBudget:
+    """
+    Token bucket de tokens del modelo por minuto, compartido por los workers.
+    `reservar` bloquea hasta que haya saldo; `ajustar` corrige con el gasto
+    real (el saldo puede quedar negativo y frena a los siguientes).
+    """
+
+    def __init__(self, tpm: float, estimado: float = BATCH_TOKENS_ESTIMADOS):
+        self.tpm = tpm
+        self.rate_per_s = tpm / 60.0
+        self.estimado = float(estimado)
+        self._lock = threading.Lock()
+        self._saldo = float(tpm)
+        self._t = time.monotonic()
+        self.esperado_s = 0.0
+
+    def _rellenar(self, ahora: float) -> None:
+        self._saldo = min(self.tpm, self._saldo + (ahora - self._t) * self.rate_per_s)
+        self._t = ahora
+
+    def reservar(self, parar: Optional[threading.Event] = None) -> float:
+        with self._lock:
+            n = self.estimado
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._rellenar(ahora)
+                # una reserva más grande que el balde completo pasa cuando está lleno
+                if self._saldo >= min(n, self.tpm):
+                    self._saldo -= n
+                    return n
+                espera = (min(n, self.tpm) - self._saldo) / self.rate_per_s
+                self.esperado_s += min(espera, 1.0)
+            if parar is not None and parar.wait(min(espera, 1.0)):
+                return 0.0
+            if parar is None:
+                time.sleep(min(espera, 1.0))
+
+    def ajustar(self, reservado: float, real: int) -> None:
+        with self._lock:
+            self._saldo += reservado - real
+            if real:
+                # media móvil: la próxima reserva se parece a lo que gastan las preguntas reales
+                self.estimado = 0.8 * self.estimado + 0.2 * real
+
+
+class _Etapas:
+    """Latencia (suma, ms), tokens y cantidad de spans por etapa, agrupados por trace."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_trace: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def abrir(self, trace_id: str) -> None:
+        with self._lock:
+            self._por_trace[trace_id] = {}
+
+    def cerrar(self, trace_id: str) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            etapas = self._por_trace.pop(trace_id, {})
+        return {k: {"ms": round(v["ms"], 2), "tokens": int(v["tokens"]), "n": int(v["n"])}
+                for k, v in etapas.items()}
+
+    def __call__(self, sp: Span, error: Optional[BaseException]) -> None:
+        with self._lock:
+            etapas = self._por_trace.get(sp.trace_id)
+            if etapas is None or sp.name == "batch":
+                return
+            e = etapas.setdefault(sp.name, {"ms": 0.0, "tokens": 0, "n": 0})
+            e["ms"] += sp.latency_ms
+            e["tokens"] += int(sp.attrs.get("tokens_used") or 0)
+            e["n"] += 1
+
+
+def leer_preguntas(path: str) -> Iterator[Tuple[str, str]]:
+    """(id, pregunta) de un JSONL o CSV; sin columna id se usa el número de línea/fila."""
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for i, fila in enumerate(csv.DictReader(f), 1):
+                yield _item(fila, i)
+        return
+    with open(path, encoding="utf-8") as f:
+        for i, linea in enumerate(f, 1):
+            if not linea.strip():
+                continue
+            try:
+                obj = json.loads(linea)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{i}: JSON inválido ({e})") from None
+            yield _item(obj if isinstance(obj, dict) else {"pregunta": obj}, i)
+
+
+def _item(fila: Dict[str, Any], n: int) -> Tuple[str, str]:
+    pregunta = next((fila[c] for c in CAMPOS_PREGUNTA if fila.get(c)), "")
+    ident = fila.get("id")
+    return (str(ident) if ident not in (None, "") else str(n)), str(pregunta or "")
+
+
+def reanudar(path: str) -> Set[str]:
+    """
+    Ids ya terminados en una salida previa. Si la corrida anterior se cortó a
+    mitad de una línea, la recorta para que lo que se agregue quede bien.
+    """
+    hechos: Set[str] = set()
+    if not os.path.exists(path):
+        return hechos
+    with open(path, "rb+") as f:
+        datos = f.read()
+        if datos and not datos.endswith(b"\n"):
+            f.truncate(datos.rfind(b"\n") + 1)
+            datos = datos[: datos.rfind(b"\n") + 1]
+    for linea in datos.splitlines():
+        try:
+            rec = json.loads(linea)
+        except ValueError:
+            continue
+        if rec.get("status") in TERMINADOS:
+            hechos.add(str(rec.get("id")))
+        else:
+            hechos.discard(str(rec.get("id")))
+    return hechos
+
+
+class BatchRunner:
+    def __init__(self, salida: str, workers: int = BATCH_WORKERS, tpm: int = BATCH_TPM,
+                 tokens_estimados: int = BATCH_TOKENS_ESTIMADOS, usar_cache: bool = True):
+        self.salida = salida
+        self.workers = max(1, workers)
+        self.budget = TokenBudget(tpm, tokens_estimados) if tpm > 0 else None
+        self.usar_cache = usar_cache
+        self.parar = threading.Event()
+        self._etapas = _Etapas()
+        self._lock = threading.Lock()
+        self._out = None
+        self.contadores: Dict[str, int] = {"ok": 0, "invalida": 0, "error": 0, "interrumpida": 0, "saltadas": 0}
+        self.tokens = 0
+
+    def procesar(self, ident: str, pregunta: str) -> Dict[str, Any]:
+        """Corre una pregunta en su propio trace y devuelve el registro de salida."""
+        client = au.get_client()
+        reservado = self.budget.reservar(self.parar) if self.budget is not None else 0.0
+        # con el breaker abierto no tiene sentido consumir la cola: se espera a que se pueda probar
+        while client.breaker.abierto() and not self.parar.wait(1.0):
+            pass
+        if self.parar.is_set():
+            # cualquiera de las dos esperas pudo terminar por la interrupción: no se llama
+            # al modelo y el registro (que no es TERMINADOS) hace que se reintente al reanudar
+            if self.budget is not None:
+                self.budget.ajustar(reservado, 0)
+            return {"id": ident, "pregunta": pregunta, "status": "interrumpida"}
+        fuentes: List[str] = []
+
+        def retrieve(q: str, k: int, hint: str) -> List[Tuple[str, str]]:
+            ctx = retrieval.recuperar_contexto(q, k, hint)
+            fuentes.extend(src for src, _ in ctx if src not in fuentes)
+            return ctx
+
+        trace_id = new_trace_id()
+        self._etapas.abrir(trace_id)
+        t0 = time.perf_counter()
+        rec: Dict[str, Any] = {"id": ident, "pregunta": pregunta, "trace_id": trace_id}
+        try:
+            with span("batch", role="assistant", trace_id=trace_id, item=ident) as sp, \
+                    retrieval.corpus_fijo() as snap:
+                sp.set(corpus=snap.version)
+                event("user", pregunta)
+                q = au.analizar_consulta(pregunta)
+                ok, err = au.sanitize_input(q) if q.strip() else (False, "pregunta vacía")
+                if not ok:
+                    event("system", f"input_validation_failed: {err}")
+                    sp.set(tool="invalida")
+                    rec.update(status="invalida", error=err)
+                    return rec
+                try:
+                    res = orchestrate(q, "", client, au.MODEL, retrieve, retrieval.formatear_contexto,
+                                      cache=au.get_response_cache() if self.usar_cache else None)
+                except LLMGatewayError as e:
+                    event("system", f"llm_degradado: {e}", tool="llm_gateway")
+                    sp.set(tool="error")
+                    rec.update(status="error", error=f"{type(e).__name__}: {e}")
+                    return rec
+                ruta = "cache" if res.get("cache") == "hit" else (
+                    "fusion" if res.get("fused") else f"directo:{res.get('route')}")
+                sp.set(message=res["text"], tokens_total=int(res["tokens_used"]), tool=ruta)
+                rec.update(
+                    status="ok", respuesta=res["text"], fuentes=fuentes, ruta=ruta, domains=res.get("domains"),
+                    failed=res.get("failed") or {}, cache=res.get("cache"), tokens_used=int(res["tokens_used"]),
+                    corpus_version=snap.version,
+                )
+        except Exception as e:
+            rec.update(status="error", error=f"{type(e).__name__}: {e}")
+        finally:
+            if self.budget is not None:
+                self.budget.ajustar(reservado, int(rec.get("tokens_used") or 0))
+            rec["latency_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            rec["etapas"] = self._etapas.cerrar(trace_id)
+        return rec
+
+    def _escribir(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self._out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._out.flush()
+            self.contadores[rec["status"]] += 1
+            self.tokens += int(rec.get("tokens_used") or 0)
+
+    def correr(self, items: Iterator[Tuple[str, str]], total: Optional[int] = None,
+               progreso_s: float = 5.0) -> Dict[str, Any]:
+        hechos = reanudar(self.salida)
+        add_listener(self._etapas)
+        cupos = threading.BoundedSemaphore(self.workers * 2)  # no se encola el archivo entero
+        t0 = time.perf_counter()
+        ultimo = [t0]
+
+        def tarea(ident: str, pregunta: str) -> None:
+            try:
+                if not self.parar.is_set():
+                    self._escribir(self.procesar(ident, pregunta))
+            finally:
+                cupos.release()
+                ahora = time.perf_counter()
+                if progreso_s and ahora - ultimo[0] >= progreso_s:
+                    ultimo[0] = ahora
+                    print(self._progreso(total, ahora - t0), file=sys.stderr, flush=True)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.salida)), exist_ok=True)
+        self._out = open(self.salida, "a", encoding="utf-8")
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch")
+        try:
+            for ident, pregunta in items:
+                if ident in hechos:
+                    self.contadores["saltadas"] += 1
+                    continue
+                cupos.acquire()
+                pool.submit(tarea, ident, pregunta)
+            pool.shutdown(wait=True)
+        except KeyboardInterrupt:
+            # lo que ya está en curso termina y queda escrito; el resto sale en la próxima corrida
+            self.parar.set()
+            print("\nInterrumpido: terminando las preguntas en curso…", file=sys.stderr, flush=True)
+            pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            self._out.close()
+        return self._resumen(time.perf_counter() - t0)
+
+    def _progreso(self, total: Optional[int], s: float) -> str:
+        c = self.contadores
+        hechas = c["ok"] + c["invalida"] + c["error"]
+        tpm = self.tokens / s * 60 if s else 0.0
+        return (f"[batch] {hechas + c['saltadas']}/{total if total is not None else '?'} "
+                f"(ok {c['ok']}, error {c['error']}, inválidas {c['invalida']}, interrumpidas {c['interrumpida']}, "
+                f"saltadas {c['saltadas']}) "
+                f"{hechas / s if s else 0:.2f} preg/s, {tpm:.0f} tokens/min")
+
+    def _resumen(self, s: float) -> Dict[str, Any]:
+        hechas = self.contadores["ok"] + self.contadores["invalida"] + self.contadores["error"]
+        return dict(
+            self.contadores,
+            segundos=round(s, 2),
+            preguntas_por_s=round(hechas / s, 3) if s else None,
+            tokens=self.tokens,
+            tokens_por_min=round(self.tokens / s * 60, 1) if s else None,
+            espera_presupuesto_s=round(self.budget.esperado_s, 2) if self.budget is not None else None,
+            interrumpido=self.parar.is_set(),
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Responde en lote preguntas de un JSONL/CSV con orchestrate")
+    ap.add_argument("entrada", help="JSONL o CSV con 'pregunta' (o 'question') y opcionalmente 'id'")
+    ap.add_argument("-o", "--salida", help="JSONL de respuestas y checkpoint (por defecto <entrada>.respuestas.jsonl)")
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                    help="preguntas en paralelo; sus agentes comparten el pool de MAX_AGENT_WORKERS")
+    ap.add_argument("--tpm", type=int, default=BATCH_TPM, help="presupuesto de tokens por minuto (0 = sin límite)")
+    ap.add_argument("--tokens-estimados", type=int, default=BATCH_TOKENS_ESTIMADOS,
+                    help="tokens que reserva cada pregunta hasta conocer el gasto real")
+    ap.add_argument("--sin-cache", action="store_true", help="no usar la caché de respuestas")
+    args = ap.parse_args(argv)
+
+    salida = args.salida or os.path.splitext(args.entrada)[0] + ".respuestas.jsonl"
+    au.get_client()  # sin credenciales falla aquí, antes de leer nada
+    print(f"Índice listo: {retrieval.precalentar()}", file=sys.stderr)
+    total = sum(1 for _ in leer_preguntas(args.entrada))
+    runner = BatchRunner(salida, args.workers, args.tpm, args.tokens_estimados, usar_cache=not args.sin_cache)
+    resumen = runner.correr(leer_preguntas(args.entrada), total=total)
+    print(json.dumps(resumen, ensure_ascii=False))
+    return 1 if resumen["interrumpido"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
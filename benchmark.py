@@ -0,0 +1,366 @@
+"""
+Benchmark de recuperación y de punta a punta con un LLM simulado.
+
+    python benchmark.py --docs 10,1000,10000 --queries 300 --out bench.json
+    python benchmark.py --docs 1000 --e2e-queries 100 --llm-latency-ms 300 --concurrency 8
+
+Por cada tamaño de corpus se genera un data/ sintético en un directorio
+temporal y se corre un proceso aparte (para que la memoria y los tiempos de
+arranque no se mezclen entre tamaños) que mide:
+
+- `_cargar_documentos` y el chunker configurado (tiempo y MB/s)
+- construcción del índice en frío y refresco sin cambios
+- `recuperar_contexto` pregunta por pregunta y `recuperar_contexto_batch`
+  (p50/p95/p99 y consultas por segundo); el batch se compara por scorer con
+  el bucle escalar con los mismos hints y, si queda por debajo de
+  --min-batch-speedup, el proceso termina con código 1
+- `orchestrate` completo contra stub_llm.py (latencia configurable), después
+  de una tanda de calentamiento que no entra en los percentiles (la primera
+  llamada, que crea el cliente perezoso, queda en `first_call_ms`)
+- arranque en procesos nuevos: tiempo de import de `retrieval` y de
+  `assistant_uni` (sin credenciales) y latencia de la primera consulta con
+  el índice ya construido, recorriendo data/ o con RAG_INDEX_PREBUILT=1
+
+El resultado es un JSON con la configuración, el commit y una entrada por
+tamaño (incluye el RSS máximo del proceso), para comparar entre commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import psutil
+
+_DOMINIOS = {
+    "beca": ("beca", "beneficio", "arancel", "alimentación", "postulación", "requisitos", "plazo", "socioeconómico"),
+    "reglamento": ("nota", "apelar", "retiro", "asignatura", "convalidación", "examen", "reprobación", "semestre"),
+    "admin": ("certificado", "secretaría", "horario", "correo", "formulario", "oficina", "trámite", "solicitud"),
+}
+_SILABAS = ("ca", "de", "la", "mi", "no", "pa", "re", "si", "ta", "ve", "lo", "ri", "ga", "to", "men", "cion", "dad")
+
+
+def _vocabulario(rng: random.Random, n: int = 5000) -> List[str]:
+    vistos, out = set(), []
+    while len(out) < n:
+        w = "".join(rng.choice(_SILABAS) for _ in range(rng.randint(2, 4)))
+        if w not in vistos:
+            vistos.add(w)
+            out.append(w)
+    return out
+
+
+def generar_corpus(data_dir: str, n_docs: int, palabras_doc: int = 400, seed: int = 7) -> List[str]:
+    """
+    Escribe `n_docs` documentos .txt en `data_dir` (Zipf sobre un vocabulario
+    sintético + términos de dominio) y devuelve un conjunto de preguntas.
+    """
+    rng = random.Random(seed)
+    vocab = _vocabulario(rng)
+    pesos = np.cumsum(1.0 / np.arange(1, len(vocab) + 1)).tolist()
+    os.makedirs(data_dir, exist_ok=True)
+    dominios = list(_DOMINIOS)
+    preguntas: List[str] = []
+    for i in range(n_docs):
+        dom = dominios[i % len(dominios)]
+        palabras = rng.choices(vocab, cum_weights=pesos, k=palabras_doc)
+        for j in range(0, palabras_doc, 25):
+            palabras[j] = rng.choice(_DOMINIOS[dom])
+        parrafos = [" ".join(palabras[k:k + 80]) + "." for k in range(0, palabras_doc, 80)]
+        with open(os.path.join(data_dir, f"{dom}_{i:06d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(parrafos))
+        if len(preguntas) < 2000 and rng.random() < max(0.05, 2000 / max(n_docs, 1)):
+            k = rng.randint(0, palabras_doc - 6)
+            preguntas.append(f"¿{rng.choice(_DOMINIOS[dom])} " + " ".join(palabras[k:k + rng.randint(2, 5)]) + "?")
+    return preguntas
+
+
+def _percentiles(ms: Sequence[float]) -> Dict[str, float]:
+    a = np.asarray(ms, dtype=np.float64)
+    if a.size == 0:
+        return {}
+    return {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 4),
+        "p50_ms": round(float(np.percentile(a, 50)), 4),
+        "p95_ms": round(float(np.percentile(a, 95)), 4),
+        "p99_ms": round(float(np.percentile(a, 99)), 4),
+        "max_ms": round(float(a.max()), 4),
+    }
+
+
+def _peak_rss_mb() -> float:
+    mi = psutil.Process().memory_info()
+    peak = getattr(mi, "peak_wset", None)  # Windows
+    if peak is None:
+        try:
+            import resource
+            # Linux reporta KB; macOS, bytes
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        except ImportError:
+            peak = mi.rss
+    return round(peak / 2 ** 20, 1)
+
+
+def _rss_mb() -> float:
+    return round(psutil.Process().memory_info().rss / 2 ** 20, 1)
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _cronometrar(fn, repeticiones: int = 1):
+    mejor, out = float("inf"), None
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        out = fn()
+        mejor = min(mejor, time.perf_counter() - t)
+    return out, mejor
+
+
+def _worker(args: argparse.Namespace) -> Dict[str, Any]:
+    """Corre dentro del proceso hijo, con RAG_DATA_DIR/RAG_INDEX_DIR ya apuntando al corpus."""
+    from stub_llm import StubConfig, serve
+
+    port = int(os.environ["BENCH_STUB_PORT"])
+    stub = serve(port=port, cfg=StubConfig(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+                                           token_delay_ms=0.0, seed=1))
+    rss0 = _rss_mb()
+    t = time.perf_counter()
+    import assistant_uni as au
+    import retrieval
+    from planner_agent import orchestrate
+    res: Dict[str, Any] = {"import_s": round(time.perf_counter() - t, 4)}
+
+    with open(os.environ["BENCH_QUESTIONS"], encoding="utf-8") as f:
+        preguntas = json.load(f)
+    qs = [preguntas[i % len(preguntas)] for i in range(args.queries)]
+
+    docs, s = _cronometrar(au._cargar_documentos, 3)
+    mb = sum(len(t.encode("utf-8")) for _, t in docs) / 2 ** 20
+    res["cargar_documentos"] = {"docs": len(docs), "mb": round(mb, 2), "s": round(s, 4),
+                                "mb_per_s": round(mb / s, 2) if s else None}
+
+    chunks, s = _cronometrar(lambda: [sp for _, t in docs for sp in au.CHUNKER.spans(t)])
+    res["chunkear"] = {"chunks": len(chunks), "s": round(s, 4), "mb_per_s": round(mb / s, 2) if s else None}
+    del docs, chunks
+
+    indice = au._get_indice()
+    snap, s = _cronometrar(indice.snapshot)
+    res["indice"] = {"chunks": snap.n_chunks, "terms": len(snap.terms), "build_s": round(s, 4)}
+    _, s = _cronometrar(indice.refresh, 3)
+    res["indice"]["refresh_noop_s"] = round(s, 4)
+    res["indice"]["rss_mb"] = _rss_mb()
+
+    for q in qs[:20]:  # calentamiento: pesos del scorer y cachés del snapshot
+        au.recuperar_contexto(q, 3)
+    lat = []
+    t0 = time.perf_counter()
+    for q in qs:
+        t = time.perf_counter()
+        au.recuperar_contexto(q, 3)
+        lat.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - t0
+    res["recuperar_contexto"] = dict(_percentiles(lat), qps=round(len(qs) / total, 1))
+
+    # batch contra el bucle escalar con los mismos hints, por scorer (mejor de 3 cada uno)
+    hints = ["beca", "reglamento", "admin"]
+    qh = [hints[i % 3] for i in range(len(qs))]
+    res["recuperar_contexto_batch"] = {}
+    for nombre, cls in retrieval.SCORERS.items():
+        scorer = cls(domain_boost=retrieval.RAG_DOMAIN_BOOST)
+        au.recuperar_contexto_batch(qs[:20], 3, qh[:20], scorer)  # calentamiento: import de scipy y pesos
+        _, esc = _cronometrar(lambda: [au.recuperar_contexto(q, 3, h, scorer) for q, h in zip(qs, qh)], 3)
+        _, s = _cronometrar(lambda: au.recuperar_contexto_batch(qs, 3, qh, scorer), 3)
+        res["recuperar_contexto_batch"][nombre] = {
+            "n": len(qs), "s": round(s, 4), "qps": round(len(qs) / s, 1) if s else None,
+            "scalar_qps": round(len(qs) / esc, 1) if esc else None,
+            "speedup": round(esc / s, 2) if s else None,
+        }
+
+    if args.e2e_queries:
+        def una(q: str) -> float:
+            t = time.perf_counter()
+            orchestrate(q, "", au.client, au.MODEL, au.recuperar_contexto, au.formatear_contexto, cache=None)
+            return (time.perf_counter() - t) * 1000
+
+        e2e_qs = [qs[i % len(qs)] for i in range(args.e2e_queries)]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            # calentamiento fuera de los percentiles: cliente, pool de agentes y una conexión por hilo.
+            # La primera llamada paga la creación perezosa del cliente; se informa aparte.
+            primera = una(e2e_qs[0])
+            list(pool.map(una, e2e_qs[:args.concurrency]))
+            antes = stub.stub_config.requests
+            t0 = time.perf_counter()
+            lat = list(pool.map(una, e2e_qs))
+            total = time.perf_counter() - t0
+        res["orchestrate"] = dict(
+            _percentiles(lat),
+            first_call_ms=round(primera, 1),
+            concurrency=args.concurrency,
+            llm_latency_ms=args.llm_latency_ms,
+            throughput_rps=round(len(e2e_qs) / total, 2),
+            llm_calls=stub.stub_config.requests - antes,
+        )
+    stub.shutdown()
+
+    res["rss_start_mb"] = rss0
+    res["rss_end_mb"] = _rss_mb()
+    res["peak_rss_mb"] = _peak_rss_mb()
+    return res
+
+
+# corre en un proceso nuevo: mide el import y la primera consulta, sin nada precargado
+_ARRANQUE = """
+import json, sys, time
+t = time.perf_counter()
+import {modulo}
+t1 = time.perf_counter()
+out = {{"import_ms": (t1 - t) * 1000}}
+if {consultar}:
+    {modulo}.recuperar_contexto(sys.argv[1], 3)
+    out["first_query_ms"] = (time.perf_counter() - t1) * 1000
+print(json.dumps(out))
+"""
+
+
+def _arranque(env: Dict[str, str], pregunta: str, repeticiones: int = 3) -> Dict[str, Any]:
+    """Import y primera consulta en procesos nuevos (mejor de `repeticiones`), con el índice ya construido."""
+    sin_credenciales = {k: v for k, v in env.items() if k not in ("OPENAI_API_KEY", "OPENAI_BASE_URL")}
+    casos = {
+        "import_retrieval_ms": ("retrieval", False, {}),
+        "import_assistant_ms": ("assistant_uni", False, {}),
+        "first_query_ms": ("retrieval", True, {"RAG_INDEX_PREBUILT": "0"}),
+        "first_query_prebuilt_ms": ("retrieval", True, {"RAG_INDEX_PREBUILT": "1"}),
+    }
+    out: Dict[str, Any] = {}
+    for clave, (modulo, consultar, extra) in casos.items():
+        mejor = None
+        for _ in range(repeticiones):
+            proc = subprocess.run(
+                [sys.executable, "-c", _ARRANQUE.format(modulo=modulo, consultar=consultar), pregunta],
+                env=dict(sin_credenciales, **extra), cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                out[clave] = None
+                break
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            ms = r["first_query_ms"] if consultar else r["import_ms"]
+            mejor = ms if mejor is None else min(mejor, ms)
+        else:
+            out[clave] = round(mejor, 1)
+    return out
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__) or ".",
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(argv: List[str] = None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description="Benchmark de recuperación y orquestación (LLM simulado)")
+    ap.add_argument("--docs", default="10,1000,10000", help="tamaños de corpus separados por coma (10 a 100000)")
+    ap.add_argument("--words-per-doc", type=int, default=400)
+    ap.add_argument("--queries", type=int, default=300, help="consultas de recuperación por tamaño")
+    ap.add_argument("--e2e-queries", type=int, default=30, help="llamadas a orchestrate por tamaño (0 = omitir)")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--llm-latency-ms", type=float, default=100.0)
+    ap.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="", help="archivo JSON de salida (por defecto, stdout)")
+    ap.add_argument("--keep", action="store_true", help="no borrar los corpus generados")
+    ap.add_argument("--min-batch-speedup", type=float, default=1.0,
+                    help="batch/escalar mínimo por scorer (0 = no verificar)")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.worker:
+        json.dump(_worker(args), sys.stdout)
+        return {}
+
+    out: Dict[str, Any] = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "out", "keep")},
+        "results": [],
+    }
+    base = tempfile.mkdtemp(prefix="rag_bench_")
+    try:
+        for n in [int(x) for x in args.docs.split(",") if x.strip()]:
+            raiz = os.path.join(base, f"docs_{n}")
+            t = time.perf_counter()
+            preguntas = generar_corpus(os.path.join(raiz, "data"), n, args.words_per_doc, args.seed)
+            gen_s = time.perf_counter() - t
+            qpath = os.path.join(raiz, "preguntas.json")
+            with open(qpath, "w", encoding="utf-8") as f:
+                json.dump(preguntas, f, ensure_ascii=False)
+
+            env = dict(
+                os.environ,
+                RAG_DATA_DIR=os.path.join(raiz, "data"),
+                RAG_INDEX_DIR=os.path.join(raiz, "index"),
+                LOG_PATH=os.path.join(raiz, "logs", "agent.log"),
+                OPENAI_API_KEY="bench",
+                BENCH_STUB_PORT=str(_puerto_libre()),
+                BENCH_QUESTIONS=qpath,
+                RESPONSE_CACHE="0",
+            )
+            env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{env['BENCH_STUB_PORT']}/v1"
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker"] + (argv if argv is not None else sys.argv[1:])
+            print(f"[bench] {n} documentos...", file=sys.stderr)
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                res = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "falló"}
+            else:
+                res = json.loads(proc.stdout)
+                res["startup"] = _arranque(env, preguntas[0])
+            out["results"].append(dict(docs=n, generate_s=round(gen_s, 3), questions=len(preguntas), **res))
+    finally:
+        if not args.keep:
+            shutil.rmtree(base, ignore_errors=True)
+
+    texto = json.dumps(out, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    return out
+
+
+def batch_lentos(out: Dict[str, Any], minimo: float) -> List[str]:
+    """Tamaños y scorers en que recuperar_contexto_batch no alcanza `minimo` veces el escalar."""
+    lentos = []
+    for r in out.get("results", []):
+        for nombre, b in r.get("recuperar_contexto_batch", {}).items():
+            if b.get("speedup") is not None and b["speedup"] < minimo:
+                lentos.append(f"{r['docs']} docs/{nombre}: {b['qps']} qps batch vs {b['scalar_qps']} escalar")
+    return lentos
+
+
+if __name__ == "__main__":
+    resultado = main()
+    minimo = resultado.get("config", {}).get("min_batch_speedup")
+    lentos = batch_lentos(resultado, minimo) if minimo else []
+    if lentos:
+        print("[bench] recuperar_contexto_batch más lento que el escalar: " + "; ".join(lentos), file=sys.stderr)
+        sys.exit(1)
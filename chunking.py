@@ -0,0 +1,179 @@
+"""
+Chunkers para el índice RAG.
+
+Un chunker devuelve spans (inicio, fin) sobre el texto original, sin copiar
+ni normalizar: el índice guarda el texto de cada fuente una sola vez y cada
+chunk como (fuente, inicio, fin). Los tamaños se expresan en tokens
+estimados (len // 4, como en el resto del agente).
+
+- `EstructuraChunker`: corta en encabezados (markdown, "Artículo N",
+  "Capítulo II", líneas en mayúsculas) y dentro de cada sección empaqueta
+  párrafos, líneas y oraciones hasta `max_tokens`; solo si una oración sola
+  excede el tamaño se corta por espacios. Secciones cortas consecutivas
+  comparten chunk si caben enteras.
+- `VentanaChunker`: ventanas fijas con solape (el comportamiento anterior),
+  cortadas en un espacio para no partir palabras.
+
+`chunker_desde_config("estructura:200")` / `("ventana:800:120")` arma uno a
+partir de RAG_CHUNKER.
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+Span = Tuple[int, int]
+
+_ENCABEZADO = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]+\S.*"
+    r"|(?:art[íi]culo|art\.|cap[íi]tulo|t[íi]tulo|secci[óo]n|anexo)[ \t]*[0-9IVXLCivxlc]+\b.*)$",
+    re.MULTILINE | re.IGNORECASE,
+)
+_MAYUSCULAS = re.compile(r"^[ \t]*[A-ZÁÉÍÓÚÑÜ][A-ZÁÉÍÓÚÑÜ0-9 ,.:;()\-]{3,79}$", re.MULTILINE)
+
+# de más grueso a más fino: párrafo, línea, oración
+_SEPARADORES = (
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"\n\s*"),
+    re.compile(r"(?<=[.!?;:])\s+(?=[¿¡\"«(\-]?[A-ZÁÉÍÓÚÑ0-9])"),
+)
+
+
+def _recortar(texto: str, a: int, b: int) -> Optional[Span]:
+    while a < b and texto[a].isspace():
+        a += 1
+    while b > a and texto[b - 1].isspace():
+        b -= 1
+    return (a, b) if b > a else None
+
+
+def _por_espacios(texto: str, a: int, b: int, tam: int) -> List[Span]:
+    out = []
+    while a < b:
+        fin = min(a + tam, b)
+        if fin < b:
+            corte = max(texto.rfind(" ", a, fin), texto.rfind("\n", a, fin))
+            if corte > a:
+                fin = corte
+        out.append((a, fin))
+        a = fin
+    return out
+
+
+class Chunker(ABC):
+    """Interfaz: `spans(texto)` -> lista de (inicio, fin) sobre `texto`."""
+
+    @abstractmethod
+    def spans(self, texto: str) -> List[Span]:
+        """(inicio, fin) de cada chunk sobre `texto`, en orden de inicio."""
+
+    @abstractmethod
+    def config(self) -> str:
+        """Identifica la configuración; si cambia, el índice se reconstruye completo."""
+
+    def __call__(self, texto: str) -> List[str]:
+        return [texto[a:b] for a, b in self.spans(texto)]
+
+
+class EstructuraChunker(Chunker):
+    def __init__(self, max_tokens: int = 200):
+        if max_tokens <= 0:
+            # con tamaño 0, _por_espacios no avanza nunca
+            raise ValueError(f"Tamaño de chunk inválido: max_tokens={max_tokens} (se requiere > 0)")
+        self.max_tokens = max_tokens
+        self._max = max_tokens * 4
+
+    def config(self) -> str:
+        return f"estructura:{self.max_tokens}"
+
+    def _secciones(self, texto: str) -> List[Span]:
+        cortes = {m.start() for m in _ENCABEZADO.finditer(texto)}
+        cortes.update(m.start() for m in _MAYUSCULAS.finditer(texto))
+        cortes.discard(0)
+        bordes = [0] + sorted(cortes) + [len(texto)]
+        return [(a, b) for a, b in zip(bordes, bordes[1:]) if b > a]
+
+    def _unidades(self, texto: str, a: int, b: int, nivel: int = 0) -> List[Span]:
+        """Parte [a, b) en unidades de a lo sumo self._max caracteres."""
+        if b - a <= self._max:
+            return [(a, b)]
+        if nivel == len(_SEPARADORES):
+            return _por_espacios(texto, a, b, self._max)
+        partes, ini = [], a
+        for m in _SEPARADORES[nivel].finditer(texto, a, b):
+            if m.end() < b:
+                partes.append((ini, m.end()))
+                ini = m.end()
+        partes.append((ini, b))
+        out: List[Span] = []
+        for p0, p1 in partes:
+            out.extend(self._unidades(texto, p0, p1, nivel + 1))
+        return out
+
+    def spans(self, texto: str) -> List[Span]:
+        out: List[Span] = []
+        entero = False  # el último chunk contiene solo secciones completas
+        for s0, s1 in self._secciones(texto):
+            unidades = self._unidades(texto, s0, s1)
+            # secciones cortas consecutivas (encabezados, artículos breves) comparten chunk
+            if entero and s1 - out[-1][0] <= self._max:
+                out[-1] = (out[-1][0], s1)
+                continue
+            antes = len(out)
+            actual: Optional[List[int]] = None
+            for u0, u1 in unidades:
+                if actual is not None and u1 - actual[0] <= self._max:
+                    actual[1] = u1
+                    continue
+                if actual is not None:
+                    out.append((actual[0], actual[1]))
+                actual = [u0, u1]
+            out.append((actual[0], actual[1]))
+            entero = len(out) == antes + 1
+        return [s for s in (_recortar(texto, a, b) for a, b in out) if s is not None]
+
+
+class VentanaChunker(Chunker):
+    def __init__(self, tam: int = 800, overlap: int = 120):
+        if tam <= 0 or not 0 <= overlap < tam:
+            raise ValueError(f"Ventana inválida: tam={tam}, overlap={overlap} (se requiere 0 <= overlap < tam)")
+        self.tam = tam
+        self.overlap = overlap
+
+    def config(self) -> str:
+        return f"ventana:{self.tam}:{self.overlap}"
+
+    def spans(self, texto: str) -> List[Span]:
+        out: List[Span] = []
+        a, n = 0, len(texto)
+        while a < n:
+            b = min(a + self.tam, n)
+            if b < n:
+                corte = max(texto.rfind(" ", a + self.overlap + 1, b), texto.rfind("\n", a + self.overlap + 1, b))
+                if corte > a:
+                    b = corte
+            s = _recortar(texto, a, b)
+            if s is not None:
+                # si el avance cayó en espacios, el recorte repite el inicio anterior: se conserva uno solo
+                if out and s[0] == out[-1][0]:
+                    out[-1] = max(out[-1], s)
+                else:
+                    out.append(s)
+            if b >= n:
+                break
+            sig = b - self.overlap
+            # el solape arranca en un borde de palabra
+            espacio = texto.find(" ", sig, b)
+            # siempre avanza, aunque el corte por palabra haya dejado la ventana más corta que el solape
+            a = max(espacio + 1 if espacio >= 0 else sig, a + 1)
+        return out
+
+
+def chunker_desde_config(spec: str) -> Chunker:
+    """'estructura', 'estructura:<max_tokens>' o 'ventana[:<tam>[:<overlap>]]'."""
+    tipo, *args = (spec or "estructura").split(":")
+    nums = [int(a) for a in args if a]
+    if tipo == "estructura":
+        return EstructuraChunker(*nums)
+    if tipo == "ventana":
+        return VentanaChunker(*nums)
+    raise ValueError(f"Chunker desconocido: {spec}")
@@ -0,0 +1,216 @@
+"""
+Armado del bloque de contexto con presupuesto de tokens.
+
+Con el chunker de ventanas los chunks se solapan, así que dos chunks
+vecinos de la misma fuente repiten texto; y cuando varios agentes recuperan
+lo mismo, el mismo pasaje viaja en cada prompt. Aquí:
+
+1. se fusionan los pasajes de una misma fuente que se solapan o se contienen,
+2. se descartan pasajes casi idénticos (shingles de palabras),
+3. se recorta al presupuesto respetando el orden de relevancia,
+
+y se informa cuántos tokens de prompt se ahorraron frente a concatenar los
+chunks tal cual. Los tokens se estiman como len(texto) // 4, igual que en
+el resto del agente.
+"""
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+Contexto = Tuple[str, str]  # (fuente, texto)
+
+MIN_OVERLAP = 32        # caracteres mínimos para considerar que dos pasajes se solapan
+NEAR_DUP = 0.8          # fracción de shingles del pasaje menor contenida en el otro
+SHINGLE = 5             # palabras por shingle
+SEPARADOR = "\n\n---\n\n"
+SIN_CONTEXTO = "No se encontraron fragmentos relevantes en la base local."
+
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // 4
+
+
+def _bloque(fuente: str, texto: str) -> str:
+    return f"[Fuente: {fuente}]\n{texto}"
+
+
+def formatear(contextos: Sequence[Contexto]) -> str:
+    if not contextos:
+        return SIN_CONTEXTO
+    return SEPARADOR.join(_bloque(f, t) for f, t in contextos)
+
+
+def _shingles(texto: str) -> FrozenSet[int]:
+    w = texto.lower().split()
+    if len(w) < SHINGLE:
+        return frozenset([hash(" ".join(w))])
+    return frozenset(hash(" ".join(w[i:i + SHINGLE])) for i in range(len(w) - SHINGLE + 1))
+
+
+def _casi_igual(a: FrozenSet[int], b: FrozenSet[int]) -> bool:
+    menor = min(len(a), len(b))
+    return menor > 0 and len(a & b) / menor >= NEAR_DUP
+
+
+def _unir(a: str, b: str) -> Optional[str]:
+    """a y b unidos si uno contiene al otro o el final de uno es el comienzo del otro."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    for x, y in ((a, b), (b, a)):
+        cabeza = y[:MIN_OVERLAP]
+        pos = x.find(cabeza, max(0, len(x) - len(y)))
+        while pos >= 0:
+            if y.startswith(x[pos:]):
+                return x + y[len(x) - pos:]
+            pos = x.find(cabeza, pos + 1)
+    return None
+
+
+def fusionar_solapados(contextos: Sequence[Contexto]) -> List[Contexto]:
+    """
+    Une pasajes de la misma fuente que se solapan. Conserva el orden de
+    relevancia: el pasaje unido ocupa el lugar del mejor de sus partes.
+    """
+    out: List[Contexto] = []
+    for fuente, texto in contextos:
+        texto = texto.strip()
+        if not texto:
+            continue
+        pos = len(out)
+        # un pasaje nuevo puede unir a dos anteriores (el chunk del medio)
+        i = 0
+        while i < len(out):
+            if out[i][0] == fuente:
+                unido = _unir(out[i][1], texto)
+                if unido is not None:
+                    texto = unido
+                    del out[i]
+                    pos = min(pos, i)
+                    continue
+            i += 1
+        out.insert(min(pos, len(out)), (fuente, texto))
+    return out
+
+
+class ContextStats:
+    """Tokens ahorrados por el armado de contexto (acumulado del proceso)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.merged = 0
+        self.deduped = 0
+        self.trimmed = 0
+        self.shared_dropped = 0
+        self.shared_tokens_saved = 0
+
+    def record_shared(self, dropped: int, tokens: int) -> None:
+        with self._lock:
+            self.shared_dropped += dropped
+            self.shared_tokens_saved += tokens
+
+    def record(self, info: Dict[str, int]) -> None:
+        with self._lock:
+            self.builds += 1
+            self.tokens_in += info["tokens_in"]
+            self.tokens_out += info["tokens_out"]
+            self.merged += info["merged"]
+            self.deduped += info["deduped"]
+            self.trimmed += info["trimmed"]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "builds": self.builds,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out + self.shared_tokens_saved,
+                "merged": self.merged,
+                "deduped": self.deduped,
+                "trimmed": self.trimmed,
+                # pasajes que no se repitieron en el prompt de un segundo agente
+                "shared_dropped": self.shared_dropped,
+                "shared_tokens_saved": self.shared_tokens_saved,
+            }
+
+
+CONTEXT_STATS = ContextStats()
+
+
+def construir_contexto(contextos: Sequence[Contexto], presupuesto: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Devuelve (bloque de contexto, info) con info = tokens_in (concatenación
+    ingenua), tokens_out, tokens_saved, merged, deduped y trimmed.
+    `presupuesto` es el máximo de tokens del bloque (None = sin límite).
+    """
+    tokens_in = estimar_tokens(formatear(contextos)) if contextos else 0
+    unidos = fusionar_solapados(contextos)
+    merged = len([t for _, t in contextos if t.strip()]) - len(unidos)
+
+    elegidos: List[Contexto] = []
+    firmas: List[FrozenSet[int]] = []
+    deduped = trimmed = 0
+    usados = 0
+    for fuente, texto in unidos:
+        sh = _shingles(texto)
+        if any(_casi_igual(sh, f) for f in firmas):
+            deduped += 1
+            continue
+        costo = estimar_tokens(_bloque(fuente, texto)) + (estimar_tokens(SEPARADOR) if elegidos else 0)
+        if presupuesto is not None and usados + costo > presupuesto:
+            if not elegidos:
+                # el más relevante siempre entra, recortado a palabra completa
+                disponible = max(0, presupuesto * 4 - len(_bloque(fuente, "")))
+                texto = texto[:disponible].rsplit(" ", 1)[0] + " …"
+                costo = estimar_tokens(_bloque(fuente, texto))
+            else:
+                trimmed += 1
+                continue
+        elegidos.append((fuente, texto))
+        firmas.append(sh)
+        usados += costo
+
+    bloque = formatear(elegidos)
+    tokens_out = estimar_tokens(bloque) if elegidos else 0
+    info = {
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "tokens_saved": max(0, tokens_in - tokens_out),
+        "merged": merged,
+        "deduped": deduped,
+        "trimmed": trimmed,
+    }
+    CONTEXT_STATS.record(info)
+    return bloque, info
+
+
+def repartir_entre_agentes(por_dominio: Iterable[Tuple[str, Sequence[Contexto]]],
+                           min_propios: int = 1) -> Dict[str, List[Contexto]]:
+    """
+    Quita de cada dominio los pasajes casi idénticos a los que ya van a otro
+    dominio anterior, para no pagar el mismo texto en cada prompt de agente.
+    Cada dominio conserva al menos `min_propios` pasajes (sus mejores), aunque
+    estén repetidos, para no dejar a un agente sin contexto.
+    """
+    vistos: List[FrozenSet[int]] = []
+    out: Dict[str, List[Contexto]] = {}
+    descartados = tokens = 0
+    for dominio, ctxs in por_dominio:
+        propios: List[Contexto] = []
+        for fuente, texto in fusionar_solapados(ctxs):
+            sh = _shingles(texto)
+            repetido = any(_casi_igual(sh, v) for v in vistos)
+            if repetido and len(propios) >= min_propios:
+                descartados += 1
+                tokens += estimar_tokens(_bloque(fuente, texto) + SEPARADOR)
+                continue
+            propios.append((fuente, texto))
+            if not repetido:
+                vistos.append(sh)
+        out[dominio] = propios
+    if descartados:
+        CONTEXT_STATS.record_shared(descartados, tokens)
+    return out
@@ -1,61 +1,92 @@
 import streamlit as st
 import pandas as pd
-import json
-from datetime import datetime
-import matplotlib.pyplot as plt
 import os
+import time
+
+import log_store
 
 LOG_PATH = os.getenv("LOG_PATH", "logs/agent.log")
+LOG_DB = os.getenv("LOG_DB", "logs/agent.db")
+# spans raíz de una respuesta completa; 'llm', 'orchestrate', etc. van anidados dentro
+ETAPAS_RESPUESTA = ("consultar", "orquestar", "batch")
 
-@st.cache_data
-def load_logs(path):
-    rows = []
-    if not os.path.exists(path):
-        return pd.DataFrame(rows)
-    with open(path,'r',encoding='utf-8') as f:
-        for line in f:
-            try:
-                j = json.loads(line)
-                if isinstance(j.get("message"), str):
-                    try:
-                        inner = json.loads(j["message"])
-                        j.update(inner)
-                    except:
-                        pass
-                rows.append(j)
-            except:
-                continue
-    return pd.DataFrame(rows)
+def query(conn, sql, params=()):
+    return pd.read_sql_query(sql, conn, params=params)
 
 st.title("Dashboard Observabilidad - Agente Univ.")
 
-df = load_logs(LOG_PATH)
-st.write("Registros cargados:", len(df))
+conn = log_store.connect(LOG_DB)
+# solo se parsean las líneas agregadas al log desde la última vez
+nuevos = log_store.ingest(LOG_PATH, conn)
+roles = query(conn, "SELECT * FROM agg_role")
+total_requests = int(roles["n"].sum()) if len(roles) else 0
+st.write("Registros cargados:", total_requests, f"(+{nuevos} nuevos)")
 
-if len(df)==0:
+if total_requests == 0:
     st.info("No hay logs. Ejecuta el agente para generar registros.")
 else:
-    avg_latency = df["latency_ms"].dropna().astype(float).mean()
-    total_requests = len(df)
-    total_tokens = df["tokens_used"].dropna().astype(float).sum()
-    st.metric("Latencia media (ms)", round(avg_latency or 0,2))
+    # 'llm' y 'orquestar' tienen ambos role=assistant: la latencia de una respuesta
+    # sale solo de las etapas raíz, no de todos los registros 'assistant'
+    todo = pd.DataFrame(log_store.stage_percentiles(conn))
+    resp = todo[todo["stage"].isin(ETAPAS_RESPUESTA)] if len(todo) else todo
+    lat_n = int(resp["n"].sum()) if len(resp) else 0
+    avg_latency = float((resp["mean_ms"] * resp["n"]).sum()) / lat_n if lat_n else 0
+    ttft_n = int(roles["ttft_n"].sum())
+    total_tokens = int(roles["tokens_sum"].sum())
+    st.metric("Latencia media por respuesta (ms)", round(avg_latency, 2))
+    st.metric("Tiempo al primer token medio (ms)", round(float(roles["ttft_sum"].sum()) / ttft_n, 2) if ttft_n else 0)
     st.metric("Total registros", total_requests)
-    st.metric("Tokens usados (total)", int(total_tokens or 0))
+    st.metric("Tokens usados (total)", total_tokens)
+
+
+    ventanas = {"Última hora": 3600, "Últimas 24 h": 86400, "Últimos 7 días": 7 * 86400, "Todo": None}
+    ventana = st.selectbox("Ventana", list(ventanas), index=1)
+    desde = time.time() - ventanas[ventana] if ventanas[ventana] else 0.0
 
+    # todo lo siguiente sale de los rollups por minuto (sketches fusionados), no de los eventos
+    st.subheader("Latencia por etapa (ms)")
+    etapas = pd.DataFrame(log_store.stage_percentiles(conn, desde))
+    if len(etapas):
+        st.dataframe(etapas.set_index("stage").round(2))
 
-    st.subheader("Distribución latencia (ms)")
-    fig, ax = plt.subplots()
-    df["latency_ms"].dropna().astype(float).hist(bins=30, ax=ax)
-    st.pyplot(fig)
+        st.subheader("Latencia por minuto")
+        opciones = etapas["stage"].tolist()
+        etapa = st.selectbox("Etapa", opciones, index=opciones.index("llm") if "llm" in opciones else 0)
+        q = st.radio("Cuantil", [0.5, 0.95, 0.99], index=1, horizontal=True)
+        serie = pd.DataFrame(log_store.stage_timeseries(conn, etapa, desde, q))
+        if len(serie):
+            serie["minute"] = pd.to_datetime(serie["minute"], unit="s")
+            st.line_chart(serie.set_index("minute")[f"p{int(q * 100)}_ms"])
+
+    st.subheader("Solicitudes por minuto")
+    tp = pd.DataFrame(log_store.throughput(conn, desde), columns=["minute", "solicitudes"])
+    if len(tp):
+        tp["minute"] = pd.to_datetime(tp["minute"], unit="s")
+        st.line_chart(tp.set_index("minute"))
+
+    if len(etapas):
+        # un span raíz por trace; los tokens salen de las etapas internas (llm, agent, fusion)
+        n_traces = int(etapas["roots"].sum())
+        st.metric("Tokens por trace (media)", round(int(etapas["tokens"].sum()) / n_traces, 1) if n_traces else 0)
 
     st.subheader("Eventos por role")
-    counts = df['role'].value_counts()
-    st.bar_chart(counts)
+    st.bar_chart(roles.set_index("role")["n"])
+
 
+    st.subheader("Traces más lentos")
+    lentos = pd.DataFrame(log_store.slowest_traces(conn, desde),
+                          columns=["trace_id", "inicio", "latency_ms", "tokens", "eventos", "errores"])
+    lentos["inicio"] = pd.to_datetime(lentos["inicio"], unit="s")
+    st.dataframe(lentos)
 
     st.subheader("Detalle por trace_id")
-    trace_ids = df['trace_id'].dropna().unique().tolist()
-    sel = st.selectbox("Selecciona trace_id", options=["--"]+trace_ids)
-    if sel and sel!="--":
-        sub = df[df['trace_id']==sel].sort_values('asctime')
-        st.dataframe(sub[['asctime','role','message','latency_ms','tokens_used','tool']])
+    recientes = query(conn, "SELECT trace_id FROM traces ORDER BY start_ts DESC LIMIT 500")
+    opciones = list(dict.fromkeys(lentos["trace_id"].tolist() + recientes["trace_id"].tolist()))
+    sel = st.selectbox("Selecciona trace_id", options=["--"] + opciones)
+    if sel and sel != "--":
+        sub = query(conn, """
+            SELECT datetime(ts, 'unixepoch', 'localtime') AS asctime, role, stage, message,
+                   latency_ms, ttft_ms, tokens_used, tool
+            FROM events WHERE trace_id = ? ORDER BY ts
+        """, (sel,))
+        st.dataframe(sub)
@@ -0,0 +1,260 @@
+"""
+Recuperación densa (embeddings) para el RAG local.
+
+Los vectores de los chunks se guardan como una matriz float32 en disco (.npy,
+abierta con mmap) junto a un sidecar con el hash de contenido de cada fila;
+al cambiar el índice léxico solo se vuelven a embeber los chunks cuyo hash
+no estaba en la generación anterior. La búsqueda exacta es un producto
+matriz-vector; para corpus grandes hay un modo aproximado tipo IVF.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag_index import IndexSnapshot
+
+_CURRENT = "CURRENT"
+
+
+class Embedder(ABC):
+    """Interfaz de embedder local: devuelve vectores float32 normalizados (L2)."""
+    nombre = "base"
+    dim = 0
+
+    @abstractmethod
+    def embed(self, textos: Sequence[str]) -> np.ndarray:
+        """Matriz (len(textos), dim) float32 con filas de norma 1."""
+
+
+class HashingEmbedder(Embedder):
+    """
+    Embedder determinista por feature hashing de palabras y n-gramas de
+    caracteres. No necesita modelo ni red; pensado para pruebas y como base.
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+        self.nombre = f"hashing-{dim}-{ngram}"
+        self._cache: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, feat: str) -> Tuple[int, float]:
+        hit = self._cache.get(feat)
+        if hit is None:
+            h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+            hit = (h % self.dim, 1.0 if (h >> 63) & 1 else -1.0)
+            if len(self._cache) < 200_000:
+                self._cache[feat] = hit
+        return hit
+
+    def _features(self, texto: str) -> List[str]:
+        feats = []
+        for tok in re.findall(r"[a-záéíóúñ0-9]+", (texto or "").lower()):
+            feats.append("w:" + tok)
+            padded = f"#{tok}#"
+            for i in range(max(len(padded) - self.ngram + 1, 1)):
+                feats.append("c:" + padded[i : i + self.ngram])
+        return feats
+
+    def embed(self, textos: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(textos), self.dim), dtype=np.float32)
+        for i, texto in enumerate(textos):
+            for feat in self._features(texto):
+                j, signo = self._bucket(feat)
+                out[i, j] += signo
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Embedder con un modelo local de sentence-transformers (dependencia opcional)."""
+
+    def __init__(self, model_name: str = "paraphrase-multilingual-MiniLM-L12-v2", batch_size: int = 64):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "Falta el paquete opcional sentence-transformers para usar este embedder"
+            ) from e
+        self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.dim = int(self.model.get_sentence_embedding_dimension())
+        self.nombre = "st-" + re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+
+    def embed(self, textos: Sequence[str]) -> np.ndarray:
+        vecs = self.model.encode(
+            list(textos), batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False
+        )
+        return np.asarray(vecs, dtype=np.float32)
+
+
+def embedder_desde_config(spec: str) -> Embedder:
+    """'hashing', 'hashing:512' o 'st:<modelo>'."""
+    tipo, _, arg = (spec or "hashing").partition(":")
+    if tipo == "hashing":
+        return HashingEmbedder(dim=int(arg) if arg else 256)
+    if tipo == "st":
+        return SentenceTransformerEmbedder(arg) if arg else SentenceTransformerEmbedder()
+    raise ValueError(f"Embedder desconocido: {spec}")
+
+
+def _load_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """k-means esférico simple (vectores normalizados, similitud coseno)."""
+    rng = np.random.default_rng(seed)
+    cent = np.array(x[rng.choice(x.shape[0], size=k, replace=False)], dtype=np.float32)
+    asign = np.zeros(x.shape[0], dtype=np.int64)
+    for _ in range(iters):
+        for ini in range(0, x.shape[0], 65536):
+            asign[ini : ini + 65536] = np.argmax(x[ini : ini + 65536] @ cent.T, axis=1)
+        for c in range(k):
+            miembros = x[asign == c]
+            if miembros.shape[0]:
+                v = miembros.sum(axis=0)
+                n = np.linalg.norm(v)
+                if n > 0:
+                    cent[c] = v / n
+    return cent, asign
+
+
+class DenseSnapshot:
+    """Vectores de una generación del índice léxico (fila i = chunk id i)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.generation: int = meta["generation"]
+        self.vectors = _load_array(os.path.join(path, "vectors.npy"))
+        self.hashes = _load_array(os.path.join(path, "ids.npy"))
+        self.centroids: Optional[np.ndarray] = None
+        self.ivf_order: Optional[np.ndarray] = None
+        self.ivf_offsets: Optional[np.ndarray] = None
+        if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+            self.centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            self.ivf_order = _load_array(os.path.join(path, "ivf_order.npy"))
+            self.ivf_offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+
+    def buscar(self, q: np.ndarray, aproximado: bool = False, nprobe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunk ids candidatos y su similitud coseno con `q`."""
+        if self.vectors.shape[0] == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if aproximado and self.centroids is not None:
+            probes = np.argsort(-(self.centroids @ q))[:nprobe]
+            ids = np.concatenate(
+                [self.ivf_order[self.ivf_offsets[c] : self.ivf_offsets[c + 1]] for c in probes]
+            ).astype(np.int64)
+            return ids, np.asarray(self.vectors[ids] @ q)
+        return np.arange(self.vectors.shape[0]), np.asarray(self.vectors @ q)
+
+
+class DenseIndex:
+    """
+    Mantiene en `index_dir/dense/<embedder>` los vectores alineados con la
+    generación vigente del índice léxico.
+    """
+
+    def __init__(self, index_dir: str, embedder: Embedder, ivf_min_chunks: int = 4096, batch_size: int = 256):
+        self.embedder = embedder
+        self.dir = os.path.join(index_dir, "dense", embedder.nombre)
+        self.ivf_min_chunks = ivf_min_chunks
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._snapshot: Optional[DenseSnapshot] = None
+
+    def para(self, snap: IndexSnapshot) -> DenseSnapshot:
+        key = ("denso", self.embedder.nombre)
+        dense = snap.cache.get(key)
+        if dense is None:
+            with self._lock:
+                dense = snap.cache.get(key)
+                if dense is None:
+                    dense = snap.cache[key] = self._sincronizar(snap)
+        return dense
+
+    def _load_current(self) -> Optional[DenseSnapshot]:
+        try:
+            with open(os.path.join(self.dir, _CURRENT), "r", encoding="utf-8") as f:
+                return DenseSnapshot(os.path.join(self.dir, f.read().strip()))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _sincronizar(self, snap: IndexSnapshot) -> DenseSnapshot:
+        old = self._snapshot or self._load_current()
+        if old is not None and old.generation == snap.generation:
+            self._snapshot = old
+            return old
+
+        hashes = np.asarray(snap.chunk_hash, dtype=np.uint64)
+        vectors = np.zeros((hashes.shape[0], self.embedder.dim), dtype=np.float32)
+        faltan = np.ones(hashes.shape[0], dtype=bool)
+        if old is not None and old.hashes.shape[0] and old.vectors.shape[1] == self.embedder.dim:
+            # solo se reutilizan filas cuyo contenido (hash) no cambió
+            old_hashes = np.asarray(old.hashes)
+            orden = np.argsort(old_hashes, kind="stable")
+            pos = np.searchsorted(old_hashes[orden], hashes)
+            pos = np.minimum(pos, orden.shape[0] - 1)
+            hit = old_hashes[orden[pos]] == hashes
+            vectors[hit] = old.vectors[orden[pos[hit]]]
+            faltan = ~hit
+
+        pendientes = np.flatnonzero(faltan)
+        for ini in range(0, pendientes.shape[0], self.batch_size):
+            ids = pendientes[ini : ini + self.batch_size]
+            vectors[ids] = self.embedder.embed([snap.chunk_text(int(c)) for c in ids])
+
+        nombre = f"gen-{snap.generation:06d}-{uuid.uuid4().hex[:8]}"
+        destino = os.path.join(self.dir, nombre)
+        os.makedirs(destino, exist_ok=True)
+        np.save(os.path.join(destino, "vectors.npy"), vectors)
+        np.save(os.path.join(destino, "ids.npy"), hashes)
+        if vectors.shape[0] >= self.ivf_min_chunks:
+            k = max(1, int(np.sqrt(vectors.shape[0])))
+            cent, asign = _kmeans(vectors, k)
+            orden = np.argsort(asign, kind="stable")
+            offsets = np.zeros(k + 1, dtype=np.int64)
+            np.cumsum(np.bincount(asign, minlength=k), out=offsets[1:])
+            np.save(os.path.join(destino, "ivf_centroids.npy"), cent)
+            np.save(os.path.join(destino, "ivf_order.npy"), orden.astype(np.int64))
+            np.save(os.path.join(destino, "ivf_offsets.npy"), offsets)
+        with open(os.path.join(destino, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"generation": snap.generation, "embedder": self.embedder.nombre, "dim": self.embedder.dim,
+                 "reembebidos": int(pendientes.shape[0])},
+                f,
+            )
+        tmp = os.path.join(self.dir, f"{_CURRENT}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(nombre)
+        os.replace(tmp, os.path.join(self.dir, _CURRENT))
+
+        for d in sorted(x for x in os.listdir(self.dir) if x.startswith("gen-"))[:-2]:
+            if d != nombre:
+                shutil.rmtree(os.path.join(self.dir, d), ignore_errors=True)
+
+        self._snapshot = DenseSnapshot(destino)
+        return self._snapshot
+
+
+def fusion_rrf(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion: suma 1/(k + rango) de cada lista."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rango, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rango)
+    return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
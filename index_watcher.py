@@ -0,0 +1,143 @@
+"""
+Recarga en caliente del índice RAG.
+
+Un hilo en segundo plano detecta archivos agregados, modificados o borrados
+bajo DATA_DIR y llama a `InvertedIndex.refresh` fuera del camino de las
+consultas: mientras se construye la generación nueva, `snapshot()` sigue
+devolviendo la anterior, y el cambio es un reemplazo atómico de referencia.
+Con watchdog (inotify/FSEvents/kqueue) solo se revisan los archivos
+tocados, juntando ráfagas de eventos durante `debounce_s`, y cada
+`resync_s` se hace una pasada completa por si se perdió algún evento. Sin
+watchdog se sondea el directorio cada `intervalo` segundos: solo se listan
+nombres, mtimes y tamaños, y `refresh` corre únicamente si algo cambió.
+"""
+import os
+import threading
+from typing import List, Optional, Set, Tuple
+
+import ingest
+from rag_index import InvertedIndex
+from tracing import event
+
+
+class IndexWatcher:
+    def __init__(self, indice: InvertedIndex, debounce_s: float = 0.5, intervalo: Optional[float] = None,
+                 resync_s: float = 300.0):
+        self.indice = indice
+        self.debounce_s = debounce_s
+        self.intervalo = intervalo if intervalo is not None else indice.refresh_interval
+        self.resync_s = resync_s
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._pendientes: Set[str] = set()
+        self._completo = False
+        self._observer = None
+        self._hilo: Optional[threading.Thread] = None
+        # (nombre, mtime_ns, tamaño) de data/ en el último sondeo, para no refrescar si nada cambió
+        self._firma: Optional[List[Tuple[str, int, int]]] = None
+
+    @property
+    def modo(self) -> str:
+        return "watchdog" if self._observer is not None else "polling"
+
+    def start(self) -> "IndexWatcher":
+        try:
+            self._observer = self._crear_observer()
+        except (ImportError, OSError) as e:
+            # sin watchdog, o sin inotify disponible (límite de watches, FS de red)
+            event("system", f"index_watch_polling: {e}", tool="index_watcher")
+            self._observer = None
+        self.indice.auto_refresh = False
+        self._hilo = threading.Thread(target=self._loop, name="index-watcher", daemon=True)
+        self._hilo.start()
+        return self
+
+    def stop(self) -> None:
+        self._parar.set()
+        self._despertar.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=2)
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+        self.indice.auto_refresh = True
+
+    def resincronizar(self) -> None:
+        """Pide una pasada completa por DATA_DIR en segundo plano (p. ej. tras un arranque en caliente)."""
+        with self._lock:
+            self._completo = True
+        self._despertar.set()
+
+    def _crear_observer(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, ev):
+                if ev.event_type in ("opened", "closed_no_write"):
+                    return
+                watcher._on_evento(ev.src_path, ev.is_directory)
+                if getattr(ev, "dest_path", ""):
+                    watcher._on_evento(ev.dest_path, ev.is_directory)
+
+        os.makedirs(self.indice.data_dir, exist_ok=True)
+        observer = Observer()
+        observer.schedule(_Handler(), self.indice.data_dir, recursive=True)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def _on_evento(self, path: str, es_dir: bool) -> None:
+        path = os.fsdecode(path)
+        if os.path.abspath(path).startswith(os.path.abspath(self.indice.index_dir) + os.sep):
+            return
+        nombre = os.path.relpath(path, self.indice.data_dir).replace(os.sep, "/")
+        if nombre.startswith("..") or any(p.startswith(".") for p in nombre.split("/")):
+            return
+        with self._lock:
+            if es_dir:
+                # un directorio creado, movido o borrado arrastra archivos sin evento propio
+                self._completo = True
+            elif ingest.soportado(nombre):
+                self._pendientes.add(nombre)
+            else:
+                return
+        self._despertar.set()
+
+    def _loop(self) -> None:
+        while not self._parar.is_set():
+            hubo = self._despertar.wait(self.resync_s if self._observer is not None else self.intervalo)
+            if self._parar.is_set():
+                break
+            if hubo:
+                self._parar.wait(self.debounce_s)  # junta la ráfaga (editores que guardan en varios pasos)
+            with self._lock:
+                self._despertar.clear()
+                tocados, self._pendientes = self._pendientes, set()
+                completo, self._completo = self._completo, False
+            incremental = hubo and not completo and self._observer is not None
+            try:
+                if self._observer is None:
+                    firma = self._firmar()
+                    if firma == self._firma and not completo:
+                        continue
+                    self.indice.refresh()
+                    self._firma = firma
+                else:
+                    self.indice.refresh(tocados if incremental else None)
+            except Exception as e:
+                self._firma = None
+                event("system", f"index_watch_error: {type(e).__name__}: {e}", tool="index_watcher")
+
+    def _firmar(self) -> List[Tuple[str, int, int]]:
+        firma = []
+        for nombre, path in self.indice.listar_fuentes():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            firma.append((nombre, st.st_mtime_ns, st.st_size))
+        return firma
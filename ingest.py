@@ -0,0 +1,226 @@
+"""
+Extracción de texto del corpus (txt, md, HTML, DOCX, PDF).
+
+Cada extensión tiene un extractor `bytes -> str` registrado en EXTRACTORES;
+se agregan otros con `registrar_extractor`. Los formatos livianos (texto
+plano) se decodifican en el proceso; el resto corre en un
+ProcessPoolExecutor. El texto extraído se guarda en un caché por hash de
+contenido, así que un archivo que no cambió (o que volvió a su versión
+anterior) no se vuelve a extraer. Los fallos no se descartan en silencio:
+`extraer_lote` devuelve el error de cada archivo que no se pudo leer.
+
+HTML y DOCX se leen con la biblioteca estándar; PDF necesita el paquete
+opcional pypdf.
+"""
+import io
+import os
+import re
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from xml.etree import ElementTree
+
+ExtractFn = Callable[[bytes], str]
+
+
+class ExtraccionError(Exception):
+    pass
+
+
+def _texto_plano(data: bytes) -> str:
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise ExtraccionError(f"No es UTF-8 válido (byte {e.start})") from e
+
+
+class _HTMLATexto(HTMLParser):
+    _BLOQUES = {"p", "div", "br", "li", "tr", "section", "article", "table", "ul", "ol", "pre", "blockquote"}
+    _OMITIR = {"script", "style", "noscript", "template", "head"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.partes: List[str] = []
+        self._omitir = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._OMITIR:
+            self._omitir += 1
+        elif re.fullmatch(r"h[1-6]", tag):
+            # los encabezados se marcan como en markdown para que el chunker corte ahí
+            self.partes.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag in self._BLOQUES:
+            self.partes.append("\n- " if tag == "li" else "\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._OMITIR:
+            self._omitir = max(0, self._omitir - 1)
+        elif re.fullmatch(r"h[1-6]", tag) or (tag in self._BLOQUES and tag != "li"):
+            self.partes.append("\n")
+
+    def handle_data(self, data):
+        if not self._omitir:
+            self.partes.append(data)
+
+
+def _html(data: bytes) -> str:
+    m = re.search(rb"<meta[^>]+charset=[\"']?([A-Za-z0-9_-]+)", data[:2048], re.IGNORECASE)
+    try:
+        html = data.decode(m.group(1).decode() if m else "utf-8", errors="replace")
+    except LookupError:
+        html = data.decode("utf-8", errors="replace")
+    p = _HTMLATexto()
+    p.feed(html)
+    p.close()
+    texto = re.sub(r"[ \t\r\f\v]+", " ", "".join(p.partes))
+    return re.sub(r"\n\s*\n\s*", "\n\n", texto).strip()
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx(data: bytes) -> str:
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            root = ElementTree.fromstring(z.read("word/document.xml"))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ExtraccionError(f"DOCX inválido: {e}") from e
+    parrafos = []
+    for p in root.iter(_W + "p"):
+        texto = "".join(
+            n.text or "" if n.tag == _W + "t" else "\t" if n.tag == _W + "tab" else "\n"
+            for n in p.iter() if n.tag in (_W + "t", _W + "tab", _W + "br")
+        )
+        estilo = p.find(f"{_W}pPr/{_W}pStyle")
+        nivel = re.search(r"(?:heading|ttulo|titulo)\s*(\d)", (estilo.get(_W + "val") or "").lower()) \
+            if estilo is not None else None
+        if nivel and texto.strip():
+            texto = "#" * int(nivel.group(1)) + " " + texto
+        parrafos.append(texto)
+    return "\n\n".join(t for t in parrafos if t.strip())
+
+
+def _pdf(data: bytes) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise ExtraccionError("Falta el paquete opcional pypdf para leer PDF") from e
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        texto = "\n\n".join((page.extract_text() or "").strip() for page in reader.pages)
+    except Exception as e:  # pypdf lanza varios tipos propios ante archivos dañados
+        raise ExtraccionError(f"PDF ilegible: {e}") from e
+    if not texto.strip():
+        raise ExtraccionError("PDF sin texto extraíble (¿escaneado?)")
+    return texto
+
+
+EXTRACTORES: Dict[str, ExtractFn] = {
+    ".txt": _texto_plano,
+    ".md": _texto_plano,
+    ".html": _html,
+    ".htm": _html,
+    ".docx": _docx,
+    ".pdf": _pdf,
+}
+# se extraen en el proceso: no vale la pena mandarlos al pool ni cachearlos
+LIVIANOS: Set[str] = {".txt", ".md"}
+
+
+def registrar_extractor(ext: str, fn: ExtractFn, liviano: bool = False) -> None:
+    ext = ext.lower() if ext.startswith(".") else "." + ext.lower()
+    EXTRACTORES[ext] = fn
+    (LIVIANOS.add if liviano else LIVIANOS.discard)(ext)
+
+
+def extension(nombre: str) -> str:
+    return os.path.splitext(nombre)[1].lower()
+
+
+def soportado(nombre: str) -> bool:
+    return extension(nombre) in EXTRACTORES
+
+
+def _extraer(ext: str, data: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """(texto, error). Corre en los procesos del pool: no lanza excepciones."""
+    try:
+        return EXTRACTORES[ext](data), None
+    except ExtraccionError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class CacheExtraccion:
+    """Texto extraído por sha1 del contenido, un archivo por entrada."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _archivo(self, sha1: str) -> str:
+        return os.path.join(self.path, sha1 + ".txt")
+
+    def get(self, sha1: str) -> Optional[str]:
+        try:
+            with open(self._archivo(sha1), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, sha1: str, texto: str) -> None:
+        tmp = self._archivo(sha1) + f".{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(texto)
+        os.replace(tmp, self._archivo(sha1))
+
+    def podar(self, vigentes: Iterable[str]) -> None:
+        vivos = {s + ".txt" for s in vigentes}
+        for nombre in os.listdir(self.path):
+            if nombre not in vivos and not nombre.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.path, nombre))
+                except OSError:
+                    pass
+
+
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+
+
+def extraer_lote(items: Sequence[Tuple[str, bytes, str]],
+                 cache: Optional[CacheExtraccion] = None,
+                 workers: Optional[int] = None) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    items = [(nombre, contenido, sha1)]. Devuelve {nombre: (texto, error)},
+    con exactamente uno de los dos en None.
+    """
+    out: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    pesados: List[Tuple[str, bytes, str]] = []
+    for nombre, data, sha1 in items:
+        ext = extension(nombre)
+        if ext not in EXTRACTORES:
+            out[nombre] = (None, f"Formato no soportado: {ext or nombre}")
+        elif ext in LIVIANOS:
+            out[nombre] = _extraer(ext, data)
+        else:
+            texto = cache.get(sha1) if cache is not None else None
+            if texto is not None:
+                out[nombre] = (texto, None)
+            else:
+                pesados.append((nombre, data, sha1))
+
+    workers = min(workers or INGEST_WORKERS, len(pesados))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            resultados = list(pool.map(_extraer, [extension(n) for n, _, _ in pesados], [d for _, d, _ in pesados],
+                                       chunksize=max(1, len(pesados) // (workers * 4))))
+    else:
+        resultados = [_extraer(extension(n), d) for n, d, _ in pesados]
+
+    for (nombre, _, sha1), (texto, error) in zip(pesados, resultados):
+        if texto is not None and cache is not None:
+            cache.put(sha1, texto)
+        out[nombre] = (texto, error)
+    return out
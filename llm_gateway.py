@@ -0,0 +1,359 @@
+"""
+Gateway de llamadas al modelo (chat completions), compartido por consultar,
+los agentes y la fusión.
+
+- Pool HTTP (httpx) con conexiones keep-alive acotadas y timeouts explícitos.
+- Plazo por llamada: `timeout` es el tiempo total, reintentos incluidos.
+- Reintentos con backoff exponencial y jitter completo ante 429, 5xx,
+  errores de conexión y timeouts; se respeta Retry-After si cabe en el plazo.
+- Hedging opcional: si una llamada sin stream supera el p95 reciente de su
+  etapa, se lanza un duplicado y gana la primera respuesta.
+- Circuit breaker: tras LLM_BREAKER_FAILURES fallos seguidos del upstream
+  se rechaza de inmediato (CircuitOpenError) durante LLM_BREAKER_RESET_S; luego
+  pasa una sola llamada de prueba. Quien llama responde con la caché o con
+  una respuesta degradada en vez de quedarse esperando.
+- Límite de llamadas simultáneas por etapa ("consultar", "agent", "fusion").
+
+Los sitios de llamada usan `chat_completion(client, etapa, **kwargs)`, que
+también acepta un cliente OpenAI común (sin gateway). openai y httpx se
+importan al crear el primer gateway, no al importar el módulo.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from tracing import current_span
+
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "0.5"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "8"))
+# 1 = duplicar llamadas que superan el p95 de su etapa
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "200"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+# "etapa:n,etapa:n"; las etapas sin entrada usan LLM_STAGE_DEFAULT
+LLM_STAGE_LIMITS = os.getenv("LLM_STAGE_LIMITS", "consultar:8,agent:8,fusion:4")
+LLM_STAGE_DEFAULT = int(os.getenv("LLM_STAGE_DEFAULT", "8"))
+
+
+class LLMGatewayError(Exception):
+    pass
+
+
+class CircuitOpenError(LLMGatewayError):
+    pass
+
+
+class StageBusyError(LLMGatewayError):
+    pass
+
+
+def _limites(spec: str) -> Dict[str, int]:
+    out = {}
+    for parte in (spec or "").split(","):
+        if parte.strip():
+            etapa, _, n = parte.partition(":")
+            out[etapa.strip()] = int(n)
+    return out
+
+
+def _reintentable(e: BaseException) -> bool:
+    import openai
+
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    valor = resp.headers.get("retry-after") if resp is not None else None
+    try:
+        return float(valor) if valor else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Cerrado -> abierto tras `fallos` seguidos -> semiabierto (una prueba) tras `reset_s`."""
+
+    def __init__(self, fallos: int = 5, reset_s: float = 30.0):
+        self.fallos = fallos
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._seguidos = 0
+        self._abierto_hasta = 0.0
+        self._probando = False
+        self.aperturas = 0
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._seguidos < self.fallos:
+                return "cerrado"
+            return "abierto" if time.monotonic() < self._abierto_hasta else "semiabierto"
+
+    def permitir(self) -> Tuple[bool, bool]:
+        """(se puede llamar, esta llamada tomó el turno de prueba del semiabierto)."""
+        with self._lock:
+            if self._seguidos < self.fallos:
+                return True, False
+            if time.monotonic() < self._abierto_hasta or self._probando:
+                return False, False
+            self._probando = True
+            return True, True
+
+    def abierto(self) -> bool:
+        with self._lock:
+            return self._seguidos >= self.fallos and time.monotonic() < self._abierto_hasta
+
+    def soltar(self) -> None:
+        """Devuelve el turno de prueba si la llamada que lo tomó no llegó a hacerse."""
+        with self._lock:
+            self._probando = False
+
+    def exito(self) -> None:
+        with self._lock:
+            self._seguidos = 0
+            self._probando = False
+
+    def fallo(self) -> None:
+        with self._lock:
+            self._seguidos += 1
+            if self._seguidos >= self.fallos and (self._probando or self._seguidos == self.fallos):
+                self._abierto_hasta = time.monotonic() + self.reset_s
+                self.aperturas += 1
+            self._probando = False
+
+
+class _Latencias:
+    """
+    Ventana de latencias exitosas por etapa; el p95 se recalcula cada 16
+    muestras. Sin lock propio: el gateway la actualiza con su `_lock`.
+    """
+
+    def __init__(self, n: int = 256):
+        self._v: Deque[float] = deque(maxlen=n)
+        self._p95: Optional[float] = None
+        self._nuevas = 0
+
+    def agregar(self, ms: float) -> None:
+        self._v.append(ms)
+        self._nuevas += 1
+        if self._nuevas >= 16:
+            self._nuevas = 0
+            orden = sorted(self._v)
+            self._p95 = orden[int(0.95 * (len(orden) - 1))]
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self._p95
+
+
+class LLMGateway:
+    def __init__(self, api_key: str, base_url: Optional[str] = None, timeout_s: float = LLM_TIMEOUT_S,
+                 max_retries: int = LLM_MAX_RETRIES, hedge: bool = LLM_HEDGE,
+                 stage_limits: Optional[Dict[str, int]] = None, default_limit: int = LLM_STAGE_DEFAULT,
+                 breaker: Optional[CircuitBreaker] = None, wrap: Optional[Callable[[Any], Any]] = None):
+        import httpx
+        from openai import OpenAI
+
+        self.timeout_s = timeout_s
+        self.max_retries = max_retries
+        self.hedge = hedge
+        limites = stage_limits if stage_limits is not None else _limites(LLM_STAGE_LIMITS)
+        self.default_limit = default_limit
+        self._limites = dict(limites)
+        self._sems: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S)
+        self._latencias: Dict[str, _Latencias] = {}
+        self._en_curso: Dict[str, int] = {}
+        self._contadores = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "rejected": 0, "errors": 0}
+
+        conexiones = sum(limites.values()) + default_limit
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_connections=conexiones * (2 if hedge else 1),
+                                max_keepalive_connections=conexiones, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(timeout_s, connect=LLM_CONNECT_TIMEOUT_S),
+        )
+        # los reintentos los maneja el gateway (con plazo total), no el SDK
+        self._client = OpenAI(api_key=api_key, base_url=base_url, http_client=self._http, max_retries=0)
+        if wrap is not None:
+            # p. ej. langsmith.wrappers.wrap_openai para trazar las llamadas
+            self._client = wrap(self._client)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=conexiones, thread_name_prefix="llm-hedge") \
+            if hedge else None
+
+    def _sem(self, etapa: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._sems.get(etapa)
+            if sem is None:
+                sem = self._sems[etapa] = threading.BoundedSemaphore(self._limites.get(etapa, self.default_limit))
+                self._latencias[etapa] = _Latencias()
+                self._en_curso[etapa] = 0
+            return sem
+
+    def _contar(self, clave: str, n: int = 1) -> None:
+        with self._lock:
+            self._contadores[clave] += n
+
+    def _ocupar(self, etapa: str, plazo: float, prueba: bool) -> threading.BoundedSemaphore:
+        sem = self._sem(etapa)
+        if not sem.acquire(timeout=max(0.0, plazo - time.monotonic())):
+            # solo quien tomó el turno de prueba lo devuelve; si no, liberaría el de otro hilo
+            if prueba:
+                self.breaker.soltar()
+            self._contar("rejected")
+            raise StageBusyError(f"Etapa '{etapa}' sin cupo para llamar al modelo dentro del plazo")
+        with self._lock:
+            self._en_curso[etapa] += 1
+        return sem
+
+    def _liberar(self, etapa: str, sem: threading.BoundedSemaphore) -> None:
+        with self._lock:
+            self._en_curso[etapa] -= 1
+        sem.release()
+
+    def create(self, etapa: str, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """chat.completions.create con plazo, reintentos, hedging, breaker y cupo por etapa."""
+        plazo = time.monotonic() + (timeout or self.timeout_s)
+        permitido, prueba = self.breaker.permitir()
+        if not permitido:
+            self._contar("rejected")
+            raise CircuitOpenError("Servicio del modelo no disponible (circuit breaker abierto)")
+        self._contar("calls")
+        if kwargs.get("stream"):
+            return self._stream(etapa, plazo, kwargs, prueba)
+        sem = self._ocupar(etapa, plazo, prueba)
+        try:
+            return self._con_reintentos(etapa, plazo, lambda: self._hedged(etapa, plazo, kwargs))
+        finally:
+            self._liberar(etapa, sem)
+
+    def _stream(self, etapa: str, plazo: float, kwargs: Dict[str, Any], prueba: bool) -> Iterator[Any]:
+        # el cupo se mantiene mientras se consume el stream; los reintentos, solo antes del primer chunk
+        sem = self._ocupar(etapa, plazo, prueba)
+        try:
+            stream = self._con_reintentos(etapa, plazo, lambda: self._llamar(etapa, plazo, kwargs))
+        except BaseException:
+            self._liberar(etapa, sem)
+            raise
+
+        def iterar():
+            try:
+                yield from stream
+            finally:
+                # si el consumidor corta antes, se cierra la respuesta y vuelve la conexión al pool
+                if hasattr(stream, "close"):
+                    stream.close()
+                self._liberar(etapa, sem)
+
+        return iterar()
+
+    def _llamar(self, etapa: str, plazo: float, kwargs: Dict[str, Any]) -> Any:
+        restante = plazo - time.monotonic()
+        if restante <= 0:
+            raise self._timeout()
+        t0 = time.perf_counter()
+        resp = self._client.chat.completions.create(timeout=restante, **kwargs)
+        if not kwargs.get("stream"):
+            # la llaman a la vez los hilos de la etapa y los del hedging
+            with self._lock:
+                self._latencias[etapa].agregar((time.perf_counter() - t0) * 1000)
+        return resp
+
+    def _timeout(self) -> Exception:
+        import httpx
+        import openai
+
+        return openai.APITimeoutError(request=httpx.Request("POST", str(self._client.base_url)))
+
+    def _hedged(self, etapa: str, plazo: float, kwargs: Dict[str, Any]) -> Any:
+        with self._lock:
+            p95 = self._latencias[etapa].p95 if self.hedge else None
+        if p95 is None:
+            return self._llamar(etapa, plazo, kwargs)
+        primera = self._hedge_pool.submit(self._llamar, etapa, plazo, kwargs)
+        hechos, _ = wait([primera], timeout=max(p95, LLM_HEDGE_MIN_MS) / 1000.0)
+        # el duplicado solo sale si la etapa tiene cupo libre: el hedging no debe agravar la congestión
+        sem = self._sems[etapa]
+        if hechos or not sem.acquire(blocking=False):
+            return primera.result()
+        try:
+            self._contar("hedges")
+            sp = current_span()
+            if sp is not None:
+                sp.set(hedged=True)
+            segunda = self._hedge_pool.submit(self._llamar, etapa, plazo, kwargs)
+            pendientes = {primera, segunda}
+            error: Optional[BaseException] = None
+            while pendientes:
+                hechos, pendientes = wait(pendientes, timeout=max(0.0, plazo - time.monotonic()),
+                                          return_when=FIRST_COMPLETED)
+                if not hechos:
+                    break
+                for f in hechos:
+                    if f.exception() is None:
+                        if f is segunda:
+                            self._contar("hedge_wins")
+                        return f.result()
+                    error = f.exception()
+            raise error or self._timeout()
+        finally:
+            sem.release()
+
+    def _con_reintentos(self, etapa: str, plazo: float, fn: Callable[[], Any]) -> Any:
+        intento = 0
+        while True:
+            try:
+                resp = fn()
+            except Exception as e:
+                if not _reintentable(e):
+                    # el upstream respondió (p. ej. 400): no cuenta como caída
+                    self.breaker.exito()
+                    raise
+                self.breaker.fallo()
+                espera = random.uniform(0, min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_S * 2 ** intento))
+                espera = max(espera, _retry_after(e) or 0.0)
+                if intento >= self.max_retries or time.monotonic() + espera >= plazo or self.breaker.abierto():
+                    self._contar("errors")
+                    raise
+                intento += 1
+                self._contar("retries")
+                sp = current_span()
+                if sp is not None:
+                    sp.set(retries=intento)
+                time.sleep(espera)
+                continue
+            self.breaker.exito()
+            return resp
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            etapas = {
+                e: {"limit": self._limites.get(e, self.default_limit), "in_flight": self._en_curso[e],
+                    "p95_ms": self._latencias[e].p95}
+                for e in self._sems
+            }
+            return dict(self._contadores, breaker=self.breaker.estado, breaker_opens=self.breaker.aperturas,
+                        stages=etapas)
+
+    def close(self) -> None:
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self._http.close()
+
+
+def chat_completion(client: Any, etapa: str, **kwargs: Any) -> Any:
+    """Llamada al modelo por el gateway si `client` es uno; con un cliente OpenAI común, directa."""
+    if isinstance(client, LLMGateway):
+        return client.create(etapa, **kwargs)
+    return client.chat.completions.create(**kwargs)
@@ -0,0 +1,225 @@
+"""
+Pipeline de logs no bloqueante.
+
+`emit` deja el registro (un dict) en una cola acotada y vuelve de inmediato;
+un hilo de fondo serializa cada registro una sola vez a JSON, acumula lotes
+y los escribe como NDJSON con una única escritura en modo append, ya sea al
+juntar `batch_size` registros o cada `flush_interval_s`. La rotación es por
+tamaño. Si hay varios procesos escribiendo el mismo archivo, las escrituras
+y la rotación se serializan con un lock de archivo (`<log>.lock`).
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos, solo entre hilos
+    fcntl = None
+
+
+def _asctime(ts: float) -> str:
+    # mismo formato que logging ("2025-01-31 12:00:00,123") para el dashboard
+    dt = datetime.fromtimestamp(ts)
+    return dt.strftime("%Y-%m-%d %H:%M:%S") + f",{int(dt.microsecond / 1000):03d}"
+
+
+class LogPipeline:
+    """
+    Cola acotada + escritor en segundo plano. `policy` define qué hacer con
+    la cola llena: "drop" descarta el registro (y lo cuenta), "block" espera
+    hasta `block_timeout_s` antes de descartarlo.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = 10_000,
+        batch_size: int = 256,
+        flush_interval_s: float = 0.5,
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 5,
+        policy: str = "drop",
+        block_timeout_s: float = 1.0,
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError("policy debe ser 'drop' o 'block'")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.policy = policy
+        self.block_timeout_s = block_timeout_s
+
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._flush_req = threading.Event()
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self.emitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- productor ---
+    def emit(self, record: Dict[str, Any]) -> bool:
+        if self._closed:
+            return False
+        record.setdefault("ts", time.time())
+        with self._flushed:
+            self._pending += 1
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=self.block_timeout_s)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._flushed:
+                self._pending -= 1
+                self.dropped += 1
+                self._flushed.notify_all()
+            return False
+        # emit corre en muchos hilos: el += suelto pierde incrementos
+        with self._flushed:
+            self.emitted += 1
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Espera a que todo lo emitido hasta ahora esté escrito en disco."""
+        self._flush_req.set()
+        fin = time.monotonic() + timeout
+        with self._flushed:
+            while self._pending > 0:
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    return False
+                self._flushed.wait(restante)
+        return True
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+        for fd in (self._fd, self._lock_fd):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._lock_fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "emitted": self.emitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+            "queued": self._queue.qsize(),
+        }
+
+    # --- escritor ---
+    def _run(self) -> None:
+        buf: List[str] = []
+        ultimo = time.monotonic()
+        while True:
+            espera = max(0.0, self.flush_interval_s - (time.monotonic() - ultimo))
+            try:
+                rec = self._queue.get(timeout=0 if self._flush_req.is_set() else espera)
+            except queue.Empty:
+                rec = False
+            if rec is None:
+                self._write(buf)
+                return
+            if rec is not False:
+                buf.append(self._serializar(rec))
+            if (
+                len(buf) >= self.batch_size
+                or (buf and time.monotonic() - ultimo >= self.flush_interval_s)
+                or (rec is False and self._flush_req.is_set())
+            ):
+                self._write(buf)
+                buf = []
+                ultimo = time.monotonic()
+                if self._queue.empty():
+                    self._flush_req.clear()
+
+    @staticmethod
+    def _serializar(rec: Dict[str, Any]) -> str:
+        if "asctime" not in rec:
+            base = {"asctime": _asctime(rec["ts"]), "levelname": "INFO"}
+            base.update(rec)
+            rec = base
+        return json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+
+    def _write(self, buf: List[str]) -> None:
+        if buf:
+            data = "".join(buf).encode("utf-8")
+            try:
+                self._lock()
+                try:
+                    self._rotar_si_corresponde(len(data))
+                    os.write(self._fd, data)
+                finally:
+                    self._unlock()
+                self.written += len(buf)
+                self.batches += 1
+            except OSError:
+                self.errors += 1
+                self.dropped += len(buf)
+        with self._flushed:
+            self._pending -= len(buf)
+            self._flushed.notify_all()
+
+    def _open(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _lock(self) -> None:
+        if fcntl is None:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_WRONLY | os.O_CREAT, 0o644)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _unlock(self) -> None:
+        if fcntl is not None and self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _rotar_si_corresponde(self, extra: int) -> None:
+        # otro proceso pudo haber rotado: si el inode cambió, reabrir
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if self._fd is None or st is None or os.fstat(self._fd).st_ino != st.st_ino:
+            self._open()
+            st = os.stat(self.path)
+        if not self.max_bytes or st.st_size == 0 or st.st_size + extra <= self.max_bytes:
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
@@ -0,0 +1,354 @@
+"""
+Ingesta incremental del log NDJSON a SQLite, para el dashboard.
+
+`ingest` retoma desde el último byte leído (guardado por archivo junto con
+su inode) y solo parsea las líneas nuevas y completas; si el log rotó,
+termina primero lo que faltaba del archivo rotado (`<log>.1`). Cada evento
+queda como una fila en `events` (con el mensaje truncado a un resumen) y en
+la misma transacción se actualizan los agregados por rol (`agg_role`), por
+trace (`traces`) y los rollups por minuto y etapa (`rollup`: conteos,
+tokens, errores y un DDSketch de latencia), que es lo que consulta el
+dashboard. Los sketches de varios minutos se fusionan para obtener
+p50/p95/p99 de cualquier ventana sin leer eventos.
+
+    python log_store.py            # ingesta única de LOG_PATH a LOG_DB
+"""
+import os
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sketch import DDSketch
+
+LOG_PATH = os.getenv("LOG_PATH", "logs/agent.log")
+LOG_DB = os.getenv("LOG_DB", "logs/agent.db")
+MESSAGE_PREVIEW = 300
+SKETCH_ACCURACY = 0.01
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_state (
+    path TEXT PRIMARY KEY, inode INTEGER NOT NULL, offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    trace_id TEXT,
+    span_id TEXT,
+    parent_span_id TEXT,
+    role TEXT,
+    stage TEXT,
+    domain TEXT,
+    model TEXT,
+    tool TEXT,
+    latency_ms REAL,
+    ttft_ms REAL,
+    tokens_used INTEGER,
+    error INTEGER NOT NULL DEFAULT 0,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_events_trace ON events(trace_id);
+CREATE INDEX IF NOT EXISTS ix_events_ts ON events(ts);
+CREATE TABLE IF NOT EXISTS agg_role (
+    role TEXT PRIMARY KEY,
+    n INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    latency_n INTEGER NOT NULL,
+    ttft_sum REAL NOT NULL,
+    ttft_n INTEGER NOT NULL,
+    tokens_sum INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS traces (
+    trace_id TEXT PRIMARY KEY,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    events INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    errors INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_traces_start ON traces(start_ts);
+CREATE INDEX IF NOT EXISTS ix_traces_latency ON traces(latency_ms);
+CREATE TABLE IF NOT EXISTS rollup (
+    minute INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    roots INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    tokens INTEGER NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (minute, stage)
+);
+"""
+
+_COLS = ("ts", "trace_id", "span_id", "parent_span_id", "role", "stage", "domain", "model", "tool",
+         "latency_ms", "ttft_ms", "tokens_used", "error", "message")
+
+
+def connect(db_path: str = LOG_DB) -> sqlite3.Connection:
+    d = os.path.dirname(db_path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    if conn.execute("SELECT 1 FROM rollup LIMIT 1").fetchone() is None and \
+            conn.execute("SELECT 1 FROM events LIMIT 1").fetchone() is not None:
+        rebuild_rollups(conn)
+    return conn
+
+
+def _ts(j: Dict[str, Any]) -> float:
+    ts = j.get("ts")
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        return datetime.strptime(j.get("asctime", ""), "%Y-%m-%d %H:%M:%S,%f").timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _num(v: Any) -> Optional[float]:
+    try:
+        return float(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_line(line: bytes) -> Optional[Tuple]:
+    """Una línea del log -> fila de `events` (None si no es JSON válido)."""
+    try:
+        j = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(j, dict):
+        return None
+    msg = j.get("message")
+    if isinstance(msg, str) and msg.startswith("{") and "role" not in j:
+        # formato anterior: el registro completo venía serializado dentro de message
+        try:
+            j.update(json.loads(msg))
+            msg = j.get("message")
+        except ValueError:
+            pass
+    msg = msg if isinstance(msg, str) else ("" if msg is None else str(msg))
+    stage = j.get("stage") or None
+    error = 1 if j.get("role") == "system" and stage and msg.startswith(stage + "_error") else 0
+    tokens = _num(j.get("tokens_used"))
+    return (
+        _ts(j), j.get("trace_id"), j.get("span_id"), j.get("parent_span_id") or None, j.get("role"),
+        stage, j.get("domain") or None, j.get("model") or None, j.get("tool"),
+        _num(j.get("latency_ms")), _num(j.get("ttft_ms")), int(tokens) if tokens else 0,
+        error, msg[:MESSAGE_PREVIEW],
+    )
+
+
+def _leer(f, offset: int, bloque: int = 8 * 1024 * 1024) -> Iterator[Tuple[List[bytes], int]]:
+    """Líneas completas desde `offset`, por bloques: (líneas, bytes consumidos)."""
+    f.seek(offset)
+    resto = b""
+    while True:
+        data = f.read(bloque)
+        if not data:
+            return
+        data = resto + data
+        fin = data.rfind(b"\n")
+        if fin < 0:
+            resto = data
+            continue
+        resto = data[fin + 1:]
+        yield data[:fin].split(b"\n"), fin + 1
+
+
+def _guardar(conn: sqlite3.Connection, filas: Iterable[Tuple]) -> int:
+    filas = [f for f in filas if f is not None]
+    if not filas:
+        return 0
+    conn.executemany(f"INSERT INTO events({','.join(_COLS)}) VALUES ({','.join('?' * len(_COLS))})", filas)
+
+    roles: Dict[Any, List[float]] = {}
+    trazas: Dict[Any, List[float]] = {}
+    for ts, trace_id, _, parent, role, stage, _, _, _, lat, ttft, tokens, error, _ in filas:
+        r = roles.setdefault(role, [0, 0.0, 0, 0.0, 0, 0])
+        r[0] += 1
+        if lat:
+            r[1] += lat
+            r[2] += 1
+        if ttft:
+            r[3] += ttft
+            r[4] += 1
+        r[5] += tokens
+        if trace_id:
+            t = trazas.setdefault(trace_id, [ts, ts, 0, 0, 0.0, 0])
+            t[0], t[1] = min(t[0], ts), max(t[1], ts)
+            t[2] += 1
+            t[3] += tokens
+            if not parent and lat:
+                t[4] = max(t[4], lat)
+            t[5] += error
+
+    _acumular_rollups(conn, filas)
+    conn.executemany(
+        "INSERT INTO agg_role(role, n, latency_sum, latency_n, ttft_sum, ttft_n, tokens_sum) VALUES (?,?,?,?,?,?,?) "
+        "ON CONFLICT(role) DO UPDATE SET n = n + excluded.n, latency_sum = latency_sum + excluded.latency_sum, "
+        "latency_n = latency_n + excluded.latency_n, ttft_sum = ttft_sum + excluded.ttft_sum, "
+        "ttft_n = ttft_n + excluded.ttft_n, tokens_sum = tokens_sum + excluded.tokens_sum",
+        [(k or "", *v) for k, v in roles.items()],
+    )
+    # la latencia de un trace es la de su span raíz (o el mayor evento sin padre)
+    conn.executemany(
+        "INSERT INTO traces(trace_id, start_ts, end_ts, events, tokens, latency_ms, errors) VALUES (?,?,?,?,?,?,?) "
+        "ON CONFLICT(trace_id) DO UPDATE SET start_ts = MIN(start_ts, excluded.start_ts), "
+        "end_ts = MAX(end_ts, excluded.end_ts), events = events + excluded.events, "
+        "tokens = tokens + excluded.tokens, latency_ms = MAX(latency_ms, excluded.latency_ms), "
+        "errors = errors + excluded.errors",
+        [(k, *v) for k, v in trazas.items()],
+    )
+    return len(filas)
+
+
+def _acumular_rollups(conn: sqlite3.Connection, filas: List[Tuple]) -> None:
+    nuevos: Dict[Tuple[int, str], list] = {}
+    for ts, _, _, parent, role, stage, _, _, _, lat, _, tokens, error, _ in filas:
+        # spans por su etapa; registros antiguos sin etapa, por rol si traen latencia
+        clave = stage or (role if lat else None)
+        if not clave:
+            continue
+        r = nuevos.get((int(ts // 60), clave))
+        if r is None:
+            r = nuevos[(int(ts // 60), clave)] = [0, 0, 0, 0, DDSketch(SKETCH_ACCURACY)]
+        r[0] += 1
+        r[1] += 1 if (stage and not parent) else 0
+        r[2] += error
+        r[3] += tokens
+        r[4].add(lat or 0.0)
+    if not nuevos:
+        return
+    filas_rollup = []
+    for (minuto, etapa), (n, roots, errors, tokens, sk) in nuevos.items():
+        row = conn.execute(
+            "SELECT n, roots, errors, tokens, sketch FROM rollup WHERE minute = ? AND stage = ?", (minuto, etapa)
+        ).fetchone()
+        if row is not None:
+            n, roots, errors, tokens = n + row[0], roots + row[1], errors + row[2], tokens + row[3]
+            sk.merge(DDSketch.from_json(row[4]))
+        filas_rollup.append((minuto, etapa, n, roots, errors, tokens, sk.to_json()))
+    conn.executemany(
+        "INSERT OR REPLACE INTO rollup(minute, stage, n, roots, errors, tokens, sketch) VALUES (?,?,?,?,?,?,?)",
+        filas_rollup,
+    )
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """Recalcula `rollup` desde `events` (bases creadas antes de que existieran los rollups)."""
+    with conn:
+        conn.execute("DELETE FROM rollup")
+        cur = conn.execute(f"SELECT {','.join(_COLS)} FROM events ORDER BY id")
+        while True:
+            filas = cur.fetchmany(50_000)
+            if not filas:
+                break
+            _acumular_rollups(conn, filas)
+
+
+# --- consultas para el dashboard ---
+def _sketches(conn: sqlite3.Connection, desde: float, hasta: Optional[float]) -> Dict[str, list]:
+    hasta_min = int(hasta // 60) if hasta is not None else 2 ** 62
+    out: Dict[str, list] = {}
+    for etapa, n, roots, errors, tokens, raw in conn.execute(
+        "SELECT stage, n, roots, errors, tokens, sketch FROM rollup WHERE minute BETWEEN ? AND ?",
+        (int(desde // 60), hasta_min),
+    ):
+        r = out.get(etapa)
+        sk = DDSketch.from_json(raw)
+        if r is None:
+            out[etapa] = [n, roots, errors, tokens, sk]
+        else:
+            r[0] += n
+            r[1] += roots
+            r[2] += errors
+            r[3] += tokens
+            r[4].merge(sk)
+    return out
+
+
+def stage_percentiles(conn: sqlite3.Connection, desde: float = 0.0,
+                      hasta: Optional[float] = None) -> List[Dict[str, Any]]:
+    """p50/p95/p99 de latencia (ms), conteos, spans raíz, errores y tokens por etapa en la ventana."""
+    filas = []
+    for etapa, (n, roots, errors, tokens, sk) in sorted(_sketches(conn, desde, hasta).items()):
+        filas.append({
+            "stage": etapa, "n": n, "roots": roots, "errors": errors, "tokens": tokens,
+            "mean_ms": sk.mean, "p50_ms": sk.quantile(0.5), "p95_ms": sk.quantile(0.95),
+            "p99_ms": sk.quantile(0.99), "max_ms": sk.max if sk.count else None,
+        })
+    return filas
+
+
+def stage_timeseries(conn: sqlite3.Connection, stage: str, desde: float = 0.0,
+                     q: float = 0.95) -> List[Dict[str, Any]]:
+    """Por minuto: eventos, solicitudes (spans raíz), tokens y el cuantil `q` de latencia de `stage`."""
+    out = []
+    for minuto, n, roots, tokens, raw in conn.execute(
+        "SELECT minute, n, roots, tokens, sketch FROM rollup WHERE stage = ? AND minute >= ? ORDER BY minute",
+        (stage, int(desde // 60)),
+    ):
+        out.append({"minute": minuto * 60, "n": n, "roots": roots, "tokens": tokens,
+                    f"p{int(q * 100)}_ms": DDSketch.from_json(raw).quantile(q)})
+    return out
+
+
+def throughput(conn: sqlite3.Connection, desde: float = 0.0) -> List[Tuple[int, int]]:
+    """Solicitudes por minuto (spans raíz de cualquier etapa)."""
+    return conn.execute(
+        "SELECT minute * 60, SUM(roots) FROM rollup WHERE minute >= ? GROUP BY minute ORDER BY minute",
+        (int(desde // 60),),
+    ).fetchall()
+
+
+def slowest_traces(conn: sqlite3.Connection, desde: float = 0.0, limit: int = 20) -> List[Tuple]:
+    return conn.execute(
+        "SELECT trace_id, start_ts, latency_ms, tokens, events, errors FROM traces "
+        "WHERE start_ts >= ? ORDER BY latency_ms DESC LIMIT ?",
+        (desde, limit),
+    ).fetchall()
+
+
+def ingest(path: str = LOG_PATH, conn: Optional[sqlite3.Connection] = None) -> int:
+    """Agrega al store las líneas nuevas de `path`. Devuelve cuántos eventos se ingirieron."""
+    conn = conn or connect()
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    # el inode se toma del archivo abierto: si rota mientras se lee, el estado sigue siendo coherente
+    st = os.fstat(f.fileno())
+    row = conn.execute("SELECT inode, offset FROM ingest_state WHERE path = ?", (path,)).fetchone()
+    inode, offset = row if row else (st.st_ino, 0)
+
+    total = 0
+    with f, conn:
+        if inode != st.st_ino:
+            # rotó: primero lo que quedaba del archivo anterior, si sigue en <log>.1
+            rotado = path + ".1"
+            if os.path.exists(rotado) and os.stat(rotado).st_ino == inode:
+                with open(rotado, "rb") as viejo:
+                    for lineas, _ in _leer(viejo, offset):
+                        total += _guardar(conn, (parse_line(l) for l in lineas if l))
+            offset = 0
+        elif st.st_size < offset:
+            offset = 0  # truncado
+        for lineas, leidos in _leer(f, offset):
+            total += _guardar(conn, (parse_line(l) for l in lineas if l))
+            offset += leidos
+        conn.execute(
+            "INSERT INTO ingest_state(path, inode, offset) VALUES (?,?,?) "
+            "ON CONFLICT(path) DO UPDATE SET inode = excluded.inode, offset = excluded.offset",
+            (path, st.st_ino, offset),
+        )
+    return total
+
+
+if __name__ == "__main__":
+    print(f"{ingest(LOG_PATH)} eventos nuevos en {LOG_DB}")
@@ -1,9 +1,52 @@
-from typing import Dict, List
+"""
+Memoria conversacional por sesión y almacén de sesiones para el servidor.
+
+`SessionMemory` guarda los últimos `max_turns` turnos en un buffer circular
+(cada turno recortado a `max_turn_chars`) y, a medida que salen del buffer,
+un resumen corrido de los más viejos (la primera oración de cada uno, hasta
+`summary_chars`). `resumen()` arma el texto con turnos completos, sin
+cortar ninguno a la mitad, y queda cacheado hasta el próximo turno: el costo
+no depende del largo de la conversación.
+
+`SessionStore` mantiene miles de sesiones en memoria con LRU + TTL; las que
+salen por LRU (y todas al cerrar) se guardan en SQLite si se configuró una
+ruta, y se recuperan de ahí cuando vuelven.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+SEPARADOR = " | "
+
+
+def _recortar(texto: str, max_chars: int) -> str:
+    if len(texto) <= max_chars:
+        return texto
+    corte = texto[: max_chars - 1].rsplit(" ", 1)[0]
+    return corte + "…"
+
+
+def _primera_oracion(texto: str, max_chars: int = 120) -> str:
+    m = re.match(r"(.+?[.!?])(\s|$)", texto)
+    return _recortar(m.group(1) if m else texto, max_chars)
+
 
 class SessionMemory:
-    def __init__(self):
+    def __init__(self, max_turns: int = 8, max_turn_chars: int = 400, summary_chars: int = 600):
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.summary_chars = summary_chars
         self.state: Dict[str, str] = {}
-        self.turns: List[str] = []
+        self.turns: Deque[str] = deque(maxlen=max_turns)
+        # resumen corrido de los turnos que ya salieron del buffer (más viejo primero)
+        self.older: Deque[str] = deque()
+        self._older_chars = 0
+        self.n_turns = 0
+        self._resumen: Dict[int, str] = {}
 
     def remember(self, key: str, value: str):
         self.state[key] = value
@@ -12,8 +55,188 @@ class SessionMemory:
         return self.state.get(key, default)
 
     def add_turn(self, role: str, content: str):
-        self.turns.append(f"{role.upper()}: {content}")
+        if len(self.turns) == self.turns.maxlen:
+            self._resumir(self.turns[0])
+        texto = " ".join((content or "").split())
+        self.turns.append(_recortar(f"{role.upper()}: {texto}", self.max_turn_chars))
+        self.n_turns += 1
+        self._resumen.clear()
+
+    def _resumir(self, turno: str) -> None:
+        rol, _, texto = turno.partition(": ")
+        gist = f"{rol}: {_primera_oracion(texto)}"
+        self.older.append(gist)
+        self._older_chars += len(gist) + len(SEPARADOR)
+        while self.older and self._older_chars > self.summary_chars:
+            self._older_chars -= len(self.older.popleft()) + len(SEPARADOR)
 
     def resumen(self, max_chars: int = 600) -> str:
-        txt = " | ".join(self.turns)
-        return txt[-max_chars:] if len(txt) > max_chars else txt
+        txt = self._resumen.get(max_chars)
+        if txt is None:
+            txt = self._resumen[max_chars] = self._armar(max_chars)
+        return txt
+
+    def _armar(self, max_chars: int) -> str:
+        # turnos recientes completos, del más nuevo al más viejo, mientras quepan
+        partes: List[str] = []
+        usados = 0
+        for turno in reversed(self.turns):
+            costo = len(turno) + (len(SEPARADOR) if partes else 0)
+            if usados + costo > max_chars:
+                if not partes:
+                    partes.append(_recortar(turno, max_chars))
+                    usados = len(partes[0])
+                break
+            partes.append(turno)
+            usados += costo
+        else:
+            # sobra espacio: se antepone lo que se pueda del resumen de turnos viejos
+            antes: List[str] = []
+            disponible = max_chars - usados - len(SEPARADOR) - len("Antes: ")
+            for gist in reversed(self.older):
+                costo = len(gist) + (len(SEPARADOR) if antes else 0)
+                if costo > disponible:
+                    break
+                antes.append(gist)
+                disponible -= costo
+            if antes and partes:
+                partes.append("Antes: " + SEPARADOR.join(reversed(antes)))
+        return SEPARADOR.join(reversed(partes))
+
+    # --- serialización (para SessionStore con SQLite) ---
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "cfg": [self.max_turns, self.max_turn_chars, self.summary_chars],
+            "state": dict(self.state),
+            "turns": list(self.turns),
+            "older": list(self.older),
+            "n": self.n_turns,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "SessionMemory":
+        mem = cls(*d["cfg"])
+        mem.state = dict(d["state"])
+        mem.turns.extend(d["turns"])
+        mem.older.extend(d["older"])
+        mem._older_chars = sum(len(g) + len(SEPARADOR) for g in mem.older)
+        mem.n_turns = d["n"]
+        return mem
+
+
+class SessionStore:
+    """SessionMemory por session_id con LRU + TTL en memoria y, opcionalmente, respaldo en SQLite."""
+
+    def __init__(self, max_sessions: int = 10000, ttl_s: float = 3600.0, db_path: Optional[str] = None,
+                 memory_kwargs: Optional[Dict[str, int]] = None):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.db_path = db_path
+        self.memory_kwargs = memory_kwargs or {}
+        self._lock = threading.Lock()
+        # session_id -> [memoria, lock de la sesión, último acceso, turnos en uso]
+        self._data: "OrderedDict[str, list]" = OrderedDict()
+        self.hits = self.misses = self.loaded = self.spilled = self.expired = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated)")
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - ttl_s,))
+
+    def get(self, session_id: str) -> Tuple[SessionMemory, threading.Lock]:
+        """
+        Devuelve (memoria, lock de la sesión); crea la sesión si no existe.
+        La sesión queda en uso (no sale por LRU) hasta el `soltar` correspondiente.
+        """
+        ahora = time.time()
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is not None and item[3] == 0 and ahora - item[2] > self.ttl_s:
+                self.expired += 1
+                item = None
+            if item is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                mem = self._cargar(session_id, ahora)
+                item = [mem or SessionMemory(**self.memory_kwargs), threading.Lock(), ahora, 0]
+                self._data[session_id] = item
+            item[2] = ahora
+            item[3] += 1
+            self._data.move_to_end(session_id)
+            intentos = len(self._data)
+            while len(self._data) > self.max_sessions and intentos > 0:
+                intentos -= 1
+                viejo_id, viejo = self._data.popitem(last=False)
+                if viejo[3] > 0:
+                    # en uso (turno en curso o por empezar): se saca la siguiente
+                    self._data[viejo_id] = viejo
+                    continue
+                if ahora - viejo[2] <= self.ttl_s:
+                    self._guardar(viejo_id, viejo)
+            return item[0], item[1]
+
+    def soltar(self, session_id: str) -> None:
+        """Marca el fin del turno que pidió la sesión con `get`."""
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is not None and item[3] > 0:
+                item[3] -= 1
+
+    def _cargar(self, session_id: str, ahora: float) -> Optional[SessionMemory]:
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT data, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        if ahora - row[1] > self.ttl_s:
+            self.expired += 1
+            return None
+        self.loaded += 1
+        return SessionMemory.from_dict(json.loads(row[0]))
+
+    def _guardar(self, session_id: str, item: list) -> None:
+        if self._db is None:
+            return
+        data = json.dumps(item[0].to_dict(), ensure_ascii=False)
+        self._db.execute(
+            "INSERT INTO sessions(id, data, updated) VALUES (?,?,?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (session_id, data, item[2]),
+        )
+        self.spilled += 1
+
+    def close(self) -> None:
+        """Vuelca a SQLite las sesiones vigentes (al apagar el servidor)."""
+        with self._lock:
+            if self._db is None:
+                return
+            ahora = time.time()
+            self._db.execute("BEGIN")
+            for session_id, item in self._data.items():
+                if ahora - item[2] <= self.ttl_s:
+                    self._guardar(session_id, item)
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (ahora - self.ttl_s,))
+            self._db.execute("COMMIT")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            en_disco = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] if self._db else None
+            return {
+                "in_memory": len(self._data),
+                "on_disk": en_disco,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loaded": self.loaded,
+                "spilled": self.spilled,
+                "expired": self.expired,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
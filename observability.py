@@ -1,74 +1,84 @@
-import time
-import uuid
-import json
-import os
-from pythonjsonlogger import jsonlogger
-import logging
+"""
+Métricas Prometheus del agente.
+
+Al importarse, registra un listener en tracing: cada span cerrado alimenta
+el histograma de latencia por etapa, los tokens (prompt/completion), los
+errores y las consultas a la caché, con etiquetas stage/domain/model. Las
+solicitudes completas (spans raíz) van además a REQUEST_LATENCY y
+REQUEST_COUNT. Se exponen con `start_metrics_server(port)` o, dentro del
+servicio HTTP, en GET /metrics (ver server.py).
+"""
+from typing import Any, Callable, Optional
+
 from dotenv import load_dotenv
-from prometheus_client import Counter, Histogram, Gauge
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest, start_http_server
 
-load_dotenv()
+import tracing
+# `instrument` vive en tracing (no necesita prometheus); se reexporta aquí
+from tracing import instrument, log_event, new_span_id, new_trace_id, span, usage_tokens
 
-LOG_PATH = os.getenv("LOG_PATH", "logs/agent.log")
-os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+load_dotenv()
 
+# de 1 ms (recuperación en memoria) a 60 s (fusión lenta o timeout de agente)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_LABELS = ("stage", "domain", "model")
 
-REQUEST_LATENCY = Histogram("agent_request_latency_seconds", "Latency of agent requests")
-REQUEST_COUNT = Counter("agent_requests_total", "Total agent requests", ['status'])
+REQUEST_LATENCY = Histogram("agent_request_latency_seconds", "Latency of agent requests", ["stage"],
+                            buckets=LATENCY_BUCKETS)
+REQUEST_COUNT = Counter("agent_requests_total", "Total agent requests", ["stage", "status"])
 TOKENS_USED = Counter("agent_tokens_used_total", "Total tokens used")
 
-logger = logging.getLogger("agent_logger")
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    handler = logging.FileHandler(LOG_PATH)
-    formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(trace_id)s %(span_id)s %(parent_span_id)s %(message)s %(role)s %(latency_ms)s %(tokens_used)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-def new_trace_id():
-    return str(uuid.uuid4())
-
-def new_span_id():
-    return str(uuid.uuid4())[:8]
-
-def log_event(trace_id, span_id, parent_span_id, role, message, latency_ms=None, tokens_used=None, tool=None, extra=None):
-    record = {
-        "trace_id": trace_id,
-        "span_id": span_id,
-        "parent_span_id": parent_span_id,
-        "role": role,
-        "message": message,
-        "tool": tool,
-        "latency_ms": latency_ms,
-        "tokens_used": tokens_used
-    }
-  
-    logger.info(json.dumps(record), extra={
-        "trace_id": trace_id,
-        "span_id": span_id,
-        "parent_span_id": parent_span_id,
-        "role": role,
-        "latency_ms": latency_ms or 0,
-        "tokens_used": tokens_used or 0
-    })
-
-def instrument(fn):
-    def wrapper(*args, **kwargs):
-        trace_id = kwargs.get("trace_id") or new_trace_id()
-        parent_span_id = kwargs.get("parent_span_id")
-        span_id = new_span_id()
-        start = time.time()
-        try:
-            resp = fn(*args, **kwargs, trace_id=trace_id, span_id=span_id)
-            status = "success"
-        except Exception as e:
-            resp = None
-            status = "error"
-            raise
-        finally:
-            latency = (time.time() - start)*1000
-            REQUEST_LATENCY.observe(latency/1000.0)
-            REQUEST_COUNT.labels(status=status).inc()
-            log_event(trace_id, span_id, parent_span_id, role="assistant", message=f"call to {fn.__name__}", latency_ms=latency, tokens_used=getattr(resp, "usage", {}).get("total_tokens", None) if resp else None)
-        return resp
-    return wrapper
+STAGE_LATENCY = Histogram("agent_stage_latency_seconds", "Latency per stage", STAGE_LABELS,
+                          buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("agent_stage_errors_total", "Errors per stage", STAGE_LABELS)
+STAGE_TOKENS = Counter("agent_stage_tokens_total", "Tokens per stage (kind=prompt|completion|estimated)",
+                       STAGE_LABELS + ("kind",))
+CACHE_LOOKUPS = Counter("agent_cache_lookups_total", "Response cache lookups", ["stage", "result"])
+LLM_RETRIES = Counter("agent_llm_retries_total", "LLM call retries (429/5xx/timeouts) per stage", STAGE_LABELS)
+CONTEXT_TOKENS_SAVED = Counter("agent_context_tokens_saved_total",
+                               "Prompt tokens saved by merging, deduplicating and trimming RAG context", ["stage"])
+
+
+def _observar(sp: "tracing.Span", exc: Optional[BaseException]) -> None:
+    a = sp.attrs
+    labels = (sp.name, a.get("domain") or "", a.get("model") or "")
+    segundos = sp.latency_ms / 1000.0
+    STAGE_LATENCY.labels(*labels).observe(segundos)
+    error = exc is not None and not isinstance(exc, GeneratorExit)
+    if error:
+        STAGE_ERRORS.labels(*labels).inc()
+
+    prompt, completion = a.get("prompt_tokens") or 0, a.get("completion_tokens") or 0
+    if prompt or completion:
+        STAGE_TOKENS.labels(*labels, "prompt").inc(prompt)
+        STAGE_TOKENS.labels(*labels, "completion").inc(completion)
+        TOKENS_USED.inc(prompt + completion)
+    elif a.get("tokens_used"):
+        STAGE_TOKENS.labels(*labels, "estimated").inc(a["tokens_used"])
+        TOKENS_USED.inc(a["tokens_used"])
+
+    if a.get("retries"):
+        LLM_RETRIES.labels(*labels).inc(a["retries"])
+
+    if a.get("context_tokens_saved"):
+        CONTEXT_TOKENS_SAVED.labels(sp.name).inc(a["context_tokens_saved"])
+
+    if a.get("cache"):
+        CACHE_LOOKUPS.labels(sp.name, a["cache"]).inc()
+
+    if sp.parent_id is None:
+        REQUEST_LATENCY.labels(sp.name).observe(segundos)
+        REQUEST_COUNT.labels(sp.name, "error" if error else "success").inc()
+
+
+tracing.add_listener(_observar)
+
+
+def metrics_payload() -> bytes:
+    return generate_latest()
+
+
+def start_metrics_server(port: int, addr: str = "127.0.0.1") -> None:
+    """Expone /metrics en un hilo aparte (para el REPL o procesos por lotes)."""
+    start_http_server(port, addr=addr)
+
@@ -1,5 +1,19 @@
-from typing import List, Dict, Tuple, Callable
-from openai import OpenAI
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, List, Dict, Iterator, Tuple, Callable, Optional
+
+from response_cache import ResponseCache, bucket_for, normalizar_pregunta
+from tracing import bind, instrument, span, usage_tokens
+from context_builder import repartir_entre_agentes
+from llm_gateway import CircuitOpenError, LLMGateway, chat_completion
+from query_analyzer import QueryAnalysis, QueryAnalyzer
+
+if TYPE_CHECKING:
+    # solo para las anotaciones: el SDK se importa al crear el cliente (ver llm_gateway.py)
+    from openai import OpenAI
 
 
 RetrieveFn = Callable[[str, int, str], List[Tuple[str, str]]]
@@ -11,16 +25,27 @@ SYSTEM_PROMPT = (
     "Si hay riesgo de fechas/plazos variables, indica validar en la fuente oficial."
 )
 
+AGENT_TIMEOUT_S = float(os.getenv("AGENT_TIMEOUT_S", "60"))
+MAX_AGENT_WORKERS = int(os.getenv("MAX_AGENT_WORKERS", "8"))
+
 class BaseAgent:
-    def __init__(self, client: OpenAI, model: str, retrieve: RetrieveFn, format_ctx: FormatFn, domain_hint: str = ""):
+    def __init__(self, client: "OpenAI", model: str, retrieve: RetrieveFn, format_ctx: FormatFn, domain_hint: str = "",
+                 timeout: Optional[float] = None):
         self.client = client
         self.model = model
         self.retrieve = retrieve
         self.format_ctx = format_ctx
         self.domain_hint = domain_hint
+        self.timeout = timeout
+        self.tokens_used = 0
+        self.latency_ms = 0.0
 
     def answer(self, question: str, mem_summary: str) -> str:
-        ctx_pairs = self.retrieve(question, 3, self.domain_hint) 
+        with span("agent", domain=self.domain_hint):
+            return self._answer(question, mem_summary)
+
+    def _answer(self, question: str, mem_summary: str) -> str:
+        ctx_pairs = self.retrieve(question, 3, self.domain_hint)
         ctx_block = self.format_ctx(ctx_pairs)
         fuentes = sorted({src for (src, _) in ctx_pairs})
 
@@ -34,8 +59,14 @@ class BaseAgent:
                 "Cuando corresponda, cita fuentes entre [Fuente: archivo]."
             )},
         ]
-        resp = self.client.chat.completions.create(model=self.model, temperature=0.5, messages=msgs)
-        text = resp.choices[0].message.content
+        kwargs = {"timeout": self.timeout} if self.timeout else {}
+        with span("llm", model=self.model, domain=self.domain_hint) as sp:
+            resp = chat_completion(self.client, "agent", model=self.model, temperature=0.5, messages=msgs, **kwargs)
+            text = resp.choices[0].message.content or ""
+            prompt, completion, total = usage_tokens(resp)
+            self.tokens_used = total or max(20, len(text) // 4)
+            sp.set(tokens_used=self.tokens_used, prompt_tokens=prompt, completion_tokens=completion)
+        self.latency_ms = sp.latency_ms
 
 
         if fuentes:
@@ -49,13 +80,17 @@ KEYS_BECAS = ("beca", "beneficio", "arancel", "alimentación", "postulación")
 KEYS_ACAD  = ("nota", "apelar", "retiro", "asignatura", "convalid", "reprob", "examen")
 KEYS_ADMIN = ("certificado", "secretaría", "horario", "correo", "formulario", "oficina")
 
+DOMAIN_HINTS = {"becas": "beca", "academico": "reglamento", "admin": "admin"}
+DOMAIN_KEYS = {"becas": KEYS_BECAS, "academico": KEYS_ACAD, "admin": KEYS_ADMIN}
+
+# para preguntas que llegan como str; assistant_uni pasa un QueryAnalysis ya hecho
+_analizador = QueryAnalyzer(dominios=DOMAIN_KEYS)
+
+def analyze(question: str) -> QueryAnalysis:
+    return _analizador.analizar(question)
+
 def classify_domains(q: str) -> List[str]:
-    q = q.lower()
-    doms = []
-    if any(k in q for k in KEYS_BECAS): doms.append("becas")
-    if any(k in q for k in KEYS_ACAD):  doms.append("academico")
-    if any(k in q for k in KEYS_ADMIN): doms.append("admin")
-    return doms or ["academico"]
+    return list(analyze(q).dominios) or ["academico"]
 
 def make_plan(question: str, domains: List[str]) -> List[str]:
     steps = [f"Analizar intención: {question}"]
@@ -80,37 +115,328 @@ ORCH_SYS = (
     "Extrae de las respuestas parciales las fuentes citadas y añádelas al final como 'Fuentes: ...'."
 )
 
-def orchestrate(question: str,
-                mem_summary: str,
-                client: OpenAI,
-                model: str,
-                retrieve: RetrieveFn,
-                format_ctx: FormatFn) -> str:
-    domains = classify_domains(question)
-    plan = make_plan(question, domains)
+# Cambia automáticamente al editar los prompts, lo que invalida la caché de respuestas.
+PROMPT_VERSION = "v1-" + hashlib.sha1((SYSTEM_PROMPT + ORCH_SYS).encode("utf-8")).hexdigest()[:8]
 
-    agents: Dict[str, BaseAgent] = {
-        "becas":     BaseAgent(client, model, retrieve, format_ctx, domain_hint="beca"),
-        "academico": BaseAgent(client, model, retrieve, format_ctx, domain_hint="reglamento"),
-        "admin":     BaseAgent(client, model, retrieve, format_ctx, domain_hint="admin"),
-    }
+# Pool acotado compartido por todas las orquestaciones: cada agente bloquea en
+# su llamada HTTP, así que los hilos bastan para solapar las latencias.
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_AGENT_WORKERS, thread_name_prefix="agent")
+        return _pool
+
+def run_agents(agents: Dict[str, BaseAgent],
+               domains: List[str],
+               question: str,
+               mem_summary: str,
+               timeout: float = AGENT_TIMEOUT_S) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Ejecuta los agentes de `domains` en paralelo con un plazo común de `timeout`
+    segundos. Devuelve las parciales en el orden de `domains` y los dominios
+    que fallaron o no alcanzaron a responder (dominio -> motivo).
+    """
+    if len(domains) == 1:
+        futures = None
+    else:
+        pool = _get_pool()
+        futures = {d: pool.submit(bind(agents[d].answer), question, mem_summary) for d in domains}
+        wait(futures.values(), timeout=timeout)
 
     partials: List[str] = []
+    failed: Dict[str, str] = {}
     for d in domains:
-        ans = agents[d].answer(question, mem_summary)
+        try:
+            if futures is None:
+                ans = agents[d].answer(question, mem_summary)
+            else:
+                fut = futures[d]
+                if not fut.done():
+                    fut.cancel()
+                    failed[d] = "timeout"
+                    continue
+                ans = fut.result()
+        except Exception as e:
+            failed[d] = f"error: {e}"
+            continue
         partials.append(f"[{d.upper()}]\n{ans}")
+    return partials, failed
+
+# --- Ruteo: ¿hace falta la llamada de fusión? ---
+class RoutingStats:
+    """Contadores de cuántas veces se evitó la fusión y cuánto se ahorró (estimado)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fusion_calls = 0
+        self.fusion_skipped = 0
+        self.tokens_saved_est = 0
+        self.latency_saved_ms_est = 0.0
+        self._fusion_latency_ewma: Optional[float] = None
+        self._fusion_tokens_ewma: Optional[float] = None
+
+    def record_fusion(self, latency_ms: float, tokens: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.fusion_calls += 1
+            a = 0.2
+            self._fusion_latency_ewma = latency_ms if self._fusion_latency_ewma is None else (
+                (1 - a) * self._fusion_latency_ewma + a * latency_ms)
+            self._fusion_tokens_ewma = tokens if self._fusion_tokens_ewma is None else (
+                (1 - a) * self._fusion_tokens_ewma + a * tokens)
+
+    def record_skip(self, prompt_tokens_est: int, agent_latency_ms: float) -> None:
+        # sin fusiones observadas aún, se usa la llamada del agente como referencia
+        with self._lock:
+            self.requests += 1
+            self.fusion_skipped += 1
+            self.tokens_saved_est += int(self._fusion_tokens_ewma or prompt_tokens_est)
+            self.latency_saved_ms_est += self._fusion_latency_ewma or agent_latency_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "fusion_calls": self.fusion_calls,
+                "fusion_skipped": self.fusion_skipped,
+                "fusion_skip_rate": (self.fusion_skipped / self.requests) if self.requests else 0.0,
+                "tokens_saved_est": self.tokens_saved_est,
+                "latency_saved_ms_est": round(self.latency_saved_ms_est, 2),
+            }
+
+ROUTING_STATS = RoutingStats()
+
+def routing_metrics() -> Dict[str, Any]:
+    return ROUTING_STATS.snapshot()
+
+def needs_fusion(partials: List[str], failed: Dict[str, str]) -> Tuple[bool, str]:
+    """
+    Decide si las parciales requieren la llamada de fusión. Con una sola
+    parcial útil el agente ya entrega respuesta final y fuentes.
+    """
+    utiles = [p for p in partials if p.split("\n", 1)[-1].strip()]
+    if len(utiles) > 1:
+        return True, "multi_dominio"
+    if failed:
+        return False, "un_dominio_con_fallos"
+    return False, "un_dominio"
+
+def stream_chat(client: "OpenAI", model: str, messages: List[Dict[str, str]], temperature: float,
+                usage_out: Dict[str, Any], stage: str = "fusion") -> Iterator[str]:
+    """
+    Llamada con stream=True que entrega el texto a medida que llega. Al terminar
+    deja en `usage_out` 'tokens_used' (reales si el proveedor envía usage en el
+    último chunk, junto con 'prompt_tokens'/'completion_tokens') y 'ttft_ms'
+    (tiempo hasta el primer token).
+    """
+    start = time.perf_counter()
+    usage_out["ttft_ms"] = None
+    try:
+        stream = chat_completion(
+            client, stage, model=model, temperature=temperature, messages=messages,
+            stream=True, stream_options={"include_usage": True},
+        )
+    except TypeError:
+        stream = chat_completion(client, stage, model=model, temperature=temperature, messages=messages, stream=True)
+    tokens, partes = 0, []
+    usage_out["prompt_tokens"] = usage_out["completion_tokens"] = 0
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage_out["prompt_tokens"], usage_out["completion_tokens"], tokens = usage_tokens(chunk)
+        if not getattr(chunk, "choices", None):
+            continue
+        delta = getattr(chunk.choices[0].delta, "content", None)
+        if delta:
+            if usage_out["ttft_ms"] is None:
+                usage_out["ttft_ms"] = (time.perf_counter() - start) * 1000
+            partes.append(delta)
+            yield delta
+    usage_out["latency_ms"] = (time.perf_counter() - start) * 1000
+    usage_out["tokens_used"] = tokens or max(20, len("".join(partes)) // 4)
+
+def _fan_out(question: str,
+             mem_summary: str,
+             client: "OpenAI",
+             model: str,
+             retrieve: RetrieveFn,
+             format_ctx: FormatFn,
+             agent_timeout: float,
+             cache: Optional[ResponseCache]) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any],
+                                                      Optional[List[Dict[str, str]]], Optional[str]]:
+    """
+    Todo lo previo a la fusión. Devuelve (hit de caché, resultado parcial,
+    mensajes de fusión o None si no hace falta fusionar, bucket de caché).
+    """
+    with span("classify") as sp:
+        # la pregunta viaja analizada hasta el retriever: no se vuelve a tokenizar por agente
+        question = analyze(question)
+        domains = classify_domains(question)
+        plan = make_plan(question, domains)
+        sp.set(domains=domains)
+
+    bucket = None
+    if cache is not None or len(domains) > 1:
+        ctxs = [(d, retrieve(question, 3, DOMAIN_HINTS[d])) for d in domains]
+        if cache is not None:
+            # el contexto de cada dominio entra en la clave: si cambian los chunks, no hay hit
+            mem_hash = hashlib.sha1(mem_summary.encode("utf-8")).hexdigest()
+            bucket = bucket_for(ctxs, model, PROMPT_VERSION, extra=mem_hash)
+            with span("cache") as sp:
+                hit = cache.get(normalizar_pregunta(question), bucket)
+                sp.set(cache="hit" if hit is not None else "miss")
+            if hit is not None:
+                return dict(hit, tokens_used=0, cache="hit"), {}, None, bucket
+        # los dominios suelen recuperar pasajes en común: cada uno va a un solo agente
+        repartidos = repartir_entre_agentes(ctxs)
+        memo = {(question, DOMAIN_HINTS[d]): repartidos[d] for d in domains}
+        base_retrieve = retrieve
+
+        def retrieve(q: str, k: int, hint: str) -> List[Tuple[str, str]]:
+            ctx = memo.get((q, hint)) if k == 3 else None
+            return ctx if ctx is not None else base_retrieve(q, k, hint)
+
+    agents: Dict[str, BaseAgent] = {
+        d: BaseAgent(client, model, retrieve, format_ctx, domain_hint=hint, timeout=agent_timeout)
+        for d, hint in DOMAIN_HINTS.items()
+    }
+
+    # Fallo parcial: se fusiona lo que haya llegado; solo se aborta si no respondió nadie.
+    partials, failed = run_agents(agents, domains, question, mem_summary, timeout=agent_timeout)
+    if not partials:
+        motivos = "; ".join(f"{d}: {m}" for d, m in failed.items())
+        if isinstance(client, LLMGateway) and client.breaker.abierto():
+            # quien llama responde degradado en vez de un error genérico
+            raise CircuitOpenError("Ningún agente respondió (circuit breaker abierto): " + motivos)
+        raise RuntimeError("Ningún agente respondió: " + motivos)
+    agent_tokens = sum(agents[d].tokens_used for d in domains if d not in failed)
+    agent_latency = max(agents[d].latency_ms for d in domains if d not in failed)
+
+    faltantes = ""
+    if failed:
+        faltantes = (
+            "\n\nDominios sin respuesta (" + ", ".join(failed) + "): "
+            "indica al estudiante que valide esos puntos en la fuente oficial."
+        )
 
     fusion_prompt = (
         "Plan sugerido:\n- " + "\n- ".join(plan) +
         "\n\nRespuestas parciales (incluyen posibles 'Fuentes: ...'):\n\n" + "\n\n".join(partials) +
+        faltantes +
         "\n\nEntrega una respuesta final única, clara y priorizada (2–3 párrafos, con pasos concretos). "
         "Al final, agrega una línea 'Fuentes: [archivo1], [archivo2]' extraída de las parciales; "
         "si no hay fuentes, indica validar en el sitio oficial."
     )
 
+    fuse, route = needs_fusion(partials, failed)
+    result: Dict[str, Any] = {"plan": plan, "domains": domains, "failed": failed, "route": route, "fused": fuse,
+                              "tokens_used": agent_tokens}
+    if not fuse:
+        # respuesta directa del único agente; el plan viaja como metadata
+        text = partials[0].split("\n", 1)[-1]
+        if failed:
+            text += "\n\n*Sin respuesta para: " + ", ".join(failed) + "; valida esos puntos en la fuente oficial.*"
+        ROUTING_STATS.record_skip(len(ORCH_SYS + fusion_prompt) // 4 + len(text) // 4, agent_latency)
+        result["text"] = text
+        return None, result, None, bucket
+
     msgs = [
         {"role": "system", "content": ORCH_SYS},
         {"role": "user", "content": fusion_prompt},
     ]
-    resp = client.chat.completions.create(model=model, temperature=0.4, messages=msgs)
-    return resp.choices[0].message.content
+    return None, result, msgs, bucket
+
+@instrument(stage="orchestrate")
+def orchestrate(question: str,
+                mem_summary: str,
+                client: "OpenAI",
+                model: str,
+                retrieve: RetrieveFn,
+                format_ctx: FormatFn,
+                agent_timeout: float = AGENT_TIMEOUT_S,
+                cache: Optional[ResponseCache] = None) -> Dict[str, Any]:
+    """
+    Devuelve un dict con 'text', 'tokens_used', 'plan', 'domains', 'fused',
+    'route', 'failed' (dominios sin respuesta) y 'cache' ('hit'/'miss'/None).
+    `question` puede ser un QueryAnalysis; los agentes lo pasan tal cual a `retrieve`.
+    """
+    hit, result, msgs, bucket = _fan_out(question, mem_summary, client, model, retrieve, format_ctx,
+                                         agent_timeout, cache)
+    if hit is not None:
+        return hit
+    if msgs is None:
+        return _guardar(cache, question, bucket, result)
+
+    with span("fusion", model=model) as sp:
+        resp = chat_completion(client, "fusion", model=model, temperature=0.4, messages=msgs)
+        text = resp.choices[0].message.content or ""
+        prompt, completion, total = usage_tokens(resp)
+        fusion_tokens = total or max(20, len(text) // 4)
+        sp.set(tokens_used=fusion_tokens, prompt_tokens=prompt, completion_tokens=completion)
+    ROUTING_STATS.record_fusion(sp.latency_ms, fusion_tokens)
+    result.update(text=text, tokens_used=result["tokens_used"] + fusion_tokens)
+    return _guardar(cache, question, bucket, result)
+
+class OrchestrationStream:
+    """
+    Versión en streaming de orchestrate: iterar entrega el texto de la fusión a
+    medida que llega (o la respuesta directa/cacheada de una vez). Al agotarse,
+    `result` tiene el mismo dict que orchestrate más 'ttft_ms' y 'latency_ms'.
+    """
+
+    def __init__(self, question: str, mem_summary: str, client: "OpenAI", model: str,
+                 retrieve: RetrieveFn, format_ctx: FormatFn,
+                 agent_timeout: float = AGENT_TIMEOUT_S, cache: Optional[ResponseCache] = None):
+        self._args = (question, mem_summary, client, model, retrieve, format_ctx, agent_timeout, cache)
+        self.result: Optional[Dict[str, Any]] = None
+
+    def __iter__(self) -> Iterator[str]:
+        question, _, client, model, _, _, _, cache = self._args
+        start = time.perf_counter()
+        hit, result, msgs, bucket = _fan_out(*self._args)
+        if hit is not None or msgs is None:
+            result = hit if hit is not None else _guardar(cache, question, bucket, result)
+            ms = (time.perf_counter() - start) * 1000
+            yield result["text"]
+            self.result = dict(result, ttft_ms=ms, latency_ms=ms)
+            return
+
+        usage: Dict[str, Any] = {}
+        partes = []
+        antes = (time.perf_counter() - start) * 1000
+        with span("fusion", model=model) as sp:
+            for delta in stream_chat(client, model, msgs, 0.4, usage):
+                partes.append(delta)
+                yield delta
+            sp.set(tokens_used=usage["tokens_used"], ttft_ms=usage["ttft_ms"],
+                   prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"])
+        ROUTING_STATS.record_fusion(usage["latency_ms"], usage["tokens_used"])
+        result.update(text="".join(partes), tokens_used=result["tokens_used"] + usage["tokens_used"])
+        self.result = dict(
+            _guardar(cache, question, bucket, result),
+            ttft_ms=antes + (usage["ttft_ms"] if usage["ttft_ms"] is not None else usage["latency_ms"]),
+            latency_ms=(time.perf_counter() - start) * 1000,
+        )
+
+def orchestrate_stream(question: str,
+                       mem_summary: str,
+                       client: "OpenAI",
+                       model: str,
+                       retrieve: RetrieveFn,
+                       format_ctx: FormatFn,
+                       agent_timeout: float = AGENT_TIMEOUT_S,
+                       cache: Optional[ResponseCache] = None) -> OrchestrationStream:
+    return OrchestrationStream(question, mem_summary, client, model, retrieve, format_ctx, agent_timeout, cache)
+
+def _guardar(cache: Optional[ResponseCache], question: str, bucket: Optional[str],
+             result: Dict[str, Any]) -> Dict[str, Any]:
+    # respuestas con dominios caídos no se guardan: el próximo intento puede salir completo
+    if cache is None or bucket is None:
+        return dict(result, cache=None)
+    if not result["failed"]:
+        cache.put(normalizar_pregunta(question), bucket, result)
+    return dict(result, cache="miss")
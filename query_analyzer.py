@@ -0,0 +1,111 @@
+"""
+Análisis de la pregunta compilado una sola vez.
+
+`QueryAnalyzer` arma con las palabras clave de cada dominio un trie
+(alternación factorizada por prefijos, así el costo por posición depende
+del largo de la frase y no de cuántas haya) y lo busca en todas las
+posiciones del texto normalizado, como el `clave in pregunta` original:
+"anotar" encuentra "nota" y "convalid" encuentra "convalidación".
+
+La blocklist va en otra regex (trie para los literales, grupos con nombre
+para los patrones, que conservan sus mayúsculas y se buscan sin distinguir
+mayúsculas) que también se busca en cualquier posición, como el
+`re.search` por patrón original. `QueryAnalysis` es la pregunta original
+(sigue siendo un str) con tokens, dominios y bloqueos adjuntos, así se pasa
+tal cual por orchestrate, los agentes y el retriever sin volver a
+tokenizar.
+"""
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+TOKEN = r"[a-záéíóúñ0-9]"
+_META = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+class QueryAnalysis(str):
+    normalizado: str
+    tokens: Tuple[str, ...]
+    dominios: Tuple[str, ...]
+    bloqueos: Tuple[str, ...]
+
+    def __new__(cls, texto: str, normalizado: str, tokens: Sequence[str], dominios: Sequence[str],
+                bloqueos: Sequence[str]):
+        obj = super().__new__(cls, texto)
+        obj.normalizado = normalizado
+        obj.tokens = tuple(tokens)
+        obj.dominios = tuple(dominios)
+        obj.bloqueos = tuple(bloqueos)
+        return obj
+
+
+def _trie(frases: Iterable[str]) -> str:
+    """Alternación de frases literales factorizada por prefijos; prefiere la más larga."""
+    raiz: Dict[str, dict] = {}
+    for frase in frases:
+        nodo = raiz
+        for c in frase:
+            nodo = nodo.setdefault(c, {})
+        nodo[""] = {}
+
+    def armar(nodo: Dict[str, dict]) -> str:
+        ramas = [re.escape(c) + armar(hijo) for c, hijo in sorted(nodo.items()) if c]
+        if not ramas:
+            return ""
+        cuerpo = ramas[0] if len(ramas) == 1 else "(?:" + "|".join(ramas) + ")"
+        return "(?:" + cuerpo + ")?" if "" in nodo else cuerpo
+
+    return armar(raiz)
+
+
+class QueryAnalyzer:
+    def __init__(self, blocklist: Sequence[str] = (), dominios: Optional[Mapping[str, Sequence[str]]] = None,
+                 token: str = TOKEN):
+        self.orden = list(dominios or {})
+        self._token = re.compile(token + "+")
+        # palabra clave -> dominios que la usan
+        self._frases: Dict[str, List[str]] = {}
+        for dominio, claves in (dominios or {}).items():
+            for clave in claves:
+                if clave:
+                    self._frases.setdefault(clave.lower(), []).append(dominio)
+        # el trie entrega en cada posición solo la clave más larga: se le suman los
+        # dominios de las claves que son prefijo suyo ("beca" dentro de "becario")
+        self._dominios_de = {
+            frase: {d for otra, ds in self._frases.items() if frase.startswith(otra) for d in ds}
+            for frase in self._frases
+        }
+        # lookahead: un intento por posición, con claves solapadas o a mitad de palabra
+        self._claves = re.compile(f"(?=({_trie(self._frases)}))") if self._frases else None
+
+        # la blocklist se busca en cualquier posición, también dentro de una palabra ("xoverride"),
+        # igual que el re.search por patrón de antes: va en su propia regex
+        literales: List[str] = []
+        regex: List[str] = []
+        self._grupos: Dict[str, str] = {}
+        for pat in blocklist:
+            if _META.search(pat):
+                # el texto ya viene en minúsculas; bajar el patrón rompería escapes como \S o \W
+                nombre = f"r{len(self._grupos)}"
+                self._grupos[nombre] = pat
+                regex.append(f"(?P<{nombre}>(?i:{pat}))")
+            else:
+                literales.append(pat.lower())
+        if literales:
+            regex.append(f"(?P<frase>{_trie(literales)})")
+        self._bloqueo = re.compile("|".join(regex)) if regex else None
+
+    def analizar(self, texto: str) -> QueryAnalysis:
+        if isinstance(texto, QueryAnalysis):
+            return texto
+        normalizado = " ".join((texto or "").lower().split())
+        tokens = self._token.findall(normalizado)
+        dominios = set()
+        if self._claves is not None:
+            for m in self._claves.finditer(normalizado):
+                dominios.update(self._dominios_de[m.group(1)])
+        bloqueos: List[str] = []
+        if self._bloqueo is not None:
+            for m in self._bloqueo.finditer(normalizado):
+                nombre = m.lastgroup
+                bloqueos.append(self._grupos[nombre] if nombre in self._grupos else m.group(0))
+        return QueryAnalysis(texto or "", normalizado, tokens, [d for d in self.orden if d in dominios], bloqueos)
@@ -0,0 +1,514 @@
+"""
+Índice invertido persistente para el RAG local.
+
+El corpus de DATA_DIR se chunkea y tokeniza una sola vez; los postings
+(término -> chunk ids + frecuencias) quedan en disco como arrays .npy que se
+abren con mmap, de modo que una consulta solo toca los postings de sus términos.
+El texto de cada fuente se guarda una sola vez y cada chunk es un par de
+offsets (en bytes) sobre él, sin copias por chunk ni por solape.
+Cada reconstrucción escribe una generación nueva y la publica con un
+reemplazo atómico del archivo CURRENT.
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import ingest
+from chunking import Chunker, Span
+from tracing import event
+
+TokenizeFn = Callable[[str], List[str]]
+
+FORMAT_VERSION = 3
+_CURRENT = "CURRENT"
+_MANIFEST = "manifest.json"
+
+
+def _sha1_bytes(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def chunk_hash(texto: str) -> int:
+    """Hash estable de 64 bits del contenido de un chunk."""
+    return int.from_bytes(hashlib.blake2b(texto.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _offsets_bytes(texto: str, data: bytes, spans: Sequence[Span]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pasa spans en caracteres de `texto` a offsets en bytes de `data` (su UTF-8)."""
+    ini = np.asarray([a for a, _ in spans], dtype=np.int64)
+    fin = np.asarray([b for _, b in spans], dtype=np.int64)
+    if len(data) == len(texto):  # ASCII: caracteres == bytes
+        return ini, fin
+    puntos = sorted({p for sp in spans for p in sp})
+    mapa, acum, prev = {}, 0, 0
+    for p in puntos:
+        acum += len(texto[prev:p].encode("utf-8"))
+        mapa[p] = acum
+        prev = p
+    return (np.asarray([mapa[a] for a, _ in spans], dtype=np.int64),
+            np.asarray([mapa[b] for _, b in spans], dtype=np.int64))
+
+
+def _load_array(path: str) -> np.ndarray:
+    # np.load no puede mapear arrays vacíos; en ese caso se carga normal.
+    try:
+        # vista ndarray sobre el memmap (lo mantiene vivo): cortar un np.memmap
+        # crea otro memmap por corte, y chunk_text corta una vez por pasaje
+        return np.load(path, mmap_mode="r").view(np.ndarray)
+    except ValueError:
+        return np.load(path)
+
+
+class IndexSnapshot:
+    """Vista de solo lectura sobre una generación del índice."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, _MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.generation: int = manifest["generation"]
+        self.files: Dict[str, dict] = manifest["files"]
+        self._version: Optional[str] = None
+        self.sources: List[str] = manifest["sources"]
+        self.chunker: Optional[str] = manifest.get("chunker")
+        # archivos que no se pudieron leer o extraer: {nombre: {mtime_ns, size, error}}
+        self.errors: Dict[str, dict] = manifest.get("errors", {})
+        with open(os.path.join(path, "vocab.json"), "r", encoding="utf-8") as f:
+            self.terms: List[str] = json.load(f)
+        self.vocab: Dict[str, int] = {t: i for i, t in enumerate(self.terms)}
+
+        self.term_offsets = _load_array(os.path.join(path, "term_offsets.npy"))
+        self.post_chunk = _load_array(os.path.join(path, "post_chunk.npy"))
+        self.post_tf = _load_array(os.path.join(path, "post_tf.npy"))
+        self.chunk_source = _load_array(os.path.join(path, "chunk_source.npy"))
+        self.chunk_len = _load_array(os.path.join(path, "chunk_len.npy"))
+        self.chunk_hash = _load_array(os.path.join(path, "chunk_hash.npy"))
+        # chunk i = text[chunk_start[i]:chunk_end[i]]; text = fuentes concatenadas
+        self.chunk_start = _load_array(os.path.join(path, "chunk_start.npy"))
+        self.chunk_end = _load_array(os.path.join(path, "chunk_end.npy"))
+        self.text = _load_array(os.path.join(path, "text.npy"))
+
+        self._hint_cache: Dict[str, np.ndarray] = {}
+        # estructuras derivadas (pesos de un scorer, matrices) ligadas a esta generación
+        self.cache: Dict[object, object] = {}
+
+    @property
+    def version(self) -> str:
+        """
+        Versión del corpus: hash de (chunker, fuente, sha1) de cada archivo.
+        Igual para el mismo contenido aunque cambie la generación o el proceso.
+        """
+        if self._version is None:
+            h = hashlib.sha1((self.chunker or "").encode("utf-8"))
+            for name in self.sources:
+                h.update(f"\0{name}\0{self.files[name]['sha1']}".encode("utf-8"))
+            self._version = h.hexdigest()[:12]
+        return self._version
+
+    @property
+    def n_chunks(self) -> int:
+        return int(self.chunk_source.shape[0])
+
+    @property
+    def avg_chunk_len(self) -> float:
+        return float(np.mean(self.chunk_len)) if self.n_chunks else 0.0
+
+    def term_id(self, term: str) -> Optional[int]:
+        return self.vocab.get(term)
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        tid = self.vocab.get(term)
+        if tid is None:
+            return None
+        ini, fin = int(self.term_offsets[tid]), int(self.term_offsets[tid + 1])
+        return self.post_chunk[ini:fin], self.post_tf[ini:fin]
+
+    def chunk_text(self, chunk_id: int) -> str:
+        ini, fin = int(self.chunk_start[chunk_id]), int(self.chunk_end[chunk_id])
+        return self.text[ini:fin].tobytes().decode("utf-8")
+
+    def source_of(self, chunk_id: int) -> str:
+        return self.sources[int(self.chunk_source[chunk_id])]
+
+    def chunk_span(self, chunk_id: int) -> Tuple[str, int, int]:
+        """(fuente, inicio, fin) del chunk, en bytes sobre el texto extraído de la fuente."""
+        fuente = self.source_of(chunk_id)
+        base = self.files[fuente]["text_start"]
+        return fuente, int(self.chunk_start[chunk_id]) - base, int(self.chunk_end[chunk_id]) - base
+
+    def chunks_for_hint(self, hint: str) -> np.ndarray:
+        """Chunk ids de las fuentes cuyo nombre contiene `hint` (en minúsculas)."""
+        ids = self._hint_cache.get(hint)
+        if ids is None:
+            rangos = [
+                np.arange(meta["first_chunk"], meta["first_chunk"] + meta["n_chunks"])
+                for name, meta in ((s, self.files[s]) for s in self.sources)
+                if hint in name.lower()
+            ]
+            ids = np.concatenate(rangos) if rangos else np.empty(0, dtype=np.int64)
+            self._hint_cache[hint] = ids
+        return ids
+
+
+class InvertedIndex:
+    """
+    Mantiene el índice de `data_dir` (recursivo, todo formato con extractor
+    en `ingest`) en `index_dir` y lo reconstruye de forma incremental: solo se
+    vuelven a leer y tokenizar los archivos cuyo mtime cambió y cuyo hash de
+    contenido ya no coincide. Los que no se pueden leer quedan en
+    `snapshot().errors` y en el log, y no se reintentan hasta que cambian.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        index_dir: str,
+        tokenizar: TokenizeFn,
+        chunker: Chunker,
+        refresh_interval: float = 2.0,
+    ):
+        self.data_dir = data_dir
+        self.index_dir = index_dir
+        self.tokenizar = tokenizar
+        self.chunker = chunker
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._last_check = 0.0
+        # False cuando un IndexWatcher refresca en segundo plano: snapshot() no toca el disco
+        self.auto_refresh = True
+        # generaciones fijadas por lectores (corpus_fijo): _limpiar no las borra. Lock
+        # aparte para no esperar a un refresh en curso
+        self._fijadas: Counter = Counter()
+        self._lock_fijadas = threading.Lock()
+
+    # --- lectura ---
+    def snapshot(self) -> IndexSnapshot:
+        snap = self._snapshot
+        if snap is not None and (not self.auto_refresh or time.monotonic() - self._last_check < self.refresh_interval):
+            return snap
+        return self.refresh()
+
+    def snapshot_actual(self) -> Optional[IndexSnapshot]:
+        """El snapshot publicado, sin refrescar ni construir (None si todavía no hay)."""
+        return self._snapshot
+
+    def fijar(self, snap: IndexSnapshot) -> None:
+        """Marca la generación de `snap` en uso hasta el `soltar` correspondiente."""
+        with self._lock_fijadas:
+            self._fijadas[os.path.basename(snap.path)] += 1
+
+    def soltar(self, snap: IndexSnapshot) -> None:
+        with self._lock_fijadas:
+            nombre = os.path.basename(snap.path)
+            self._fijadas[nombre] -= 1
+            if self._fijadas[nombre] <= 0:
+                del self._fijadas[nombre]
+
+    def _load_current(self) -> Optional[IndexSnapshot]:
+        try:
+            with open(os.path.join(self.index_dir, _CURRENT), "r", encoding="utf-8") as f:
+                nombre = f.read().strip()
+            with open(os.path.join(self.index_dir, nombre, _MANIFEST), "r", encoding="utf-8") as f:
+                if json.load(f).get("format") != FORMAT_VERSION:
+                    return None
+            return IndexSnapshot(os.path.join(self.index_dir, nombre))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def abrir(self) -> Optional[IndexSnapshot]:
+        """
+        Publica la generación vigente de index_dir sin revisar data_dir
+        (arranque en caliente). None si no hay una hecha con este chunker.
+        """
+        with self._lock:
+            snap = self._load_current()
+            if snap is None or snap.chunker != self.chunker.config():
+                return None
+            self._snapshot = snap
+            self._last_check = time.monotonic()
+            return snap
+
+    def listar_fuentes(self) -> List[Tuple[str, str]]:
+        """(nombre relativo a data_dir con '/', ruta) de los archivos con extractor, recursivo."""
+        out: List[Tuple[str, str]] = []
+        if not os.path.isdir(self.data_dir):
+            return out
+        propio = os.path.abspath(self.index_dir)
+        for raiz, dirs, archivos in os.walk(self.data_dir):
+            dirs[:] = sorted(d for d in dirs
+                             if not d.startswith(".") and os.path.abspath(os.path.join(raiz, d)) != propio)
+            for nombre in archivos:
+                if nombre.startswith(".") or not ingest.soportado(nombre):
+                    continue
+                path = os.path.join(raiz, nombre)
+                out.append((os.path.relpath(path, self.data_dir).replace(os.sep, "/"), path))
+        out.sort()
+        return out
+
+    # --- construcción ---
+    def refresh(self, cambiados: Optional[Iterable[str]] = None) -> IndexSnapshot:
+        """
+        Publica una generación nueva si algo cambió. Con `cambiados` (nombres
+        relativos a data_dir) solo se revisan esos archivos y el resto se da
+        por igual a la generación vigente; sin él se recorre data_dir completo.
+        """
+        with self._lock:
+            old = self._snapshot
+            if old is None or os.path.dirname(old.path) != self.index_dir:
+                old = self._load_current()
+            # con otro chunker no se puede reutilizar nada de la generación anterior
+            reusable = old if old is not None and old.chunker == self.chunker.config() else None
+
+            files: Dict[str, dict] = {}
+            errors: Dict[str, dict] = {}
+            pendientes: List[Tuple[str, bytes, str]] = []
+            metas: Dict[str, dict] = {}
+            solo_mtime = False
+            if cambiados is not None and reusable is not None:
+                tocados = set(cambiados)
+                nombres = sorted(set(reusable.sources) | set(reusable.errors) | tocados)
+                fuentes = [(n, os.path.join(self.data_dir, *n.split("/"))) for n in nombres]
+            else:
+                tocados = None
+                fuentes = self.listar_fuentes()
+            for name, path in fuentes:
+                prev = reusable.files.get(name) if reusable else None
+                if tocados is not None and name not in tocados:
+                    if prev:
+                        files[name] = dict(prev)
+                    else:
+                        errors[name] = reusable.errors[name]
+                    continue
+                try:
+                    st = os.stat(path)
+                    if prev and prev["mtime_ns"] == st.st_mtime_ns and prev["size"] == st.st_size:
+                        files[name] = dict(prev)
+                        continue
+                    # un archivo que ya falló no se reintenta hasta que cambie
+                    fallo = old.errors.get(name) if old else None
+                    if fallo and fallo["mtime_ns"] == st.st_mtime_ns and fallo["size"] == st.st_size:
+                        errors[name] = fallo
+                        continue
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    continue  # borrado (o renombrado) mientras se listaba
+                except OSError as e:
+                    errors[name] = {"mtime_ns": 0, "size": -1, "error": f"{type(e).__name__}: {e}"}
+                    continue
+                sha1 = _sha1_bytes(data)
+                meta = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha1": sha1}
+                if prev and prev["sha1"] == sha1:
+                    files[name] = dict(prev, **meta)
+                    solo_mtime = True
+                    continue
+                pendientes.append((name, data, sha1))
+                metas[name] = meta
+                files[name] = meta  # reserva el lugar para conservar el orden de fuentes
+
+            nuevos: Dict[str, Tuple[bytes, np.ndarray, np.ndarray, List[str], List[Counter], List[int]]] = {}
+            if pendientes:
+                extraidos = ingest.extraer_lote(pendientes, self.cache_extraccion())
+                del pendientes
+                for name, (texto, error) in extraidos.items():
+                    if error is not None:
+                        del files[name]
+                        meta = metas[name]
+                        errors[name] = {"mtime_ns": meta["mtime_ns"], "size": meta["size"], "error": error}
+                        continue
+                    data = texto.encode("utf-8")
+                    spans = self.chunker.spans(texto)
+                    chunks = [texto[a:b] for a, b in spans]
+                    toks = [self.tokenizar(ch) for ch in chunks]
+                    ini, fin = _offsets_bytes(texto, data, spans)
+                    nuevos[name] = (data, ini, fin, chunks, [Counter(t) for t in toks], [len(t) for t in toks])
+            for name in errors.keys() - (old.errors.keys() if old else set()):
+                event("system", f"ingest_error: {name}: {errors[name]['error']}", tool="ingest")
+
+            sin_cambios = reusable is not None and not nuevos and list(files) == reusable.sources
+            if sin_cambios:
+                if solo_mtime or errors != reusable.errors:
+                    self._reescribir_manifest(old, files, errors)
+                    old.files, old.errors = files, errors
+            else:
+                generation = (old.generation + 1) if old else self._ultima_generacion() + 1
+                old = self._construir(reusable, files, nuevos, errors, generation)
+                self._limpiar(old.path)
+
+            self._snapshot = old
+            self._last_check = time.monotonic()
+            return old
+
+    def _reescribir_manifest(self, snap: IndexSnapshot, files: Dict[str, dict], errors: Dict[str, dict]) -> None:
+        manifest = {
+            "format": FORMAT_VERSION,
+            "generation": snap.generation,
+            "sources": snap.sources,
+            "chunker": snap.chunker,
+            "files": files,
+            "errors": errors,
+        }
+        tmp = os.path.join(snap.path, _MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(snap.path, _MANIFEST))
+
+    def _construir(
+        self,
+        old: Optional[IndexSnapshot],
+        files: Dict[str, dict],
+        nuevos: Dict[str, Tuple[bytes, np.ndarray, np.ndarray, List[str], List[Counter], List[int]]],
+        errors: Dict[str, dict],
+        generation: int,
+    ) -> IndexSnapshot:
+        terms: List[str] = list(old.terms) if old else []
+        vocab: Dict[str, int] = dict(old.vocab) if old else {}
+
+        sources = list(files)
+        # remapeo chunk viejo -> chunk nuevo (-1 si el archivo cambió o se borró)
+        remap = np.full(old.n_chunks if old else 0, -1, dtype=np.int64)
+        trip_t: List[np.ndarray] = []
+        trip_c: List[np.ndarray] = []
+        trip_f: List[np.ndarray] = []
+        chunk_source: List[np.ndarray] = []
+        chunk_len: List[np.ndarray] = []
+        chunk_hashes: List[np.ndarray] = []
+        textos: List[bytes] = []
+        chunk_start: List[np.ndarray] = []
+        chunk_end: List[np.ndarray] = []
+
+        siguiente = 0
+        base = 0  # offset en bytes de la fuente actual dentro de text.npy
+        for sid, name in enumerate(sources):
+            meta = files[name]
+            if name in nuevos:
+                data, ini_b, fin_b, chunks, tfs, lens = nuevos[name]
+                t_ids, c_ids, f_vals = [], [], []
+                for j, tf in enumerate(tfs):
+                    for term, n in tf.items():
+                        tid = vocab.get(term)
+                        if tid is None:
+                            tid = vocab[term] = len(terms)
+                            terms.append(term)
+                        t_ids.append(tid)
+                        c_ids.append(siguiente + j)
+                        f_vals.append(n)
+                trip_t.append(np.asarray(t_ids, dtype=np.int64))
+                trip_c.append(np.asarray(c_ids, dtype=np.int64))
+                trip_f.append(np.asarray(f_vals, dtype=np.int32))
+                chunk_len.append(np.asarray(lens, dtype=np.int32))
+                chunk_hashes.append(np.asarray([chunk_hash(ch) for ch in chunks], dtype=np.uint64))
+                textos.append(data)
+                chunk_start.append(ini_b + base)
+                chunk_end.append(fin_b + base)
+                n, largo = len(chunks), len(data)
+            else:
+                prev = old.files[name]
+                ini, n = prev["first_chunk"], prev["n_chunks"]
+                b0, largo = prev["text_start"], prev["text_len"]
+                remap[ini : ini + n] = np.arange(siguiente, siguiente + n)
+                chunk_len.append(np.asarray(old.chunk_len[ini : ini + n]))
+                chunk_hashes.append(np.asarray(old.chunk_hash[ini : ini + n]))
+                textos.append(old.text[b0 : b0 + largo].tobytes())
+                chunk_start.append(np.asarray(old.chunk_start[ini : ini + n]) - b0 + base)
+                chunk_end.append(np.asarray(old.chunk_end[ini : ini + n]) - b0 + base)
+            chunk_source.append(np.full(n, sid, dtype=np.int32))
+            meta["first_chunk"], meta["n_chunks"] = siguiente, n
+            meta["text_start"], meta["text_len"] = base, largo
+            siguiente += n
+            base += largo
+
+        if old is not None and old.post_chunk.shape[0]:
+            old_t = np.repeat(np.arange(len(old.terms)), np.diff(np.asarray(old.term_offsets)))
+            new_c = remap[np.asarray(old.post_chunk)]
+            keep = new_c >= 0
+            trip_t.append(old_t[keep])
+            trip_c.append(new_c[keep])
+            trip_f.append(np.asarray(old.post_tf)[keep])
+
+        t = np.concatenate(trip_t) if trip_t else np.empty(0, dtype=np.int64)
+        c = np.concatenate(trip_c) if trip_c else np.empty(0, dtype=np.int64)
+        fr = np.concatenate(trip_f) if trip_f else np.empty(0, dtype=np.int32)
+
+        # se descartan términos que ya no aparecen en ningún chunk
+        usados = np.bincount(t, minlength=len(terms)) > 0 if len(terms) else np.zeros(0, bool)
+        term_map = np.cumsum(usados) - 1
+        terms = [term for term, u in zip(terms, usados.tolist()) if u]
+        t = term_map[t] if t.size else t
+
+        orden = np.lexsort((c, t))
+        t, c, fr = t[orden], c[orden], fr[orden]
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(t, minlength=len(terms)), out=term_offsets[1:])
+
+        nombre = f"gen-{generation:06d}-{uuid.uuid4().hex[:8]}"
+        destino = os.path.join(self.index_dir, nombre)
+        os.makedirs(destino, exist_ok=True)
+
+        def _vacio_o(arrs: List[np.ndarray], dtype) -> np.ndarray:
+            return np.concatenate(arrs).astype(dtype) if arrs else np.empty(0, dtype=dtype)
+
+        np.save(os.path.join(destino, "term_offsets.npy"), term_offsets)
+        np.save(os.path.join(destino, "post_chunk.npy"), c.astype(np.int32))
+        np.save(os.path.join(destino, "post_tf.npy"), fr.astype(np.int32))
+        np.save(os.path.join(destino, "chunk_source.npy"), _vacio_o(chunk_source, np.int32))
+        np.save(os.path.join(destino, "chunk_len.npy"), _vacio_o(chunk_len, np.int32))
+        np.save(os.path.join(destino, "chunk_hash.npy"), _vacio_o(chunk_hashes, np.uint64))
+        np.save(os.path.join(destino, "chunk_start.npy"), _vacio_o(chunk_start, np.int64))
+        np.save(os.path.join(destino, "chunk_end.npy"), _vacio_o(chunk_end, np.int64))
+        np.save(os.path.join(destino, "text.npy"), np.frombuffer(b"".join(textos), dtype=np.uint8))
+        with open(os.path.join(destino, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(destino, _MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": FORMAT_VERSION, "generation": generation, "sources": sources,
+                 "chunker": self.chunker.config(), "files": files, "errors": errors},
+                f,
+                ensure_ascii=False,
+            )
+
+        tmp = os.path.join(self.index_dir, f"{_CURRENT}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(nombre)
+        os.replace(tmp, os.path.join(self.index_dir, _CURRENT))
+        return IndexSnapshot(destino)
+
+    def _ultima_generacion(self) -> int:
+        # un índice de otro formato no se carga, pero la numeración sigue para que _limpiar lo borre
+        try:
+            gens = [d for d in os.listdir(self.index_dir) if d.startswith("gen-")]
+        except OSError:
+            return 0
+        return max((int(d.split("-")[1]) for d in gens), default=0)
+
+    def cache_extraccion(self) -> "ingest.CacheExtraccion":
+        return ingest.CacheExtraccion(os.path.join(self.index_dir, "extract"))
+
+    def _limpiar(self, actual: str) -> None:
+        # conserva la generación vigente, la anterior (puede haber lectores con mmap abierto)
+        # y las que algún corpus_fijo todavía usa; estas se borran en una limpieza posterior
+        gens = sorted(d for d in os.listdir(self.index_dir) if d.startswith("gen-"))
+        vigente = os.path.basename(actual)
+        with self._lock_fijadas:
+            fijadas = set(self._fijadas)
+        for d in gens[:-2]:
+            if d != vigente and d not in fijadas:
+                shutil.rmtree(os.path.join(self.index_dir, d), ignore_errors=True)
+        # texto extraído que ya no usa ninguna de las generaciones conservadas
+        vigentes = set()
+        for d in gens[-2:]:
+            try:
+                with open(os.path.join(self.index_dir, d, _MANIFEST), "r", encoding="utf-8") as f:
+                    vigentes.update(m["sha1"] for m in json.load(f)["files"].values())
+            except (OSError, ValueError, KeyError):
+                continue
+        self.cache_extraccion().podar(vigentes)
@@ -0,0 +1,119 @@
+"""
+Rate limiting por cliente con token bucket.
+
+Cada clave (sesión, IP, usuario) tiene su propio balde de `capacity` fichas
+que se rellena a `rate_per_s`; cada solicitud consume una ficha. Tanto la
+verificación como el rellenado son O(1). El estado vive en un backend:
+en memoria (un solo proceso) o en SQLite (compartido entre procesos).
+"""
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class MemoryBackend:
+    """Baldes en memoria, protegidos por un lock. Se olvidan las claves inactivas (LRU)."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, capacity: float, rate_per_s: float, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate_per_s)
+            ok = tokens >= 1.0
+            if ok:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                # la clave más antigua lleva tanto sin usarse que su balde ya estaría lleno
+                self._buckets.popitem(last=False)
+            return ok, tokens
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+
+class SQLiteBackend:
+    """Baldes en una tabla SQLite; cada toma es una transacción inmediata (atómica entre procesos)."""
+
+    def __init__(self, path: str, timeout_s: float = 5.0):
+        self.path = path
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout_s, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: float, rate_per_s: float, now: float) -> Tuple[bool, float]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate_per_s)
+            ok = tokens >= 1.0
+            if ok:
+                tokens -= 1.0
+            conn.execute(
+                "INSERT INTO rate_buckets(key, tokens, updated) VALUES (?,?,?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return ok, tokens
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+
+class RateLimiter:
+    """Token bucket por clave: `per_minute` solicitudes sostenidas, ráfagas de hasta `burst`."""
+
+    def __init__(self, per_minute: int, burst: Optional[int] = None, backend=None):
+        self.per_minute = per_minute
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.rate_per_s = per_minute / 60.0
+        self.backend = backend if backend is not None else MemoryBackend()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key: str = "global") -> bool:
+        ok, _ = self.backend.take(key, self.capacity, self.rate_per_s, time.time())
+        with self._lock:
+            if ok:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        return ok
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.allowed + self.rejected
+            return {
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "reject_rate": (self.rejected / total) if total else 0.0,
+                "keys": len(self.backend),
+                "per_minute": self.per_minute,
+                "burst": self.capacity,
+            }
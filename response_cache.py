@@ -0,0 +1,255 @@
+"""
+Caché de respuestas para consultar/orchestrate.
+
+La clave combina la pregunta normalizada, la firma del contexto recuperado
+(fuente + hash de contenido de cada chunk), el modelo y la versión del
+prompt; si cambian los chunks de data/ cambia la firma y la entrada vieja
+simplemente deja de usarse (y expira por TTL/LRU). Hay un nivel en memoria
+(LRU con TTL) y uno opcional persistente en SQLite, también acotado: cada
+escritura borra lo vencido y, pasado `max_db_entries`, las filas de uso más
+antiguo. En modo casi-duplicado
+se aceptan preguntas con similitud de conjuntos de tokens (Jaccard) sobre
+un umbral, siempre que el contexto sea el mismo.
+"""
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"[a-záéíóúñü0-9]+")
+
+
+def normalizar_pregunta(pregunta: str) -> str:
+    return " ".join(_TOKEN_RE.findall((pregunta or "").lower()))
+
+
+def _sha1(texto: str) -> str:
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def context_signature(contextos: Iterable[Tuple[str, str]]) -> str:
+    """Firma de los chunks recuperados: (fuente, hash del contenido) en orden."""
+    h = hashlib.sha1()
+    for fuente, texto in contextos:
+        h.update(fuente.encode("utf-8"))
+        h.update(b"\0")
+        h.update(_sha1(texto).encode("ascii"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def make_key(pregunta_norm: str, ctx_sig: str, model: str, prompt_version: str, extra: str = "") -> str:
+    return _sha1("\x1f".join((pregunta_norm, ctx_sig, model, prompt_version, extra)))
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """
+    LRU en memoria con TTL y nivel opcional en SQLite. Seguro entre hilos.
+
+    Las entradas se agrupan por `bucket` (firma de contexto + modelo + versión
+    de prompt) para que la búsqueda de casi-duplicados solo compare preguntas
+    que recibirían exactamente el mismo contexto.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_s: float = 3600.0,
+        sqlite_path: Optional[str] = None,
+        near_dup_threshold: Optional[float] = None,
+        max_bucket: int = 64,
+        max_db_entries: int = 10000,
+    ):
+        self.max_entries = max_entries
+        self.max_db_entries = max_db_entries
+        self.ttl_s = ttl_s
+        self.near_dup_threshold = near_dup_threshold
+        self.max_bucket = max_bucket
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._buckets: Dict[str, "OrderedDict[str, FrozenSet[str]]"] = {}
+        self._key_bucket: Dict[str, str] = {}
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY, bucket TEXT, tokens TEXT, value TEXT, expires REAL, used REAL)"
+            )
+            # bases creadas antes del tope por LRU
+            if "used" not in {r[1] for r in self._db.execute("PRAGMA table_info(response_cache)")}:
+                self._db.execute("ALTER TABLE response_cache ADD COLUMN used REAL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_rc_bucket ON response_cache(bucket)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_rc_expires ON response_cache(expires)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_rc_used ON response_cache(used)")
+            self._db_filas = self._db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    # --- API ---
+    def get(self, pregunta_norm: str, bucket: str) -> Optional[Any]:
+        key = make_key(pregunta_norm, bucket, "", "")
+        ahora = time.time()
+        with self._lock:
+            value = self._get_mem(key, ahora)
+            if value is None and self._db is not None:
+                value = self._get_db(key, ahora)
+            if value is None and self.near_dup_threshold is not None:
+                value = self._get_near(pregunta_norm, bucket, ahora)
+                if value is not None:
+                    self.near_hits += 1
+                    return value
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, pregunta_norm: str, bucket: str, value: Any) -> None:
+        key = make_key(pregunta_norm, bucket, "", "")
+        ahora = time.time()
+        expires = ahora + self.ttl_s
+        tokens = frozenset(pregunta_norm.split())
+        with self._lock:
+            self._put_mem(key, bucket, tokens, expires, value)
+            if self._db is not None:
+                self._put_db(key, bucket, tokens, expires, value, ahora)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.near_hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.hits + self.near_hits) / total) if total else 0.0,
+                "entries": len(self._mem),
+                "db_entries": self._db_filas if self._db is not None else None,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._buckets.clear()
+            self._key_bucket.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+                self._db_filas = 0
+
+    # --- internos (con lock tomado) ---
+    def _get_mem(self, key: str, ahora: float) -> Optional[Any]:
+        hit = self._mem.get(key)
+        if hit is None:
+            return None
+        expires, value = hit
+        if expires < ahora:
+            self._drop(key)
+            return None
+        self._mem.move_to_end(key)
+        return value
+
+    def _get_db(self, key: str, ahora: float) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT bucket, tokens, value, expires FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        bucket, tokens, raw, expires = row
+        if expires < ahora:
+            self._db_filas -= self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,)).rowcount
+            return None
+        self._db.execute("UPDATE response_cache SET used = ? WHERE key = ?", (ahora, key))
+        value = json.loads(raw)
+        self._put_mem(key, bucket, frozenset(tokens.split()), expires, value)
+        return value
+
+    def _get_near(self, pregunta_norm: str, bucket: str, ahora: float) -> Optional[Any]:
+        tokens = frozenset(pregunta_norm.split())
+        mejor, mejor_sim = None, self.near_dup_threshold
+        vencidas = []
+        for key, otros in self._buckets.get(bucket, {}).items():
+            # una vencida no puede ganar: _get_mem la descartaría y se perdería otra válida
+            if self._mem[key][0] < ahora:
+                vencidas.append(key)
+                continue
+            sim = _jaccard(tokens, otros)
+            if sim >= mejor_sim:
+                mejor, mejor_sim = key, sim
+        for key in vencidas:
+            self._drop(key)
+        if mejor is None and self._db is not None:
+            rows = self._db.execute(
+                "SELECT key, tokens, value, expires FROM response_cache WHERE bucket = ? AND expires >= ? LIMIT ?",
+                (bucket, ahora, self.max_bucket),
+            ).fetchall()
+            for key, toks, raw, expires in rows:
+                otros = frozenset(toks.split())
+                sim = _jaccard(tokens, otros)
+                if sim >= mejor_sim:
+                    self._put_mem(key, bucket, otros, expires, json.loads(raw))
+                    mejor, mejor_sim = key, sim
+            if mejor is not None:
+                self._db.execute("UPDATE response_cache SET used = ? WHERE key = ?", (ahora, mejor))
+        return self._get_mem(mejor, ahora) if mejor is not None else None
+
+    def _put_db(self, key: str, bucket: str, tokens: FrozenSet[str], expires: float, value: Any,
+                ahora: float) -> None:
+        # lo vencido se poda en cada escritura (hay índice por expires) y la fila propia se reemplaza
+        self._db_filas -= self._db.execute(
+            "DELETE FROM response_cache WHERE expires < ? OR key = ?", (ahora, key)
+        ).rowcount
+        self._db.execute(
+            "INSERT INTO response_cache(key, bucket, tokens, value, expires, used) VALUES (?,?,?,?,?,?)",
+            (key, bucket, " ".join(sorted(tokens)), json.dumps(value, ensure_ascii=False), expires, ahora),
+        )
+        self._db_filas += 1
+        if self._db_filas > self.max_db_entries:
+            # como el LRU en memoria: fuera las de uso más antiguo. Se recuenta porque
+            # otro proceso puede compartir el archivo.
+            self._db.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_db_entries,),
+            )
+            self._db_filas = self._db.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+    def _put_mem(self, key: str, bucket: str, tokens: FrozenSet[str], expires: float, value: Any) -> None:
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        self._key_bucket[key] = bucket
+        b = self._buckets.setdefault(bucket, OrderedDict())
+        b[key] = tokens
+        b.move_to_end(key)
+        while len(b) > self.max_bucket:
+            self._drop(next(iter(b)))
+        while len(self._mem) > self.max_entries:
+            self._drop(next(iter(self._mem)))
+
+    def _drop(self, key: str) -> None:
+        self._mem.pop(key, None)
+        bucket = self._key_bucket.pop(key, None)
+        if bucket is not None:
+            b = self._buckets.get(bucket)
+            if b is not None:
+                b.pop(key, None)
+                if not b:
+                    del self._buckets[bucket]
+
+
+def bucket_for(contextos_por_dominio: Iterable[Tuple[str, List[Tuple[str, str]]]], model: str,
+               prompt_version: str, extra: str = "") -> str:
+    """Bucket de caché a partir del contexto de cada dominio consultado."""
+    partes = [f"{d}:{context_signature(ctx)}" for d, ctx in contextos_por_dominio]
+    return make_key("|".join(partes), "", model, prompt_version, extra)
@@ -0,0 +1,520 @@
+"""
+Recuperación RAG: índice invertido de DATA_DIR, scorers (BM25 / conteo),
+modos léxico, denso e híbrido, y armado del bloque de contexto.
+
+No necesita credenciales del modelo ni importa el cliente: se puede usar
+solo (evaluaciones, scripts, workers de indexado). Todo se crea en el
+primer uso (índice, watcher, scorer, índice denso) y scipy/embeddings se
+importan solo cuando se usan.
+
+    python retrieval.py --build     # construye el índice (p. ej. al armar la imagen)
+
+Con RAG_INDEX_PREBUILT=1 la primera consulta usa ese índice tal cual; ver
+`precalentar` para dejarlo cargado antes de recibir tráfico.
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple, Optional, Sequence
+import numpy as np
+from dotenv import load_dotenv
+
+from query_analyzer import TOKEN, QueryAnalysis
+from rag_index import IndexSnapshot, InvertedIndex
+from index_watcher import IndexWatcher
+from chunking import chunker_desde_config
+import ingest
+from tracing import current_span, event, span
+from context_builder import construir_contexto
+
+if TYPE_CHECKING:
+    from scipy import sparse
+    from embeddings import DenseIndex
+
+load_dotenv()
+
+DATA_DIR = os.getenv("RAG_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(os.path.dirname(__file__), ".rag_index"))
+INDEX_REFRESH_SECONDS = float(os.getenv("RAG_INDEX_REFRESH_SECONDS", "2"))
+# 1 = un hilo vigila DATA_DIR y reconstruye en segundo plano; 0 = se revisa en la consulta cada RAG_INDEX_REFRESH_SECONDS
+INDEX_WATCH = os.getenv("RAG_INDEX_WATCH", "1") == "1"
+# 1 = usar al arrancar el índice ya construido en INDEX_DIR (p. ej. con `python retrieval.py --build`) y
+# revisar DATA_DIR en segundo plano, en vez de recorrerlo antes de la primera consulta
+INDEX_PREBUILT = os.getenv("RAG_INDEX_PREBUILT", "0") == "1"
+# tokens máximos del bloque de contexto por prompt (0 = sin límite)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKENS", "700"))
+
+_TOKEN_RE = re.compile(TOKEN + "+")
+
+def _tokenizar(texto: str) -> List[str]:
+    return _TOKEN_RE.findall((texto or "").lower())
+
+# RAG_CHUNKER: "estructura[:max_tokens]" (encabezados/artículos/párrafos/oraciones) o "ventana[:tam[:overlap]]"
+CHUNKER = chunker_desde_config(os.getenv("RAG_CHUNKER", "estructura"))
+
+def _cargar_documentos() -> List[Tuple[str, str]]:
+    """(nombre, texto) de cada documento de DATA_DIR, con los mismos extractores y caché que el índice."""
+    indice = _get_indice()
+    items = []
+    for nombre, path in indice.listar_fuentes():
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            event("system", f"ingest_error: {nombre}: {e}", tool="ingest")
+            continue
+        items.append((nombre, data, hashlib.sha1(data).hexdigest()))
+    docs = []
+    for nombre, (texto, error) in ingest.extraer_lote(items, indice.cache_extraccion()).items():
+        if error is not None:
+            event("system", f"ingest_error: {nombre}: {error}", tool="ingest")
+        else:
+            docs.append((nombre, texto))
+    return docs
+
+# --- Scoring ---
+STOPWORDS_ES = frozenset(
+    "a al con de del el en es la las lo los o para por que se su sus un una y".split()
+)
+
+class Scorer(ABC):
+    """
+    Interfaz de puntuación sobre los postings del índice.
+
+    `pesos` devuelve un peso por posting (alineado con snap.post_chunk) y se
+    calcula una sola vez por generación del índice. `domain_boost` es el prior
+    que se suma a los chunks de fuentes que coinciden con el domain_hint.
+    """
+    nombre = "base"
+
+    def __init__(self, domain_boost: float = 4.0, stopwords=frozenset()):
+        self.domain_boost = domain_boost
+        self.stopwords = frozenset(stopwords)
+
+    @abstractmethod
+    def _calcular_pesos(self, snap: IndexSnapshot) -> np.ndarray:
+        """Peso de cada posting del snapshot, alineado con snap.post_chunk."""
+
+    def pesos(self, snap: IndexSnapshot) -> np.ndarray:
+        key = ("pesos", self.nombre, self._params())
+        w = snap.cache.get(key)
+        if w is None:
+            w = snap.cache[key] = self._calcular_pesos(snap)
+        return w
+
+    def _params(self) -> Tuple:
+        return ()
+
+    def consulta(self, snap: IndexSnapshot, pregunta: str) -> Tuple[List[int], List[float]]:
+        """Término ids (ordenados) y su frecuencia en la pregunta."""
+        qtf: Dict[int, int] = {}
+        tokens = pregunta.tokens if isinstance(pregunta, QueryAnalysis) else _tokenizar(pregunta)
+        for t in tokens:
+            if t in self.stopwords:
+                continue
+            tid = snap.term_id(t)
+            if tid is not None:
+                qtf[tid] = qtf.get(tid, 0) + 1
+        tids = sorted(qtf)
+        return tids, [float(qtf[t]) for t in tids]
+
+    def postings(
+        self, snap: IndexSnapshot, consulta: Tuple[List[int], List[float]], domain_hint: str = ""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Postings (chunk id, aporte) de una consulta, más el prior del dominio; sin sumar."""
+        w = self.pesos(snap)
+        ids_parts: List[np.ndarray] = []
+        val_parts: List[np.ndarray] = []
+        for tid, q in zip(*consulta):
+            ini, fin = int(snap.term_offsets[tid]), int(snap.term_offsets[tid + 1])
+            ids_parts.append(snap.post_chunk[ini:fin])
+            val_parts.append(q * w[ini:fin])
+        if domain_hint and self.domain_boost:
+            hint_ids = snap.chunks_for_hint(domain_hint)
+            ids_parts.append(hint_ids)
+            val_parts.append(np.full(hint_ids.shape[0], float(self.domain_boost)))
+        if not ids_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(ids_parts), np.concatenate(val_parts)
+
+    def puntuar(
+        self, snap: IndexSnapshot, pregunta: str, domain_hint: str = ""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Chunk ids candidatos y su puntaje, en una sola pasada por los postings."""
+        ids, vals = self.postings(snap, self.consulta(snap, pregunta), domain_hint)
+        if ids.shape[0] * 4 >= snap.n_chunks:
+            # términos muy frecuentes: acumular denso es más barato que ordenar
+            dense = np.bincount(ids, weights=vals, minlength=snap.n_chunks)
+            cand = np.flatnonzero(dense)
+            return cand, dense[cand]
+        cand, inv = np.unique(ids, return_inverse=True)
+        return cand, np.bincount(inv, weights=vals, minlength=cand.shape[0])
+
+
+class ConteoScorer(Scorer):
+    """Conteo de ocurrencias de los términos de la pregunta (comportamiento original)."""
+    nombre = "conteo"
+
+    def _calcular_pesos(self, snap: IndexSnapshot) -> np.ndarray:
+        return np.asarray(snap.post_tf, dtype=np.float64)
+
+
+class BM25Scorer(Scorer):
+    """BM25 con normalización por largo de chunk; df y largos vienen del índice."""
+    nombre = "bm25"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, domain_boost: float = 4.0,
+                 stopwords=STOPWORDS_ES):
+        super().__init__(domain_boost=domain_boost, stopwords=stopwords)
+        self.k1 = k1
+        self.b = b
+
+    def _params(self) -> Tuple:
+        return (self.k1, self.b)
+
+    def _calcular_pesos(self, snap: IndexSnapshot) -> np.ndarray:
+        n = snap.n_chunks
+        df = np.diff(np.asarray(snap.term_offsets)).astype(np.float64)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        post_idf = np.repeat(idf, df.astype(np.int64))
+        tf = np.asarray(snap.post_tf, dtype=np.float64)
+        dl = np.asarray(snap.chunk_len, dtype=np.float64)[np.asarray(snap.post_chunk)]
+        avgdl = snap.avg_chunk_len or 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * dl / avgdl)
+        return post_idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+
+SCORERS = {"bm25": BM25Scorer, "conteo": ConteoScorer}
+RAG_SCORER = os.getenv("RAG_SCORER", "bm25")
+RAG_DOMAIN_BOOST = float(os.getenv("RAG_DOMAIN_BOOST", "4"))
+
+_scorer: Optional[Scorer] = None
+# los agentes del orquestador recuperan en paralelo: la creación perezosa va con lock
+_init_lock = threading.Lock()
+
+def get_scorer() -> Scorer:
+    global _scorer
+    with _init_lock:
+        if _scorer is None:
+            _scorer = SCORERS[RAG_SCORER](domain_boost=RAG_DOMAIN_BOOST)
+        return _scorer
+
+def set_scorer(scorer: Scorer) -> None:
+    global _scorer
+    _scorer = scorer
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Mejores k por puntaje (desc) y chunk id (asc) como desempate."""
+    pos = scores > 0
+    ids, scores = ids[pos], scores[pos]
+    if ids.shape[0] > k:
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        sel = scores >= kth
+        ids, scores = ids[sel], scores[sel]
+    orden = np.lexsort((ids, -scores))[:k]
+    return list(zip(ids[orden].tolist(), scores[orden].tolist()))
+
+_indice: Optional[InvertedIndex] = None
+_watcher: Optional[IndexWatcher] = None
+
+def _get_indice() -> InvertedIndex:
+    global _indice, _watcher
+    with _init_lock:
+        if _indice is None:
+            _indice = InvertedIndex(
+                DATA_DIR,
+                INDEX_DIR,
+                _tokenizar,
+                CHUNKER,
+                refresh_interval=INDEX_REFRESH_SECONDS,
+            )
+            # arranque en caliente: se publica la generación ya construida sin recorrer DATA_DIR
+            abierto = INDEX_PREBUILT and _indice.abrir() is not None
+            if INDEX_WATCH:
+                _watcher = IndexWatcher(_indice).start()
+                if abierto:
+                    _watcher.resincronizar()
+        return _indice
+
+def snapshot_actual() -> Optional[IndexSnapshot]:
+    """Generación publicada del índice, sin refrescar (para /stats y similares)."""
+    return _get_indice().snapshot_actual()
+
+def watcher_modo() -> Optional[str]:
+    """Cómo se detectan cambios en data/ ('watchdog', 'polling'), o None sin watcher."""
+    return _watcher.modo if _watcher is not None else None
+
+# snapshot fijado para una solicitud: todos sus agentes (hilos incluidos, vía bind) ven el mismo corpus
+_snapshot_fijo: ContextVar[Optional[IndexSnapshot]] = ContextVar("rag_snapshot", default=None)
+
+def _snapshot() -> IndexSnapshot:
+    snap = _snapshot_fijo.get()
+    return snap if snap is not None else _get_indice().snapshot()
+
+@contextmanager
+def corpus_fijo() -> Iterator[IndexSnapshot]:
+    """Fija la generación vigente del índice para todo lo que corra dentro del bloque."""
+    snap = _snapshot()
+    indice = _get_indice()
+    # mientras dure el bloque, _limpiar no borra su generación aunque se publiquen otras
+    indice.fijar(snap)
+    token = _snapshot_fijo.set(snap)
+    try:
+        yield snap
+    finally:
+        _snapshot_fijo.reset(token)
+        indice.soltar(snap)
+
+def corpus_version() -> str:
+    """Versión del corpus con la que se respondería ahora (o la fijada por corpus_fijo)."""
+    return _snapshot().version
+
+# --- Recuperación densa / híbrida ---
+RAG_MODE = os.getenv("RAG_MODE", "lexico")
+RAG_EMBEDDER = os.getenv("RAG_EMBEDDER", "hashing")
+RAG_DENSE_APPROX = os.getenv("RAG_DENSE_APPROX", "0") == "1"
+DENSE_DOMAIN_BOOST = float(os.getenv("RAG_DENSE_DOMAIN_BOOST", "0.05"))
+MODOS = ("lexico", "denso", "hibrido")
+
+_denso: Optional["DenseIndex"] = None
+
+def _get_denso() -> "DenseIndex":
+    global _denso
+    with _init_lock:
+        if _denso is None:
+            from embeddings import DenseIndex, embedder_desde_config
+
+            _denso = DenseIndex(INDEX_DIR, embedder_desde_config(RAG_EMBEDDER))
+        return _denso
+
+def _buscar(
+    snap: IndexSnapshot,
+    pregunta: str,
+    top_k: int,
+    domain_hint: str,
+    scorer: Scorer,
+    modo: str,
+) -> List[Tuple[int, float]]:
+    if modo not in MODOS:
+        raise ValueError(f"Modo de recuperación desconocido: {modo}")
+    if modo == "lexico":
+        return _top_k(*scorer.puntuar(snap, pregunta, domain_hint), top_k)
+
+    denso = _get_denso()
+    dsnap = denso.para(snap)
+    q = denso.embedder.embed([str(pregunta)])[0]
+    ids, sims = dsnap.buscar(q, aproximado=RAG_DENSE_APPROX)
+    sims = np.asarray(sims, dtype=np.float64)
+    if domain_hint and DENSE_DOMAIN_BOOST:
+        sims = sims + DENSE_DOMAIN_BOOST * np.isin(ids, snap.chunks_for_hint(domain_hint))
+    if modo == "denso":
+        return _top_k(ids, sims, top_k)
+
+    # híbrido: fusión RRF de los rankings léxico y denso
+    from embeddings import fusion_rrf
+
+    profundidad = max(top_k * 10, 50)
+    lexico = _top_k(*scorer.puntuar(snap, pregunta, domain_hint), profundidad)
+    semantico = _top_k(ids, sims, profundidad)
+    return fusion_rrf([[c for c, _ in lexico], [c for c, _ in semantico]])[:top_k]
+
+def recuperar_contexto(
+    pregunta: str,
+    top_k: int = 3,
+    domain_hint: str = "",
+    scorer: Optional[Scorer] = None,
+    modo: Optional[str] = None,
+) -> List[Tuple[str, str]]:
+    with span("retrieval", domain=domain_hint, mode=modo or RAG_MODE) as sp:
+        snap = _snapshot()
+        if snap.n_chunks == 0 or top_k <= 0:
+            return []
+        hits = _buscar(snap, pregunta, top_k, domain_hint, scorer or get_scorer(), modo or RAG_MODE)
+        sp.set(chunks=len(hits), generation=snap.generation, corpus=snap.version)
+        return [(snap.source_of(cid), snap.chunk_text(cid)) for cid, _ in hits]
+
+def _matriz_pesos(snap: IndexSnapshot, scorer: Scorer) -> "sparse.csr_matrix":
+    """Matriz término × chunk (CSR) con los pesos del scorer; comparte buffers con los postings."""
+    from scipy import sparse
+
+    key = ("csr", scorer.nombre, scorer._params())
+    m = snap.cache.get(key)
+    if m is None:
+        m = sparse.csr_matrix(
+            (scorer.pesos(snap), np.asarray(snap.post_chunk), np.asarray(snap.term_offsets)),
+            shape=(len(snap.terms), snap.n_chunks),
+        )
+        snap.cache[key] = m
+    return m
+
+def recuperar_contexto_batch(
+    preguntas: Sequence[str],
+    top_k: int = 3,
+    domain_hints: Optional[Sequence[str]] = None,
+    scorer: Optional[Scorer] = None,
+    modo: Optional[str] = None,
+) -> List[List[Tuple[str, str]]]:
+    """
+    Versión por lotes de recuperar_contexto: puntúa las preguntas por bloques,
+    en una matriz densa cuando sus términos son frecuentes (un partition para
+    el top-k de todo el bloque) o con el producto disperso (preguntas ×
+    términos) · (términos × chunks) cuando no.
+    Devuelve lo mismo que llamar recuperar_contexto pregunta por pregunta;
+    en modo denso o híbrido se delega en la ruta escalar.
+    """
+    hints = list(domain_hints) if domain_hints is not None else [""] * len(preguntas)
+    if len(hints) != len(preguntas):
+        raise ValueError("domain_hints debe tener el mismo largo que preguntas")
+    with span("retrieval_batch", queries=len(preguntas), mode=modo or RAG_MODE):
+        snap = _snapshot()
+        if snap.n_chunks == 0 or top_k <= 0 or not preguntas:
+            return [[] for _ in preguntas]
+        scorer = scorer or get_scorer()
+        if (modo or RAG_MODE) != "lexico":
+            return [recuperar_contexto(p, top_k, h, scorer, modo) for p, h in zip(preguntas, hints)]
+        from scipy import sparse
+
+        consultas = [scorer.consulta(snap, p) for p in preguntas]
+        largos = np.asarray([len(t) for t, _ in consultas], dtype=np.int64)
+        tids = np.asarray([t for ts, _ in consultas for t in ts], dtype=np.int64)
+        qtf = np.asarray([x for _, xs in consultas for x in xs], dtype=np.float64)
+        indptr = np.concatenate([[0], np.cumsum(largos)])
+        offsets = np.asarray(snap.term_offsets)
+        df = offsets[tids + 1] - offsets[tids]
+        boost = float(scorer.domain_boost) if scorer.domain_boost else 0.0
+        n = snap.n_chunks
+        filas_bloque = max(1, _CELDAS_BLOQUE // n)
+        elegidos: List[List[int]] = []
+        for ini in range(0, len(preguntas), filas_bloque):
+            fin = min(ini + filas_bloque, len(preguntas))
+            t0, t1 = indptr[ini], indptr[fin]
+            hs = hints[ini:fin]
+            if int(df[t0:t1].sum()) * _DENSO >= (fin - ini) * n:
+                # términos frecuentes: se acumula denso, igual que Scorer.puntuar
+                d = _puntajes_densos(snap, scorer, consultas[ini:fin], hs)
+                elegidos.extend(_top_k_denso(d, top_k))
+                continue
+            q = sparse.csr_matrix((qtf[t0:t1], tids[t0:t1], indptr[ini:fin + 1] - t0),
+                                  shape=(fin - ini, len(snap.terms)))
+            s = q @ _matriz_pesos(snap, scorer)
+            if boost and any(hs):
+                s = s + _prior_dominios(snap, hs, boost)
+            for i in range(fin - ini):
+                a, b = s.indptr[i], s.indptr[i + 1]
+                elegidos.append([cid for cid, _ in _top_k(s.indices[a:b], s.data[a:b], top_k)])
+        return [[(snap.source_of(cid), snap.chunk_text(cid)) for cid in ids] for ids in elegidos]
+
+
+def _puntajes_densos(snap: IndexSnapshot, scorer: Scorer, consultas: Sequence[Tuple[List[int], List[float]]],
+                     hints: Sequence[str]) -> np.ndarray:
+    """Matriz pregunta × chunk: cada fila es el bincount de Scorer.puntuar, sin extraer candidatos."""
+    d = np.empty((len(consultas), snap.n_chunks))
+    for fila, consulta, h in zip(d, consultas, hints):
+        ids, vals = scorer.postings(snap, consulta, h)
+        fila[:] = np.bincount(ids, weights=vals, minlength=snap.n_chunks)
+    return d
+
+
+# celdas (preguntas × chunks) por bloque del batch: ~2 MB de matriz densa, que
+# se queda en caché durante la selección del top-k
+_CELDAS_BLOQUE = 1 << 18
+# ruta densa si los postings del bloque cubren al menos 1/_DENSO de sus celdas
+_DENSO = 32
+
+
+def _top_k_filas(filas: np.ndarray, ids: np.ndarray, scores: np.ndarray, n_filas: int, k: int) -> List[List[int]]:
+    """
+    _top_k de todas las filas a la vez, a partir de las entradas (fila, chunk,
+    puntaje): mismo orden (puntaje desc, chunk id asc) sin un bucle por fila.
+    """
+    pos = scores > 0
+    filas, ids, scores = filas[pos], ids[pos], scores[pos]
+    orden = np.lexsort((ids, -scores, filas))
+    filas, ids = filas[orden], ids[orden]
+    rango = np.arange(filas.shape[0]) - np.searchsorted(filas, filas)
+    sel = rango < k
+    out: List[List[int]] = [[] for _ in range(n_filas)]
+    for f, c in zip(filas[sel].tolist(), ids[sel].tolist()):
+        out[f].append(c)
+    return out
+
+
+def _top_k_denso(d: np.ndarray, k: int) -> List[List[int]]:
+    """_top_k_filas sobre una matriz pregunta × chunk densa: antes se descarta lo que no llega al k-ésimo."""
+    n = d.shape[1]
+    kk = min(k, n)
+    # partition con kth chico sobre -d y flatnonzero: bastante más rápidos que
+    # partition(d, n - kk) y np.nonzero en 2D
+    kth = -np.partition(-d, kk - 1, axis=1)[:, kk - 1]
+    plano = np.flatnonzero(d >= kth[:, None])
+    filas, ids = np.divmod(plano, n)
+    return _top_k_filas(filas, ids, d.ravel()[plano], d.shape[0], k)
+
+
+def _prior_dominios(snap: IndexSnapshot, hints: Sequence[str], boost: float) -> "sparse.csr_matrix":
+    """Matriz pregunta × chunk con `boost` en los chunks del domain_hint de cada pregunta."""
+    from scipy import sparse
+
+    distintos = tuple(sorted({h for h in hints if h}))
+    key = ("hints_csr", distintos)
+    d = snap.cache.get(key)
+    if d is None:
+        ids = [snap.chunks_for_hint(h) for h in distintos]
+        indptr = np.concatenate([[0], np.cumsum([a.shape[0] for a in ids])])
+        d = sparse.csr_matrix((np.ones(int(indptr[-1])), np.concatenate(ids).astype(np.int64), indptr),
+                              shape=(len(distintos), snap.n_chunks))
+        snap.cache[key] = d
+    col = {h: j for j, h in enumerate(distintos)}
+    filas = [i for i, h in enumerate(hints) if h]
+    h = sparse.csr_matrix((np.full(len(filas), boost), (filas, [col[hints[i]] for i in filas])),
+                          shape=(len(hints), len(distintos)))
+    return h @ d
+
+
+def formatear_contexto(contextos: List[Tuple[str, str]], presupuesto: Optional[int] = None) -> str:
+    """
+    Bloque de contexto para el prompt: une chunks solapados de la misma
+    fuente, quita pasajes repetidos y recorta a `presupuesto` tokens
+    (CONTEXT_TOKEN_BUDGET si no se indica). Los contextos vienen ordenados
+    por relevancia, así que al recortar se pierden los peores.
+    """
+    if presupuesto is None:
+        presupuesto = CONTEXT_TOKEN_BUDGET
+    bloque, info = construir_contexto(contextos, presupuesto or None)
+    sp = current_span()
+    if sp is not None:
+        sp.set(context_tokens=info["tokens_out"], context_tokens_saved=info["tokens_saved"])
+    return bloque
+
+
+def precalentar(pregunta: str = "reglamento") -> Dict[str, float]:
+    """
+    Deja listo lo que la primera consulta pagaría: índice abierto, pesos del
+    scorer y páginas de los postings. Devuelve los tiempos de cada paso (ms).
+    """
+    tiempos: Dict[str, float] = {}
+    t = time.perf_counter()
+    snap = _get_indice().snapshot()
+    tiempos["index_ms"] = (time.perf_counter() - t) * 1000
+    t = time.perf_counter()
+    if snap.n_chunks:
+        get_scorer().pesos(snap)
+        _buscar(snap, pregunta, 3, "", get_scorer(), RAG_MODE)
+    tiempos["scorer_ms"] = (time.perf_counter() - t) * 1000
+    return tiempos
+
+
+if __name__ == "__main__":
+    if "--build" not in sys.argv[1:]:
+        print("Uso: python retrieval.py --build")
+        sys.exit(2)
+    t = time.perf_counter()
+    snap = InvertedIndex(DATA_DIR, INDEX_DIR, _tokenizar, CHUNKER, refresh_interval=INDEX_REFRESH_SECONDS).refresh()
+    print(f"Índice generación {snap.generation} ({snap.version}): {len(snap.sources)} fuentes, "
+          f"{snap.n_chunks} chunks, {len(snap.errors)} errores, {time.perf_counter() - t:.2f} s")
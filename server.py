@@ -0,0 +1,287 @@
+"""
+Servicio HTTP (FastAPI) delante del asistente.
+
+    uvicorn server:app --host 0.0.0.0 --port 8000
+
+Endpoints:
+- POST /consultar    {"pregunta": ..., "session_id": ...}         -> respuesta simple (RAG + 1 llamada)
+- POST /orchestrate  {"pregunta": ..., "session_id": ..., "stream": true} -> SSE o JSON
+- GET  /metrics      métricas Prometheus (latencia por etapa, tokens, errores, caché)
+- GET  /stats        contadores del servicio, ruteo, contexto, caché e índice (JSON)
+
+El trabajo bloqueante (recuperación + llamadas al modelo) corre en un pool de
+hilos acotado (SERVER_WORKERS); si además de los que están en curso ya hay
+SERVER_QUEUE solicitudes esperando, se responde 429. El índice RAG se carga
+al arrancar y se comparte, igual que el cliente OpenAI (con su pool HTTP).
+
+Prueba de carga local: levantar `python stub_llm.py --port 8001` y arrancar
+el servicio con OPENAI_BASE_URL=http://127.0.0.1:8001/v1.
+"""
+import os
+import json
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+import assistant_uni as au
+import retrieval
+import observability
+from llm_gateway import CircuitOpenError, StageBusyError
+from memory import SessionStore
+from planner_agent import routing_metrics
+from context_builder import CONTEXT_STATS
+from tracing import bind, event
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+SERVER_QUEUE = int(os.getenv("SERVER_QUEUE", "64"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "3600"))
+# sesiones desalojadas por LRU (y todas al apagar) se guardan aquí; vacío = solo en memoria
+SESSION_DB = os.getenv("SESSION_DB", "")
+
+
+class Admission:
+    """Control de admisión: en curso + en cola nunca supera workers + queue."""
+
+    def __init__(self, workers: int, queue: int):
+        self.workers = workers
+        self.limit = workers + queue
+        self._lock = threading.Lock()
+        self.in_system = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_system >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_system += 1
+            self.admitted += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_system -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": min(self.in_system, self.workers),
+                "queued": max(0, self.in_system - self.workers),
+                "admitted": self.admitted,
+                "rejected_429": self.rejected,
+            }
+
+
+admission = Admission(SERVER_WORKERS, SERVER_QUEUE)
+sessions = SessionStore(SESSION_MAX, SESSION_TTL_S, db_path=SESSION_DB or None)
+_executor = ThreadPoolExecutor(max_workers=SERVER_WORKERS, thread_name_prefix="srv")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # índice compartido y pesos del scorer precargados antes de aceptar tráfico
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, retrieval.precalentar)
+    # el cliente del modelo es perezoso (import de openai, pool HTTP): se crea aquí y no en la primera consulta
+    try:
+        await loop.run_in_executor(_executor, au.get_client)
+    except RuntimeError as e:
+        event("system", f"llm_no_configurado: {e}")
+    yield
+    _executor.shutdown(wait=False, cancel_futures=True)
+    sessions.close()
+
+
+app = FastAPI(title="Asistente Universitario", lifespan=lifespan)
+
+
+class Consulta(BaseModel):
+    pregunta: str
+    session_id: Optional[str] = None
+    stream: bool = False
+
+
+def _admitir() -> None:
+    if not admission.try_acquire():
+        raise HTTPException(status_code=429, detail="Servidor saturado, reintenta en unos segundos.")
+
+
+async def _en_pool(fn, *args):
+    try:
+        # run_in_executor no propaga contextvars: bind lleva el span actual al hilo
+        return await asyncio.get_running_loop().run_in_executor(_executor, bind(fn), *args)
+    finally:
+        admission.release()
+
+
+def _client_key(body: Consulta, request: Request) -> str:
+    # el límite es por sesión; sin sesión, por IP del cliente
+    if body.session_id:
+        return "s:" + body.session_id
+    return "ip:" + (request.client.host if request.client else "desconocido")
+
+
+def _validar(pregunta: str, client_key: str) -> str:
+    """Devuelve la pregunta ya analizada para no repetir el análisis en el pool."""
+    pregunta = au.analizar_consulta(pregunta)
+    ok, err = au.sanitize_input(pregunta)
+    if not ok:
+        raise HTTPException(status_code=400, detail=err)
+    ok, err = au.rate_limit_ok(client_key)
+    if not ok:
+        raise HTTPException(status_code=429, detail=err)
+    return pregunta
+
+
+@app.post("/consultar")
+async def consultar(body: Consulta, request: Request):
+    pregunta = _validar(body.pregunta, _client_key(body, request))
+    _admitir()
+    trace_id = au.new_trace_id()
+    # validación y rate limit ya hechos: client_id=None para no cobrar dos veces
+    texto = await _en_pool(au.consultar, pregunta, trace_id, None, None)
+    return {"respuesta": texto, "trace_id": trace_id}
+
+
+def _orquestar_sesion(pregunta: str, session_id: str, trace_id: str, meta: dict) -> Iterator[str]:
+    mem, lock = sessions.get(session_id)
+    try:
+        # una sesión no procesa dos preguntas a la vez (la memoria es secuencial)
+        with lock:
+            yield from au.orquestar_stream(pregunta, mem, trace_id=trace_id, meta_out=meta)
+    finally:
+        sessions.soltar(session_id)
+
+
+def _sse(tipo: Optional[str], data: Any) -> bytes:
+    head = f"event: {tipo}\n" if tipo else ""
+    return (head + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+
+async def _stream_en_pool(gen_factory, meta: dict, resp: "_RespuestaSSE"):
+    """Consume un generador bloqueante en el pool y lo reemite como SSE."""
+    loop = asyncio.get_running_loop()
+    cola: asyncio.Queue = asyncio.Queue()
+    fin = object()
+    # el lado async lo marca al terminar por cualquier motivo (también si el cliente se fue)
+    cancelado = threading.Event()
+
+    def worker():
+        gen = None
+        try:
+            gen = gen_factory()
+            for parte in gen:
+                if cancelado.is_set():
+                    break
+                loop.call_soon_threadsafe(cola.put_nowait, parte)
+        except Exception as e:
+            loop.call_soon_threadsafe(cola.put_nowait, e)
+        finally:
+            # cerrar el generador corre sus finally (lock y refcount de la sesión, spans)
+            if gen is not None:
+                gen.close()
+            loop.call_soon_threadsafe(cola.put_nowait, fin)
+
+    fut = loop.run_in_executor(_executor, bind(worker))
+    # desde aquí el cupo de admisión lo devuelve el worker al terminar
+    resp.en_pool = True
+    fut.add_done_callback(lambda _: admission.release())
+    try:
+        while True:
+            item = await cola.get()
+            if item is fin:
+                break
+            if isinstance(item, Exception):
+                yield _sse("error", {"detail": str(item)})
+                return
+            yield _sse(None, {"delta": item})
+        yield _sse("done", {k: v for k, v in meta.items() if k != "text"})
+    finally:
+        cancelado.set()
+
+
+class _RespuestaSSE(StreamingResponse):
+    """
+    Stream SSE que ya tomó un cupo de admisión. Si el cliente se desconecta
+    antes de que Starlette empiece a iterar, el worker nunca se envía al pool
+    y el cupo se devuelve aquí.
+    """
+
+    def __init__(self, gen_factory, meta: dict):
+        self.en_pool = False
+        super().__init__(
+            _stream_en_pool(gen_factory, meta, self),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.en_pool:
+                admission.release()
+
+
+@app.post("/orchestrate")
+async def orchestrate(body: Consulta, request: Request):
+    pregunta = _validar(body.pregunta, _client_key(body, request))
+    _admitir()
+    session_id = body.session_id or uuid.uuid4().hex
+    trace_id = au.new_trace_id()
+    meta: Dict[str, Any] = {"session_id": session_id}
+
+    def gen():
+        return _orquestar_sesion(pregunta, session_id, trace_id, meta)
+
+    if body.stream:
+        return _RespuestaSSE(gen, meta)
+
+    try:
+        texto = await _en_pool(lambda: "".join(gen()))
+    except CircuitOpenError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e), "trace_id": trace_id})
+    except StageBusyError as e:
+        return JSONResponse(status_code=429, content={"detail": str(e), "trace_id": trace_id})
+    except RuntimeError as e:
+        return JSONResponse(status_code=502, content={"detail": str(e), "trace_id": trace_id})
+    return dict(meta, text=texto)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(observability.metrics_payload(), media_type=observability.CONTENT_TYPE_LATEST)
+
+
+@app.get("/stats")
+async def stats():
+    cache = au.get_response_cache()
+    snap = retrieval.snapshot_actual()
+    return {
+        "server": admission.stats(),
+        "sessions": sessions.stats(),
+        "routing": routing_metrics(),
+        "context": CONTEXT_STATS.snapshot(),
+        "llm": au.client_stats(),
+        "response_cache": cache.stats() if cache is not None else None,
+        "rate_limit": au.get_rate_limiter().stats(),
+        "index": {"generation": snap.generation, "version": snap.version, "chunks": snap.n_chunks,
+                  "sources": len(snap.sources), "errors": snap.errors,
+                  "watcher": retrieval.watcher_modo()} if snap is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("SERVER_HOST", "127.0.0.1"), port=int(os.getenv("SERVER_PORT", "8000")))
@@ -0,0 +1,102 @@
+"""
+DDSketch: cuantiles aproximados con error relativo acotado y fusionables.
+
+Cada valor positivo cae en el balde ceil(log_gamma(v)), con
+gamma = (1 + a) / (1 - a); el cuantil estimado queda a un error relativo
+`a` del real. Dos sketches con la misma precisión se fusionan sumando
+baldes, por eso sirven para rollups por minuto que luego se combinan en
+cualquier ventana. Si hay más de `max_bins` baldes se colapsan los más bajos
+(la cola de latencias chicas, que no interesa para p95/p99).
+"""
+import json
+import math
+from typing import Dict, Optional
+
+
+class DDSketch:
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, n: int = 1) -> None:
+        if value <= 0:
+            self.zero_count += n
+            value = 0.0
+        else:
+            i = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[i] = self.bins.get(i, 0) + n
+            if len(self.bins) > self.max_bins:
+                self._colapsar()
+        self.count += n
+        self.sum += value * n
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Solo se pueden fusionar sketches con la misma precisión")
+        for i, c in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + c
+        if len(self.bins) > self.max_bins:
+            self._colapsar()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        acumulado = self.zero_count
+        if acumulado > rank:
+            return 0.0
+        for i in sorted(self.bins):
+            acumulado += self.bins[i]
+            if acumulado > rank:
+                v = 2 * self.gamma ** i / (self.gamma + 1)
+                return min(max(v, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def _colapsar(self) -> None:
+        claves = sorted(self.bins)
+        sobran = len(claves) - self.max_bins
+        destino = claves[sobran]
+        for i in claves[:sobran]:
+            self.bins[destino] += self.bins.pop(i)
+
+    # --- serialización (para guardar rollups en SQLite) ---
+    def to_json(self) -> str:
+        return json.dumps({
+            "a": self.relative_accuracy, "z": self.zero_count, "n": self.count, "s": self.sum,
+            "lo": self.min if self.count else None, "hi": self.max if self.count else None,
+            "b": self.bins,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "DDSketch":
+        d = json.loads(raw)
+        s = cls(d["a"])
+        s.bins = {int(k): v for k, v in d["b"].items()}
+        s.zero_count, s.count, s.sum = d["z"], d["n"], d["s"]
+        if s.count:
+            s.min, s.max = d["lo"], d["hi"]
+        return s
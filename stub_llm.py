@@ -0,0 +1,166 @@
+"""
+Servidor local compatible con la API de chat completions de OpenAI, para
+pruebas de carga y de latencia sin gastar tokens reales.
+
+Uso:
+    python stub_llm.py --port 8001 --latency-ms 300
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python assistant_uni.py
+"""
+import json
+import random
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 200.0, jitter_ms: float = 0.0, fail_rate: float = 0.0,
+                 token_delay_ms: float = 5.0, seed: Optional[int] = None, fail_status: int = 503,
+                 slow_rate: float = 0.0, slow_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.token_delay_ms = token_delay_ms
+        # 429 o 5xx para los fallos simulados; slow_* agrega una cola de latencia (para probar hedging)
+        self.fail_status = fail_status
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _respuesta(messages) -> str:
+    ultimo = messages[-1].get("content", "") if messages else ""
+    return (
+        f"Respuesta simulada a {len(messages)} mensajes ({len(ultimo)} caracteres). "
+        "Revisa el reglamento vigente y valida plazos en la fuente oficial. [Fuente: stub]"
+    )
+
+
+def _usage(messages, text: str) -> dict:
+    prompt = sum(len(m.get("content", "") or "") for m in messages) // 4
+    completion = max(1, len(text) // 4)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, body: dict, headers: Optional[dict] = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            try:
+                self._do_post()
+            except (BrokenPipeError, ConnectionResetError):
+                # el cliente cortó (timeout o cancelación): no es un error del stub
+                self.close_connection = True
+
+        def _do_post(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            cfg.next_request()
+            demora = cfg.latency_ms + cfg.rng.uniform(0, cfg.jitter_ms)
+            if cfg.slow_rate and cfg.rng.random() < cfg.slow_rate:
+                demora += cfg.slow_ms
+            time.sleep(demora / 1000.0)
+            if cfg.fail_rate and cfg.rng.random() < cfg.fail_rate:
+                headers = {"Retry-After": "0"} if cfg.fail_status == 429 else None
+                self._json(cfg.fail_status, {"error": {"message": "stub: fallo simulado", "type": "server_error"}},
+                           headers)
+                return
+
+            messages = req.get("messages") or []
+            text = _respuesta(messages)
+            usage = _usage(messages, text)
+            rid = "chatcmpl-" + uuid.uuid4().hex[:12]
+            base = {"id": rid, "created": int(time.time()), "model": req.get("model", "stub")}
+
+            if not req.get("stream"):
+                self._json(200, dict(base, object="chat.completion", usage=usage, choices=[
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+                ]))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def enviar(obj):
+                self.wfile.write(b"data: " + json.dumps(obj).encode("utf-8") + b"\n\n")
+                self.wfile.flush()
+
+            for i, palabra in enumerate(text.split(" ")):
+                delta = {"content": ("" if i == 0 else " ") + palabra}
+                enviar(dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": delta, "finish_reason": None}
+                ]))
+                time.sleep(cfg.token_delay_ms / 1000.0)
+            enviar(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {}, "finish_reason": "stop"}
+            ]))
+            if (req.get("stream_options") or {}).get("include_usage"):
+                enviar(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8001, cfg: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """Arranca el stub en un hilo de fondo y devuelve el servidor (usar .shutdown())."""
+    cfg = cfg or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(cfg))
+    server.daemon_threads = True
+    server.stub_config = cfg
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stub local compatible con OpenAI chat completions")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--latency-ms", type=float, default=200.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("--token-delay-ms", type=float, default=5.0)
+    ap.add_argument("--fail-status", type=int, default=503)
+    ap.add_argument("--slow-rate", type=float, default=0.0)
+    ap.add_argument("--slow-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    cfg = StubConfig(args.latency_ms, args.jitter_ms, args.fail_rate, args.token_delay_ms,
+                     fail_status=args.fail_status, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    srv.daemon_threads = True
+    print(f"Stub LLM escuchando en http://{args.host}:{args.port}/v1")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,31 @@
+"""
+Configuración común: la recuperación, el log y las cachés leen sus rutas del
+entorno al importarse, así que se apuntan a un directorio temporal antes de
+que cualquier test importe los módulos del agente.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_TMP = tempfile.mkdtemp(prefix="rag_tests_")
+os.environ.update(
+    RAG_DATA_DIR=os.path.join(_TMP, "data"),
+    RAG_INDEX_DIR=os.path.join(_TMP, "index"),
+    RAG_INDEX_WATCH="0",
+    RAG_MODE="lexico",
+    LOG_PATH=os.path.join(_TMP, "logs", "agent.log"),
+    RESPONSE_CACHE="0",
+)
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    """Corpus sintético del benchmark (300 documentos, tres dominios); devuelve sus preguntas."""
+    from benchmark import generar_corpus
+
+    return generar_corpus(os.environ["RAG_DATA_DIR"], 300, palabras_doc=300, seed=11)
@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+import batch
+from batch import BatchRunner, TokenBudget, reanudar
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    t = [50.0]
+    monkeypatch.setattr(batch.time, "monotonic", lambda: t[0])
+    return t
+
+
+def test_budget_reserva_y_rellena(reloj):
+    b = TokenBudget(tpm=600, estimado=200)
+    assert [b.reservar() for _ in range(3)] == [200, 200, 200]
+    assert b._saldo == 0
+    reloj[0] += 20  # 10 tokens/s
+    b._rellenar(reloj[0])
+    assert b._saldo == 200
+    reloj[0] += 600
+    b._rellenar(reloj[0])
+    assert b._saldo == 600
+
+
+def test_budget_ajusta_con_el_gasto_real(reloj):
+    b = TokenBudget(tpm=1000, estimado=100)
+    r = b.reservar()
+    b.ajustar(r, 300)
+    assert b._saldo == 700
+    assert b.estimado == pytest.approx(140)
+    # sin gasto real (interrumpida, error) se devuelve la reserva y no se toca la estimación
+    r = b.reservar()
+    b.ajustar(r, 0)
+    assert b._saldo == 700 and b.estimado == pytest.approx(140)
+
+
+def test_budget_reserva_mayor_que_el_balde_pasa_lleno(reloj):
+    b = TokenBudget(tpm=100, estimado=500)
+    assert b.reservar() == 500
+    assert b._saldo == -400
+
+
+def test_budget_sin_saldo_se_corta_con_parar():
+    b = TokenBudget(tpm=60, estimado=60)
+    b.reservar()
+    parar = threading.Event()
+    threading.Timer(0.05, parar.set).start()
+    assert b.reservar(parar) == 0.0
+    assert b.esperado_s > 0
+
+
+class _Breaker:
+    def __init__(self, abierto):
+        self._abierto = abierto
+
+    def abierto(self):
+        return self._abierto
+
+
+class _Cliente:
+    def __init__(self, abierto=False):
+        self.breaker = _Breaker(abierto)
+
+
+def test_procesar_interrumpida_devuelve_la_reserva(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch.au, "get_client", lambda: _Cliente(abierto=True))
+    runner = BatchRunner(str(tmp_path / "out.jsonl"), workers=1, tpm=1000, tokens_estimados=100)
+    threading.Timer(0.05, runner.parar.set).start()
+    rec = runner.procesar("7", "¿cuándo es el examen?")
+    assert rec == {"id": "7", "pregunta": "¿cuándo es el examen?", "status": "interrumpida"}
+    assert runner.budget._saldo == pytest.approx(1000, abs=1)
+
+
+def test_procesar_invalida_no_llama_al_modelo(monkeypatch, tmp_path, corpus):
+    monkeypatch.setattr(batch.au, "get_client", lambda: _Cliente())
+    runner = BatchRunner(str(tmp_path / "out.jsonl"), workers=1, tpm=0)
+    rec = runner.procesar("1", "   ")
+    assert rec["status"] == "invalida" and rec["error"] == "pregunta vacía"
+
+
+def test_reanudar_solo_cuenta_terminados(tmp_path):
+    path = tmp_path / "out.jsonl"
+    filas = [
+        {"id": "1", "status": "ok"},
+        {"id": "2", "status": "invalida"},
+        {"id": "3", "status": "interrumpida"},
+        {"id": "4", "status": "error"},
+        {"id": "5", "status": "ok"},
+        {"id": "5", "status": "error"},
+    ]
+    path.write_text("".join(json.dumps(f) + "\n" for f in filas) + '{"id": "6", "sta', encoding="utf-8")
+    assert reanudar(str(path)) == {"1", "2"}
+    # la línea cortada se recorta para poder seguir agregando
+    assert path.read_text(encoding="utf-8").endswith('"error"}\n')
+    assert reanudar(str(tmp_path / "no_existe.jsonl")) == set()
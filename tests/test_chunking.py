@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from chunking import EstructuraChunker, VentanaChunker, chunker_desde_config
+from rag_index import _offsets_bytes
+
+TEXTO = """# Reglamento de becas
+
+ARTÍCULO 1. Objeto
+La beca de alimentación cubre el almuerzo en los casinos de la universidad. Se renueva cada semestre.
+
+Artículo 2 Requisitos
+El estudiante debe acreditar situación socioeconómica; la postulación se hace en línea.
+¿Qué pasa si reprueba? Pierde el beneficio hasta el próximo período.
+
+CAPÍTULO II
+""" + " ".join(f"palabra{i} ñandú" for i in range(400)) + "\n\nÚltimo párrafo con acentos: canción, pingüino."
+
+
+def _aleatorio(seed: int) -> str:
+    rng = random.Random(seed)
+    partes = []
+    for _ in range(rng.randint(1, 60)):
+        partes.append(rng.choice(["\n", "\n\n", " ", ". ", "# Título\n", "ARTÍCULO 3\n", "Artículo 7 x\n"]))
+        partes.append("".join(rng.choice("abcñáé ") for _ in range(rng.randint(0, 300))))
+    return "".join(partes)
+
+
+def _invariantes(chunker, texto):
+    spans = chunker.spans(texto)
+    for a, b in spans:
+        assert 0 <= a < b <= len(texto)
+        # sin espacios en los bordes ni chunks vacíos
+        assert not texto[a].isspace() and not texto[b - 1].isspace()
+    assert [a for a, _ in spans] == sorted(a for a, _ in spans)
+    return spans
+
+
+@pytest.mark.parametrize("max_tokens", [5, 40, 200])
+def test_estructura_cubre_todo_sin_solapes(max_tokens):
+    ch = EstructuraChunker(max_tokens)
+    for texto in [TEXTO, ""] + [_aleatorio(s) for s in range(30)]:
+        spans = _invariantes(ch, texto)
+        for (_, b), (a2, _) in zip(spans, spans[1:]):
+            assert b <= a2
+        # todo lo que no es espacio queda en algún chunk
+        cubierto = set()
+        for a, b in spans:
+            cubierto.update(range(a, b))
+        assert all(i in cubierto for i, c in enumerate(texto) if not c.isspace())
+
+
+def test_estructura_respeta_el_tamano_y_corta_en_encabezados():
+    ch = EstructuraChunker(40)
+    spans = ch.spans(TEXTO)
+    assert all(b - a <= 40 * 4 for a, b in spans)
+    inicios = {TEXTO[a:b].split("\n", 1)[0] for a, b in spans}
+    assert "Artículo 2 Requisitos" in inicios
+
+
+@pytest.mark.parametrize("tam,overlap", [(50, 0), (80, 20), (300, 120), (10, 9)])
+def test_ventana_avanza_y_solapa_a_lo_sumo_overlap(tam, overlap):
+    ch = VentanaChunker(tam, overlap)
+    for texto in [TEXTO, "x" * 1000] + [_aleatorio(s) for s in range(20)]:
+        spans = _invariantes(ch, texto)
+        assert all(b - a <= tam for a, b in spans)
+        for (a, b), (a2, _) in zip(spans, spans[1:]):
+            assert a2 > a and b - a2 <= overlap
+
+
+@pytest.mark.parametrize("spec", ["ventana:100:150", "ventana:0", "ventana:100:100", "estructura:0", "otro"])
+def test_config_invalida(spec):
+    with pytest.raises(ValueError):
+        chunker_desde_config(spec)
+
+
+def test_config_ida_y_vuelta():
+    for spec in ("estructura:120", "ventana:400:60"):
+        assert chunker_desde_config(spec).config() == spec
+
+
+@pytest.mark.parametrize("texto", [TEXTO, "solo ascii aqui. otra frase.", "ñ" * 50 + " 日本語 " + "é" * 30, ""])
+def test_offsets_en_bytes(texto):
+    data = texto.encode("utf-8")
+    spans = EstructuraChunker(5).spans(texto) + VentanaChunker(30, 10).spans(texto)
+    ini, fin = _offsets_bytes(texto, data, spans)
+    for (a, b), bi, bf in zip(spans, ini.tolist(), fin.tolist()):
+        assert data[bi:bf].decode("utf-8") == texto[a:b]
+
+
+def test_chunk_text_del_indice_coincide_con_los_spans(corpus):
+    import retrieval
+
+    snap = retrieval._snapshot()
+    fuente = snap.source_of(0)
+    with open(f"{retrieval.DATA_DIR}/{fuente}", encoding="utf-8") as f:
+        texto = f.read()
+    esperados = [texto[a:b] for a, b in retrieval.CHUNKER.spans(texto)]
+    propios = [snap.chunk_text(c) for c in range(snap.n_chunks) if snap.source_of(c) == fuente]
+    assert propios == esperados
@@ -0,0 +1,69 @@
+import pytest
+
+import llm_gateway
+from llm_gateway import CircuitBreaker
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    t = [100.0]
+    monkeypatch.setattr(llm_gateway.time, "monotonic", lambda: t[0])
+    return t
+
+
+def test_abre_tras_fallos_seguidos(reloj):
+    cb = CircuitBreaker(fallos=3, reset_s=10)
+    cb.fallo()
+    cb.fallo()
+    cb.exito()
+    cb.fallo()
+    cb.fallo()
+    assert cb.estado == "cerrado" and cb.permitir() == (True, False)
+    cb.fallo()
+    assert cb.estado == "abierto" and cb.abierto() and cb.aperturas == 1
+    assert cb.permitir() == (False, False)
+
+
+def test_semiabierto_deja_una_sola_prueba(reloj):
+    cb = CircuitBreaker(fallos=1, reset_s=10)
+    cb.fallo()
+    reloj[0] += 10
+    assert cb.estado == "semiabierto" and not cb.abierto()
+    assert cb.permitir() == (True, True)
+    assert cb.permitir() == (False, False)
+    cb.exito()
+    assert cb.estado == "cerrado" and cb.permitir() == (True, False)
+
+
+def test_prueba_fallida_reabre(reloj):
+    cb = CircuitBreaker(fallos=2, reset_s=10)
+    cb.fallo()
+    cb.fallo()
+    reloj[0] += 10
+    assert cb.permitir() == (True, True)
+    cb.fallo()
+    assert cb.estado == "abierto" and cb.aperturas == 2
+    reloj[0] += 9
+    assert cb.permitir() == (False, False)
+    reloj[0] += 1
+    assert cb.permitir() == (True, True)
+
+
+def test_fallos_tardios_no_reabren_sin_prueba(reloj):
+    # llamadas que empezaron antes de abrir no alargan la apertura
+    cb = CircuitBreaker(fallos=1, reset_s=10)
+    cb.fallo()
+    reloj[0] += 5
+    cb.fallo()
+    assert cb.aperturas == 1
+    reloj[0] += 5
+    assert cb.estado == "semiabierto"
+
+
+def test_soltar_devuelve_el_turno_de_prueba(reloj):
+    cb = CircuitBreaker(fallos=1, reset_s=10)
+    cb.fallo()
+    reloj[0] += 10
+    assert cb.permitir() == (True, True)
+    cb.soltar()
+    assert cb.permitir() == (True, True)
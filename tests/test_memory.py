@@ -0,0 +1,100 @@
+import pytest
+
+import memory
+from memory import SessionStore
+
+
+class Reloj:
+    def __init__(self):
+        self.t = 1000.0
+
+    def time(self):
+        return self.t
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    r = Reloj()
+    monkeypatch.setattr(memory.time, "time", r.time)
+    return r
+
+
+def _usar(store, sid):
+    mem, lock = store.get(sid)
+    store.soltar(sid)
+    return mem
+
+
+def test_lru_saca_la_menos_usada(reloj):
+    store = SessionStore(max_sessions=2, ttl_s=60)
+    a = _usar(store, "a")
+    _usar(store, "b")
+    assert _usar(store, "a") is a
+    _usar(store, "c")
+    assert len(store) == 2
+    assert _usar(store, "a") is a
+    assert store.stats()["hits"] == 2
+    # "b" salió por LRU: vuelve como sesión nueva
+    _usar(store, "b")
+    assert store.stats()["misses"] == 4
+
+
+def test_ttl_vence_la_sesion(reloj):
+    store = SessionStore(max_sessions=10, ttl_s=60)
+    a = _usar(store, "a")
+    reloj.t += 30
+    assert _usar(store, "a") is a
+    reloj.t += 61
+    assert _usar(store, "a") is not a
+    assert store.stats()["expired"] == 1
+
+
+def test_en_uso_no_sale_ni_vence(reloj):
+    store = SessionStore(max_sessions=1, ttl_s=60)
+    a, _ = store.get("a")
+    b = _usar(store, "b")
+    # las dos estaban en uso durante el get de "b"; en el siguiente sale "b", no "a"
+    assert len(store) == 2
+    _usar(store, "c")
+    assert "b" not in store._data and _usar(store, "a") is a
+    assert _usar(store, "b") is not b
+    store.soltar("a")
+    reloj.t += 120
+    a2, _ = store.get("a")
+    assert a2 is not a
+    # mientras está en uso no vence aunque pase el TTL
+    reloj.t += 120
+    assert store.get("a")[0] is a2
+
+
+def test_respaldo_en_sqlite(reloj, tmp_path):
+    db = str(tmp_path / "sesiones.db")
+    store = SessionStore(max_sessions=1, ttl_s=60, db_path=db)
+    a = _usar(store, "a")
+    a.remember("carrera", "ingeniería")
+    a.add_turn("user", "¿cuándo es el examen?")
+    _usar(store, "b")
+    st = store.stats()
+    assert st["spilled"] == 1 and st["on_disk"] == 1 and st["in_memory"] == 1
+    recargada = _usar(store, "a")
+    assert recargada is not a and recargada.to_dict() == a.to_dict()
+    assert store.stats()["loaded"] == 1
+
+
+def test_respaldo_vencido_no_se_carga(reloj, tmp_path):
+    db = str(tmp_path / "sesiones.db")
+    store = SessionStore(max_sessions=1, ttl_s=60, db_path=db)
+    _usar(store, "a").remember("carrera", "derecho")
+    _usar(store, "b")
+    reloj.t += 61
+    assert _usar(store, "a").fact("carrera") == ""
+    assert store.stats()["expired"] == 1
+
+
+def test_close_vuelca_y_otro_proceso_recupera(reloj, tmp_path):
+    db = str(tmp_path / "sesiones.db")
+    store = SessionStore(max_sessions=10, ttl_s=60, db_path=db)
+    _usar(store, "a").remember("carrera", "medicina")
+    store.close()
+    otro = SessionStore(max_sessions=10, ttl_s=60, db_path=db)
+    assert _usar(otro, "a").fact("carrera") == "medicina"
@@ -0,0 +1,42 @@
+import pytest
+
+import retrieval
+
+HINTS = ["beca", "reglamento", "admin", ""]
+
+
+def _escalar(preguntas, k, hints, scorer):
+    return [retrieval.recuperar_contexto(p, k, h, scorer) for p, h in zip(preguntas, hints)]
+
+
+@pytest.mark.parametrize("scorer", [retrieval.BM25Scorer(), retrieval.ConteoScorer()], ids=lambda s: s.nombre)
+@pytest.mark.parametrize("ruta", ["dispersa", "densa"])
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_batch_igual_a_escalar(corpus, monkeypatch, scorer, ruta, k):
+    # _DENSO = 0 obliga al producto disperso en todos los bloques; uno enorme, a la matriz densa
+    monkeypatch.setattr(retrieval, "_DENSO", 0 if ruta == "dispersa" else 10 ** 9)
+    preguntas = corpus[:120] + ["", "zzzz qqqq", "beca"]
+    hints = [HINTS[i % len(HINTS)] for i in range(len(preguntas))]
+    assert retrieval.recuperar_contexto_batch(preguntas, k, hints, scorer) == _escalar(preguntas, k, hints, scorer)
+
+
+def test_batch_varios_bloques(corpus, monkeypatch):
+    # bloques de pocas filas: el corte entre bloques no debe mezclar preguntas
+    monkeypatch.setattr(retrieval, "_CELDAS_BLOQUE", 7 * retrieval._snapshot().n_chunks)
+    scorer = retrieval.BM25Scorer()
+    preguntas = corpus[:50]
+    hints = [HINTS[i % len(HINTS)] for i in range(len(preguntas))]
+    assert retrieval.recuperar_contexto_batch(preguntas, 3, hints, scorer) == _escalar(preguntas, 3, hints, scorer)
+
+
+def test_batch_sin_hints_y_vacio(corpus):
+    scorer = retrieval.BM25Scorer()
+    assert retrieval.recuperar_contexto_batch(corpus[:10], 3, scorer=scorer) == _escalar(
+        corpus[:10], 3, [""] * 10, scorer)
+    assert retrieval.recuperar_contexto_batch([], 3) == []
+    assert retrieval.recuperar_contexto_batch(corpus[:2], 0) == [[], []]
+
+
+def test_batch_hints_de_otro_largo(corpus):
+    with pytest.raises(ValueError):
+        retrieval.recuperar_contexto_batch(corpus[:3], 3, ["beca"])
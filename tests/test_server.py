@@ -0,0 +1,64 @@
+import itertools
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from server import Admission
+
+_sesiones = itertools.count()
+
+
+def test_admission_limita_workers_mas_cola():
+    adm = Admission(workers=2, queue=1)
+    assert [adm.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert adm.stats() == {"workers": 2, "in_flight": 2, "queued": 1, "admitted": 3, "rejected_429": 1}
+    adm.release()
+    adm.release()
+    assert adm.try_acquire()
+    assert adm.stats() == {"workers": 2, "in_flight": 2, "queued": 0, "admitted": 4, "rejected_429": 1}
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    # sin `with`: no corre el lifespan (no precalienta el índice ni crea el cliente del modelo)
+    monkeypatch.setattr(server, "admission", Admission(workers=1, queue=0))
+    monkeypatch.setattr(server.au, "consultar", lambda pregunta, trace_id, *a: f"eco: {pregunta}")
+    return TestClient(server.app)
+
+
+def _consultar(cliente, pregunta="¿Cuándo cierra la postulación a la beca?"):
+    return cliente.post("/consultar", json={"pregunta": pregunta, "session_id": f"t{next(_sesiones)}"})
+
+
+def test_consultar_admite_y_devuelve_el_cupo(cliente):
+    r = _consultar(cliente)
+    assert r.status_code == 200 and r.json()["respuesta"].startswith("eco: ")
+    st = server.admission.stats()
+    assert st["admitted"] == 1 and st["rejected_429"] == 0 and server.admission.in_system == 0
+
+
+def test_consultar_429_con_el_servidor_saturado(cliente):
+    assert server.admission.try_acquire()
+    r = _consultar(cliente)
+    assert r.status_code == 429
+    st = server.admission.stats()
+    assert st["rejected_429"] == 1 and st["admitted"] == 1 and server.admission.in_system == 1
+    server.admission.release()
+    assert _consultar(cliente).status_code == 200
+
+
+def test_pregunta_invalida_no_toma_cupo(cliente):
+    r = _consultar(cliente, "")
+    assert r.status_code == 400
+    assert server.admission.stats()["admitted"] == 0 and server.admission.rejected == 0
+
+
+def test_error_en_el_pool_devuelve_el_cupo(cliente, monkeypatch):
+    def falla(*a):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(server.au, "consultar", falla)
+    with pytest.raises(ValueError):
+        _consultar(cliente)
+    assert server.admission.in_system == 0
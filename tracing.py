@@ -0,0 +1,241 @@
+"""
+Trazas por spans, compartidas por todo el agente.
+
+    with span("retrieval", domain="beca") as s:
+        ...
+        s.set(chunks=3)
+
+El span actual vive en un ContextVar: un span nuevo toma el trace y el padre
+de ahí, también dentro de tareas asyncio (que heredan el contexto). Para
+correr trabajo en un pool de hilos hay que enviar la función envuelta con
+`bind`, que captura el contexto de quien la envía. Las latencias salen de
+perf_counter. Al cerrarse, cada span se exporta como un registro plano del
+log (ver log_pipeline.py) con 'stage' = nombre del span.
+"""
+import os
+import time
+import uuid
+import random
+import threading
+import contextvars
+import functools
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_pipeline import LogPipeline
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("span_actual", default=None)
+_pipeline: Optional[LogPipeline] = None
+_pipeline_lock = threading.Lock()
+_exporter: Optional[Callable[[Dict[str, Any]], Any]] = None
+_listeners: List[Callable[["Span", Optional[BaseException]], Any]] = []
+
+# ids de span sin syscall por span; se resiembra tras un fork para no repetir secuencias
+_rng = random.Random()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_rng.seed)
+
+
+def get_pipeline() -> LogPipeline:
+    """Pipeline de logs del proceso; se crea en el primer registro."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline(
+                os.getenv("LOG_PATH", "logs/agent.log"),
+                max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+                batch_size=int(os.getenv("LOG_BATCH_SIZE", "256")),
+                flush_interval_s=float(os.getenv("LOG_FLUSH_SECONDS", "0.5")),
+                max_bytes=int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+                backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+                policy=os.getenv("LOG_FULL_POLICY", "drop"),
+            )
+        return _pipeline
+
+
+def set_exporter(fn: Optional[Callable[[Dict[str, Any]], Any]]) -> None:
+    """Reemplaza el destino de los registros (None vuelve al pipeline de logs)."""
+    global _exporter
+    _exporter = fn
+
+
+def add_listener(fn: Callable[["Span", Optional[BaseException]], Any]) -> None:
+    """Registra `fn(span, error)`, que se llama al cerrar cada span (p. ej. métricas)."""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def usage_tokens(resp: Any) -> Tuple[int, int, int]:
+    """(prompt, completion, total) del `usage` de una respuesta, sea objeto o dict; 0 si no viene."""
+    usage = resp.get("usage") if isinstance(resp, dict) else getattr(resp, "usage", None)
+    if not usage:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        get = usage.get
+    else:
+        get = lambda k: getattr(usage, k, None)
+    prompt = int(get("prompt_tokens") or 0)
+    completion = int(get("completion_tokens") or 0)
+    return prompt, completion, int(get("total_tokens") or (prompt + completion))
+
+
+def new_trace_id() -> str:
+    return str(uuid.uuid4())
+
+
+def new_span_id() -> str:
+    return "%08x" % _rng.getrandbits(32)
+
+
+def log_event(
+    trace_id: str,
+    span_id: str,
+    parent_span_id: Optional[str],
+    role: str,
+    message: str,
+    latency_ms: Optional[float] = None,
+    tokens_used: Optional[int] = None,
+    tool: Optional[str] = None,
+    ttft_ms: Optional[float] = None,
+    **fields: Any,
+) -> None:
+    """
+    Un registro del log. tokens_used/latency_ms/ttft_ms en None se escriben
+    como 0 para que el dashboard pueda sumar sin limpiar.
+    """
+    rec = {
+        "levelname": "INFO",
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_span_id": parent_span_id or "",
+        "role": role,
+        "message": message,
+        "tool": tool,
+        "latency_ms": latency_ms or 0,
+        "ttft_ms": ttft_ms or 0,
+        "tokens_used": int(tokens_used) if tokens_used is not None else 0,
+    }
+    if fields:
+        rec.update(fields)
+    (_exporter or get_pipeline().emit)(rec)
+
+
+class Span:
+    """
+    Tramo con duración. Sin trace_id explícito hereda el del span actual (o
+    abre un trace nuevo). Los atributos pasados a `set` van al registro; si
+    sale con excepción se registra con role 'system' y el error.
+    """
+
+    __slots__ = ("name", "role", "trace_id", "span_id", "parent_id", "attrs", "latency_ms", "_ts", "_t0", "_token")
+
+    def __init__(self, name: str, role: str = "system", trace_id: Optional[str] = None,
+                 parent_id: Optional[str] = None, **attrs: Any):
+        padre = _current.get()
+        if padre is not None:
+            if trace_id is None:
+                trace_id = padre.trace_id
+            if parent_id is None and trace_id == padre.trace_id:
+                parent_id = padre.span_id
+        self.name = name
+        self.role = role
+        self.trace_id = trace_id or new_trace_id()
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.latency_ms = 0.0
+
+    def set(self, **attrs: Any) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self) -> "Span":
+        self._ts = time.time()
+        self._token = _current.set(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.latency_ms = (time.perf_counter() - self._t0) * 1000
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # generador cerrado desde otro contexto (p. ej. el recolector)
+            pass
+        if _listeners:
+            for fn in _listeners:
+                try:
+                    fn(self, exc)
+                except Exception:
+                    pass
+        attrs = self.attrs
+        role, message = self.role, attrs.pop("message", self.name)
+        if exc_type is GeneratorExit:
+            role, message = "system", f"{self.name}_cancelled"
+        elif exc is not None:
+            role, message = "system", f"{self.name}_error: {exc}"
+        log_event(self.trace_id, self.span_id, self.parent_id, role, message,
+                  latency_ms=self.latency_ms, stage=self.name, ts=self._ts, **attrs)
+        return False
+
+
+def span(name: str, role: str = "system", trace_id: Optional[str] = None,
+         parent_id: Optional[str] = None, **attrs: Any) -> Span:
+    return Span(name, role, trace_id, parent_id, **attrs)
+
+
+def event(role: str, message: str, **fields: Any) -> None:
+    """Registro puntual (sin duración) colgado del span actual."""
+    padre = _current.get()
+    if padre is None:
+        log_event(new_trace_id(), new_span_id(), None, role, message, **fields)
+    else:
+        log_event(padre.trace_id, new_span_id(), padre.span_id, role, message, **fields)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    s = _current.get()
+    return s.trace_id if s is not None else None
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Envuelve `fn` para que corra con una copia del contexto actual (spans
+    incluidos); usar al enviar trabajo a un pool de hilos. Cada llamada a
+    bind hace su propia copia: un mismo contexto no puede correr en dos
+    hilos a la vez.
+    """
+    return partial(contextvars.copy_context().run, fn)
+
+
+def instrument(fn: Optional[Callable] = None, *, stage: Optional[str] = None, **attrs: Any):
+    """
+    Decorador: corre la función dentro de un span (stage = nombre de la
+    función si no se indica), de modo que queda en el log y, con
+    observability importado, en las métricas.
+    Si lo que devuelve trae `usage`, registra los tokens.
+
+        @instrument
+        def f(...): ...
+
+        @instrument(stage="fusion", model="gpt-4o")
+        def g(...): ...
+    """
+    def deco(f: Callable) -> Callable:
+        nombre = stage or f.__name__
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(nombre, **attrs) as sp:
+                resp = f(*args, **kwargs)
+                prompt, completion, total = usage_tokens(resp)
+                if total:
+                    sp.set(prompt_tokens=prompt, completion_tokens=completion, tokens_used=total)
+                return resp
+        return wrapper
+
+    return deco(fn) if fn is not None else deco